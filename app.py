@@ -1,620 +1,974 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
 import dash
-from dash import dcc, html, Input, Output, State
+from dash import dcc, html, Input, Output, State, ClientsideFunction
 import plotly.graph_objs as go
 import pandas as pd
-from cyvcf2 import VCF
-import re
-import numpy as np
-
-import requests, sys
-import json
-import requests
-import sys
-import json
 
-TARGET_GENE = "SCN1A"
+import flask
+
+import clinvar_refresh
+import gene_index
+import metrics
+import overlays
+import plotting
+import score_summary
+import store
+from cache import LRUCache
+from figure_cache import FigureCache, source_digest
+from gene_index import VariantIndex
+from metadata import load_metadata, dataset_versions, field_description
+from metrics import (LATENCY, RESPONSE_BYTES, RequestProfiler, current_trace, end_trace, log_event,
+                     prometheus_text, record_error, start_trace)
+from startup import StartupTasks
+from plotting import build_figure_parts, build_score_panels, gnomad_client_data
+from score_summary import ScoreSummary, describe_variant
+from variants import COUNT_FIELDS, SCORE_FIELDS, load_gene_coord, parse_vcf_row
+from vep import VepClient, hgvs_gene, vep_to_vcf_row, ENSEMBL_SERVER
+from export import EXPORT_FORMATS, export_filename, export_parts, stream_export
+from local_scores import LocalScorer, local_vcf_row, parse_variant_string, score_vcf_row
+from overlays import build_tracks, load_domain_table
+
+TARGET_GENE = "SCN1A"  # gene displayed when the app opens, others can be selected in the UI
 variant = "NM_001165963.4(SCN1A):c.1060G>C"
 
 VCF_FILE = "/path/to/gnomad_ms.fully_annotated.vcf.gz"
 CLINVAR_VCF = "/path/to/clinvar_plp_ms.fully_annotated.vcf.gz"
 GENE_COORD = "/path/to/gene_coord.csv.gz"
-
-# first, the gene coordinates
-gene_coord = pd.read_csv(GENE_COORD, compression='gzip')
-conv_chroms = [str(i) for i in range(1, 23)] + ['X', 'Y', 'MT']
-
-# Now filter only those rows that have a non conventional chromosome
-gene_coord = gene_coord[gene_coord['Chromosome/scaffold name'].isin(conv_chroms)]
-
-server = "https://rest.ensembl.org"
-# Added fields parameter to ensure we get gene_symbol for all transcripts
-ext = "/vep/human/hgvs/" + variant + "?mane=1&canonical=1&REVEL=1&AlphaMissense=1&CADD=1&vcf_string=1&fields=transcript_consequences"
-
-r = requests.get(server + ext, headers={"Content-Type": "application/json"})
-
-if not r.ok:
-    r.raise_for_status()
-    sys.exit()
-
-decoded = r.json()
-
-# The response is a list with one element
-data = decoded[0]
-
-# Get ID from colocated variants if available
-rsid = data.get('colocated_variants', [{}])[0].get('id', '.')
-
-if data.get('vcf_string'):
-    # Split the string by the hyphen and unpack the parts.
-    chrom, pos, ref, alt = data['vcf_string'].split('-')
-else:
-    # Fallback if vcf_string is not present in the API response.
-    print("Warning: 'vcf_string' not found in the API result. Unable to determine REF/ALT.")
-    ref, alt = None, None
-
-qual = '.'
-filter_col = '.'
-
-# --- 2. Construct INFO Field ---
-info_parts = []
-
-# a) Build BCSQ tag
-bcsq_entries = []
-genomic_change = f"{pos}{ref}>{alt}"
-
-for tc in data.get('transcript_consequences', []):
-    gene = tc.get('gene_symbol', '.')
-    transcript_id = tc.get('transcript_id', '.')
-    biotype = tc.get('biotype', '.')
-
-    is_protein_altering = 'amino_acids' in tc
-
-    for term in tc.get('consequence_terms', []):
-        base_entry = f"{term}|{gene}|{transcript_id}|{biotype}"
-        if term == "missense_variant":
-            base_entry = f"missense|{gene}|{transcript_id}|{biotype}"
-
-        if is_protein_altering:
-            strand = '+' if tc.get('strand') == 1 else '-'
-            aa_pos = tc.get('protein_start')
-            ref_aa, alt_aa = tc.get('amino_acids', '/').split('/')
-            protein_change = f"{aa_pos}{ref_aa}>{aa_pos}{alt_aa}"
-            full_entry = f"{base_entry}|{strand}|{protein_change}|{genomic_change}"
-            bcsq_entries.append(full_entry)
-        else:
-            bcsq_entries.append(base_entry)
-
-if bcsq_entries:
-    info_parts.append("BCSQ=" + ",".join(bcsq_entries))
-
-# b) Add other scores using smarter logic
-
-def get_best_score(transcript_consequences, score_key, target_gene):
+# Ensembl VEP server and persistent cache of its responses (None to disable the cache)
+VEP_SERVER = ENSEMBL_SERVER
+VEP_CACHE = "vep_cache.sqlite"
+# Offline scoring of the custom variant (see local_scores.py): its scores are
+# looked up in the annotated VCFs above and in these bgzipped, tabix-indexed
+# score tables, and replace the VEP ones (MPC, MISTIC and popEVE included).
+# `variant` can then also be given as chrom-pos-ref-alt ("2-166000000-C-G"),
+# resolved without any network call (the variant must be in one of the VCFs).
+LOCAL_SCORES = True
+LOCAL_SCORE_TABLES = []
+# Optional per-gene store built with `python store.py compile` (None to always parse the VCFs)
+STORE_DIR = None
+# New ClinVar releases are applied without a restart (see clinvar_refresh.py):
+# the release manifest (None: <STORE_DIR>/_metadata/clinvar_release.json) is
+# checked at most every CLINVAR_RELEASE_POLL_SECONDS (None to never check)
+CLINVAR_RELEASE_MANIFEST = None
+CLINVAR_RELEASE_POLL_SECONDS = 30
+
+# Instrumentation (see metrics.py): Prometheus metrics are served at /metrics.
+# REQUEST_LOG prints one line per request with its timing spans and response
+# size (JSON lines with STRUCTURED_LOGS). With PROFILE_DIR set, single requests
+# are profiled (PROFILER: 'cprofile' or 'pyinstrument') and dumped there: a
+# PROFILE_SAMPLE_RATE fraction of them, plus those sent with the header
+# "X-Profile: 1" or the query parameter profile=1
+REQUEST_LOG = False
+STRUCTURED_LOGS = False
+PROFILE_DIR = None
+PROFILE_SAMPLE_RATE = 0.0
+PROFILER = 'cprofile'
+
+# Overlays of the plots (see overlays.py): protein domains read from
+# DOMAINS_FILE (a TSV of transcript, start, end and name, e.g. an Ensembl
+# BioMart export of "Transcript stable ID, Pfam ID, Pfam start, Pfam end"; None
+# for no domains) and missense-depleted regions computed from the variants
+OVERLAYS = True
+DOMAINS_FILE = None
+
+# Plot rendering: WebGL above this many points; in density mode, a binned
+# heatmap above this many gnomAD points in view
+WEBGL_POINT_THRESHOLD = 20000
+DENSITY_POINT_LIMIT = 5000
+
+# Bounds of the per-gene data cache (entry count and approximate memory bytes)
+GENE_CACHE_MAX_ENTRIES = 8
+GENE_CACHE_MAX_BYTES = 2 * 1024**3
+# Cache of the plot callback outputs (see figure_cache.py), keyed on the plot
+# inputs and the version of the gene data; its memory is bounded like the gene
+# cache. FIGURE_CACHE_DIR shares it between the workers and across restarts
+# (None to keep it in memory only), pruned above FIGURE_CACHE_DIR_MAX_BYTES.
+CACHE_FIGURES = True
+FIGURE_CACHE_MAX_ENTRIES = 256
+FIGURE_CACHE_MAX_BYTES = 512 * 1024**2
+FIGURE_CACHE_DIR = None
+FIGURE_CACHE_DIR_MAX_BYTES = 4 * 1024**3
+
+# Genes loaded at startup in addition to TARGET_GENE. With gunicorn --preload
+# (see wsgi.py) they are loaded once and shared by all the workers.
+PRELOAD_GENES = []
+# Dash dev tools and reloader, for `python app.py` only
+DEBUG = False
+# Serve right away and load the data in background threads (`python app.py`);
+# wsgi.py loads in the foreground, before gunicorn forks its workers
+BACKGROUND_STARTUP = True
+
+# Filled by load_data() (nothing is read at import time)
+gene_coord = None
+VCF_ROW_STRING, vcf_string = None, "unavailable"  # vcf_string is displayed in the legend
+# Header metadata of the gnomAD and ClinVar VCFs (see metadata.py)
+DATASET_METADATA = {'gnomad': None, 'clinvar': None}
+STORE_GENES, ALL_GENES = [], []
+# Protein domains of every transcript (overlays.DomainTable), and the stamp of their file
+DOMAINS, DOMAINS_STAMP = None, None
+# ClinVar release manifest applied (see check_clinvar_release)
+CLINVAR_RELEASE = None
+_release_checked_at = float('-inf')
+_RELEASE_LOCK = threading.Lock()
+
+# Startup tasks, their progress is shown in the UI and served at /readyz
+STARTUP = StartupTasks()
+# Tasks that must have succeeded before the app is ready to serve plots
+REQUIRED_TASKS = ('gene_index', 'default_gene')
+
+def resolve_custom_variant():
     """
-    Finds the best score from a list of transcript consequences.
-    
-    Logic:
-    1. Collect all available scores for the given score_key.
-    2. If there's only one unique score value, return it.
-    3. If there are multiple, return the one associated with the target_gene.
-    4. If none are found, or none match the target gene in a conflict, return None.
+    Resolve the custom variant: a chrom-pos-ref-alt variant from the local
+    sources only, an HGVS notation with Ensembl VEP (cached on disk, see
+    vep.py), then scored from the local sources when LOCAL_SCORES is set.
     """
-    scores_with_genes = []
-    for tc in transcript_consequences:
-        if score_key in tc:
-            scores_with_genes.append({
-                'gene': tc.get('gene_symbol'),
-                'score': tc[score_key]
-            })
-
-    if not scores_with_genes:
-        return None
-
-    # Use a string representation for uniqueness check, handles dicts like AlphaMissense
-    unique_scores_str = {json.dumps(s['score']) for s in scores_with_genes}
-
-    if len(unique_scores_str) == 1:
-        return scores_with_genes[0]['score']
+    global VCF_ROW_STRING, vcf_string
+    if parse_variant_string(variant) is not None:
+        score_locally(variant)
+        return
+    vep_client = VepClient(server=VEP_SERVER, cache_path=VEP_CACHE)
+    try:
+        vep_result = vep_client.annotate_one(variant)
+        if vep_result is None:
+            print(f"WARNING: VEP could not annotate {variant}. The custom variant will not be displayed.")
+        else:
+            VCF_ROW_STRING, vcf_string = vep_to_vcf_row(vep_result, hgvs_gene(variant) or TARGET_GENE)
+            vcf_string = vcf_string or "unavailable"
+    except Exception as e:
+        print(f"WARNING: VEP annotation of {variant} failed ({e}). The custom variant will not be displayed.")
+    finally:
+        # No connection or SQLite handle is kept open across a worker fork
+        vep_client.close()
+    if LOCAL_SCORES and VCF_ROW_STRING:
+        score_locally(variant)
+
+def local_scorer():
+    """LocalScorer of the annotated VCFs found and LOCAL_SCORE_TABLES."""
+    return LocalScorer([path for path in (VCF_FILE, CLINVAR_VCF) if os.path.exists(path)], LOCAL_SCORE_TABLES)
+
+def score_locally(variant):
+    """Build (chrom-pos-ref-alt variant) or rescore (VEP row) VCF_ROW_STRING from the local sources."""
+    global VCF_ROW_STRING, vcf_string
+    t0 = time.perf_counter()
+    try:
+        scorer = local_scorer()
+    except Exception as e:
+        print(f"WARNING: local scoring unavailable ({e}).")
+        return
+    try:
+        if VCF_ROW_STRING:
+            VCF_ROW_STRING, found = score_vcf_row(scorer, VCF_ROW_STRING)
+        else:
+            VCF_ROW_STRING, local_string = local_vcf_row(scorer, variant)
+            vcf_string = local_string or "unavailable"
+            found = VCF_ROW_STRING is not None
+    finally:
+        # No file handle is kept open across a worker fork
+        scorer.close()
+    elapsed = (time.perf_counter() - t0) * 1000
+    if found:
+        print(f"Scored {variant} from the local sources in {elapsed:.0f} ms")
+    elif VCF_ROW_STRING:
+        print(f"INFO: {variant} is not in the local sources, keeping the VEP scores.")
     else:
-        # Conflict: multiple different scores exist. Prioritize the target gene.
-        for item in scores_with_genes:
-            if item['gene'] == target_gene:
-                return item['score']
-    
-    # Fallback if multiple scores exist but none match the target gene
-    return None
-
-all_tcs = data.get('transcript_consequences', [])
-
-cadd_score = get_best_score(all_tcs, 'cadd_phred', TARGET_GENE)
-if cadd_score is not None:
-    info_parts.append(f"cadd_v1.7={cadd_score}")
-
-revel_score = get_best_score(all_tcs, 'revel', TARGET_GENE)
-if revel_score is not None:
-    info_parts.append(f"REVEL={revel_score}")
-
-am_score = get_best_score(all_tcs, 'alphamissense', TARGET_GENE)
-if am_score is not None:
-    info_parts.append(f"am_pathogenicity={am_score.get('am_pathogenicity', '.')}")
-    info_parts.append(f"am_class={am_score.get('am_class', '.')}")
-
-info_string = ";".join(info_parts)
+        print(f"WARNING: {variant} is not in the local VCFs. The custom variant will not be displayed.")
+
+def load_domains():
+    """Protein domain table of the overlays (DOMAINS_FILE)."""
+    global DOMAINS, DOMAINS_STAMP
+    if not DOMAINS_FILE:
+        return
+    DOMAINS = load_domain_table(DOMAINS_FILE)
+    DOMAINS_STAMP = store.data_stamp(None, None, 'domains', DOMAINS_FILE)
+    print(f"Loaded {len(DOMAINS)} protein domains from {DOMAINS_FILE}")
+
+def load_dataset_metadata():
+    """Header metadata of both VCFs (date, versions, INFO fields), cached in the store."""
+    for source, vcf_file in [('gnomad', VCF_FILE), ('clinvar', CLINVAR_VCF)]:
+        DATASET_METADATA[source] = load_metadata(vcf_file, source, STORE_DIR)
+        if DATASET_METADATA[source] is None:
+            print(f"INFO: no header metadata for {source} (VCF not found at '{vcf_file}').")
+
+def gene_stamps(gene_symbol):
+    """
+    Identity of the data of a gene per source: the store partition or VCF it
+    is loaded from (path, size, mtime), and the custom variant row.
+    """
+    stamps = {source: store.data_stamp(STORE_DIR, gene_symbol, source, vcf_file)
+              for source, vcf_file in [('gnomad', VCF_FILE), ('clinvar', CLINVAR_VCF)]}
+    stamps['custom'] = VCF_ROW_STRING
+    stamps['domains'] = DOMAINS_STAMP
+    return stamps
+
+def data_version(stamps):
+    """Short version token of gene_stamps (part of the figure cache keys)."""
+    return hashlib.sha1(json.dumps(stamps, sort_keys=True).encode()).hexdigest()[:16]
+
+def clinvar_manifest():
+    """Path of the ClinVar release manifest polled by the app, or None."""
+    if CLINVAR_RELEASE_MANIFEST:
+        return CLINVAR_RELEASE_MANIFEST
+    return clinvar_refresh.manifest_path(STORE_DIR) if STORE_DIR else None
+
+def check_clinvar_release():
+    """
+    Switch to a new ClinVar release when the manifest (clinvar_refresh.py)
+    names one, checked at most every CLINVAR_RELEASE_POLL_SECONDS. The switch
+    only replaces CLINVAR_RELEASE, CLINVAR_VCF and the ClinVar metadata; the
+    cached genes follow at their next view (get_gene).
+    """
+    global CLINVAR_RELEASE, CLINVAR_VCF, _release_checked_at
+    path = clinvar_manifest()
+    if not path or CLINVAR_RELEASE_POLL_SECONDS is None:
+        return
+    if time.monotonic() - _release_checked_at < CLINVAR_RELEASE_POLL_SECONDS:
+        return
+    if not _RELEASE_LOCK.acquire(blocking=False):
+        return  # another thread is checking
+    try:
+        _release_checked_at = time.monotonic()
+        release = clinvar_refresh.read_manifest(path)
+        if release is None or release == CLINVAR_RELEASE:
+            return
+        if not os.path.exists(release['vcf']):
+            print(f"WARNING: ClinVar release {release['vcf']} not found, keeping {CLINVAR_VCF}")
+            return
+        metadata = load_metadata(release['vcf'], 'clinvar', STORE_DIR)
+        CLINVAR_RELEASE = release
+        if os.path.abspath(CLINVAR_VCF) != release['vcf']:
+            CLINVAR_VCF = release['vcf']
+            DATASET_METADATA['clinvar'] = metadata
+            log_event('clinvar_release', f"Switched to the ClinVar release {release['file_date']} "
+                                         f"({CLINVAR_VCF}, {len(release['changed_genes'])} genes changed)",
+                      vcf=CLINVAR_VCF, file_date=release['file_date'], changed_genes=len(release['changed_genes']))
+    finally:
+        _RELEASE_LOCK.release()
+
+def load_gene_data(vcf_file, source, gene_symbol):
+    """
+    Load a gene from the compiled store if available, otherwise parse the VCF region.
+    """
+    return store.load_or_parse(STORE_DIR, gene_symbol, source, vcf_file, gene_coord)
 
-# --- 3. Assemble Final VCF Row ---
-vcf_row = "\t".join(map(str, [chrom, pos, rsid, ref, alt, qual, filter_col, info_string]))
+def load_clinvar(gene_symbol):
+    """ClinVar variants of a gene (an empty DataFrame when unavailable)."""
+    try:
+        print(f"Loading ClinVar variants from {CLINVAR_VCF}...")
+        clinvar_data = load_gene_data(CLINVAR_VCF, 'clinvar', gene_symbol)
+        print(f"Loaded {len(clinvar_data)} ClinVar {gene_symbol} variants")
+    except FileNotFoundError:
+        print(f"INFO: ClinVar VCF file not found at '{CLINVAR_VCF}'. Skipping.")
+        clinvar_data = pd.DataFrame()
+    except Exception as e:
+        record_error('load.clinvar', e)
+        clinvar_data = pd.DataFrame()
+    return clinvar_data
 
-VCF_ROW_STRING = vcf_row
-vcf_string = data['vcf_string'] # define vcf-string, to be displayed in the legend
+@LATENCY.timed('gene_load')
+def load_gene(gene_symbol):
+    """
+    Load the gnomAD, ClinVar and custom variant data of one gene.
+    Returns a dict with the three DataFrames and the sorted transcript list.
+    """
+    # Taken before reading, so that files replaced during the load are seen as changed
+    stamps = gene_stamps(gene_symbol)
+    # Load gnomAD data
+    try:
+        print(f"Loading gnomAD variants from {VCF_FILE}...")
+        gnomad_data = load_gene_data(VCF_FILE, 'gnomad', gene_symbol)
+        print(f"Loaded {len(gnomad_data)} gnomAD {gene_symbol} variants")
+    except FileNotFoundError:
+        print(f"ERROR: gnomAD VCF file not found at '{VCF_FILE}'.")
+        gnomad_data = pd.DataFrame()
+    except Exception as e:
+        record_error('load.gnomad', e)
+        gnomad_data = pd.DataFrame()
 
-# get the date of the clinvar vcf file, as written in the header, to be displayed in the legend
-import gzip
-with gzip.open(CLINVAR_VCF, 'rt') as f:
-    for line in f:
-        if line.startswith('##fileDate='):
-            clinvar_date = line.strip().split('=')[1]
-            break
+    # Load ClinVar data (optional, always displayed when available)
+    clinvar_data = load_clinvar(gene_symbol)
 
-# Initialize the Dash app
-app = dash.Dash(__name__)
+    # Parse custom variant row (optional, displayed when it hits this gene)
+    STARTUP.wait('vep')
+    STARTUP.wait('domains')
+    stamps.update(custom=VCF_ROW_STRING, domains=DOMAINS_STAMP)
+    try:
+        custom_data = parse_vcf_row(VCF_ROW_STRING, gene_symbol) if VCF_ROW_STRING else pd.DataFrame()
+        if not custom_data.empty:
+            print(f"Loaded custom variant for {gene_symbol}")
+    except Exception as e:
+        record_error('load.custom', e)
+        custom_data = pd.DataFrame()
 
-def get_gene_coordinates(gene_coord_df, gene_symbol):
+    if gnomad_data.empty:
+        print(f"WARNING: No gnomAD variants found for {gene_symbol}! The plot will be empty.")
+        transcripts = []
+    else:
+        transcripts = sorted(gnomad_data['transcript'].unique().tolist())
+        print(f"Found {len(transcripts)} transcripts: {transcripts}")
+
+    # Index the tables once so that callbacks only slice them
+    with LATENCY.span('index_build'):
+        gene_data = {
+            'gene': gene_symbol,
+            'gnomad': VariantIndex(gnomad_data),
+            'clinvar': VariantIndex(clinvar_data),
+            'custom': VariantIndex(custom_data),
+            'transcripts': transcripts,
+            'stamps': stamps,
+            'version': data_version(stamps),
+        }
+    # Footprint of the parsed tables and of their compact form (see compact_variants)
+    for source, raw in (('gnomad', gnomad_data), ('clinvar', clinvar_data)):
+        if not raw.empty:
+            before = raw.memory_usage(deep=True).sum()
+            after = gene_data[source].frame.memory_usage(deep=True).sum()
+            print(f"{gene_symbol} {source} table: {before / 1e6:.1f} MB as loaded, {after / 1e6:.1f} MB compact")
+    # Score distributions, precomputed in the store for compiled genes
+    with LATENCY.span('summary_build'):
+        gene_data['summary'] = {
+            source: store.load_summary(STORE_DIR, gene_symbol, source)
+            or ScoreSummary.from_index(gene_data[source])
+            for source in ('gnomad', 'clinvar')
+        }
+    # Domain and constraint tracks of every transcript, drawn by the figures as is
+    with LATENCY.span('overlay_build'):
+        gene_data['overlays'] = build_tracks(gene_data['gnomad'], gene_data['clinvar'], DOMAINS)
+    return gene_data
+
+# Genes are loaded on demand and kept in a bounded LRU cache
+GENE_CACHE = LRUCache(max_entries=GENE_CACHE_MAX_ENTRIES, max_bytes=GENE_CACHE_MAX_BYTES,
+                      name='gene-cache')
+
+FIGURE_CACHE = FigureCache(max_entries=FIGURE_CACHE_MAX_ENTRIES, max_bytes=FIGURE_CACHE_MAX_BYTES,
+                           cache_dir=FIGURE_CACHE_DIR, dir_max_bytes=FIGURE_CACHE_DIR_MAX_BYTES)
+# Figures built by another version of the plotting code are never served
+FIGURE_CODE_VERSION = source_digest(__file__, plotting.__file__, score_summary.__file__, gene_index.__file__,
+                                    overlays.__file__)
+
+def get_gene(gene_symbol):
     """
-    Get chromosome and coordinates for a specific gene
+    Return the cached data of a gene, loading it on a cache miss. When the
+    files it was loaded from have changed since (e.g. a new ClinVar release),
+    the cached data is refreshed (refresh_gene).
     """
-    gene_info = gene_coord_df[gene_coord_df['HGNC symbol'] == gene_symbol]
-    if gene_info.empty:
-        raise ValueError(f"Gene {gene_symbol} not found in gene_coord dataframe")
-    gene_info = gene_info.iloc[0]
-    chrom = str(gene_info['Chromosome/scaffold name'])
-    start = int(gene_info['Gene start (bp)'])
-    end = int(gene_info['Gene end (bp)'])
-    return chrom, start, end
-
-def to_float(value):
-    """Safely convert a value to float, returning np.nan on failure."""
-    if value is None:
-        return np.nan
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return np.nan
-
-def parse_info_field(info_str):
-    """Parses a VCF INFO string into a dictionary."""
-    info_dict = {}
-    for item in info_str.split(';'):
-        if '=' in item:
-            key, value = item.split('=', 1)
-            info_dict[key] = value
-        else:
-            info_dict[item] = True
-    return info_dict
-
-def parse_variant_record(variant, gene_symbol, source_type="vcf"):
+    check_clinvar_release()
+    gene_data = GENE_CACHE.get_or_load(gene_symbol, lambda: load_gene(gene_symbol))
+    stamps = gene_stamps(gene_symbol)
+    if stamps != gene_data['stamps']:
+        gene_data = refresh_gene(gene_data, stamps)
+    return gene_data
+
+def refresh_gene(gene_data, stamps):
     """
-    Helper function to parse a single variant record (from cyvcf2 or a dictionary).
-    Returns a list of variant data dictionaries (one for each relevant transcript).
+    Refresh a cached gene whose files changed. When only ClinVar changed, the
+    gnomAD and custom indexes are kept: the ClinVar rows are reloaded, or only
+    restamped when the current release (CLINVAR_RELEASE) replaced the one they
+    were loaded from without changing this gene. Anything else is reloaded.
+    The new gene data replaces the old in one cache update.
     """
-    parsed_variants = []
-    
-    if source_type == "vcf":  # From cyvcf2
-        info_dict = variant.INFO
-        chrom, pos, ref, alt = variant.CHROM, variant.POS, variant.REF, ','.join(variant.ALT)
-    else:  # From our custom row parser
-        info_dict = variant  # The dict itself is the info
-        chrom, pos, ref, alt = variant['chrom'], variant['pos'], variant['ref'], variant['alt']
-    
-    bcsq_string = info_dict.get('BCSQ')
-    if bcsq_string is None:
-        return []
-    
-    for entry in bcsq_string.split(','):
-        fields = entry.split('|')
-        if len(fields) < 6:
-            continue
-        
-        consequence, entry_gene, entry_transcript, biotype, strand, aa_change = fields[0:6]
-        
-        if consequence != 'missense' or entry_gene != gene_symbol or not aa_change:
-            continue
-        
-        match = re.match(r'(\d+)', aa_change)
-        if not match:
-            continue
-        
-        aa_position = int(match.group(1))
-        
-        variant_data = {
-            'chrom': chrom, 'pos': pos, 'ref': ref, 'alt': alt,
-            'gene': entry_gene, 'transcript': entry_transcript, 'biotype': biotype,
-            'aa_position': aa_position, 'aa_change': aa_change,
-            'AC_joint': info_dict.get('AC_joint', 0),
-            'AC_genomes': info_dict.get('AC_genomes', 0),
-            'nhomalt_joint': info_dict.get('nhomalt_joint', 0),
-            'nhomalt_genomes': info_dict.get('nhomalt_genomes', 0),
-            'REVEL': info_dict.get('REVEL'),
-            'am_pathogenicity': info_dict.get('am_pathogenicity'),
-            'cadd_v1.7': info_dict.get('cadd_v1.7'),
-            'MPC': info_dict.get('MPC'),
-            # === NEW SCORES ADDED ===
-            'MISTIC_score': info_dict.get('MISTIC_score'),
-            'MISTIC_pred': info_dict.get('MISTIC_pred'),
-            'popEVE': info_dict.get('popEVE')
-        }
-        parsed_variants.append(variant_data)
-    
-    return parsed_variants
-
-def parse_gene_variants_region(vcf_file, gene_coord_df, gene_symbol):
+    gene_symbol = gene_data['gene']
+    changed = {source for source in stamps if stamps[source] != gene_data['stamps'].get(source)}
+    if changed != {'clinvar'}:
+        print(f"{gene_symbol}: {', '.join(sorted(changed))} data changed since it was loaded, reloading")
+        GENE_CACHE.invalidate(gene_symbol)
+        return GENE_CACHE.get_or_load(gene_symbol, lambda: load_gene(gene_symbol))
+    release = CLINVAR_RELEASE
+    refreshed = dict(gene_data, stamps=stamps, version=data_version(stamps))
+    if (release is not None and gene_data['stamps']['clinvar'] == release['previous_stamp']
+            and stamps['clinvar'] == release['stamp'] and gene_symbol not in release['changed_genes']):
+        print(f"{gene_symbol}: unchanged in the ClinVar release {release['file_date']}")
+    else:
+        with LATENCY.span('clinvar_refresh'):
+            clinvar = VariantIndex(load_clinvar(gene_symbol))
+            summary = store.load_summary(STORE_DIR, gene_symbol, 'clinvar') or ScoreSummary.from_index(clinvar)
+            tracks = build_tracks(gene_data['gnomad'], clinvar, DOMAINS)
+        refreshed.update(clinvar=clinvar, summary=dict(gene_data['summary'], clinvar=summary), overlays=tracks)
+        print(f"{gene_symbol}: ClinVar rows refreshed ({len(clinvar.frame)} variants)")
+    GENE_CACHE.put(gene_symbol, refreshed)
+    return refreshed
+
+def cached_figure(gene_data, inputs, build):
     """
-    Parse VCF file for a specific gene using coordinates.
+    Output of build() cached on the plot inputs, the gene data version and the
+    rendering settings (see figure_cache.py).
     """
-    print(f"Looking up {gene_symbol} coordinates...")
-    chrom, start, end = get_gene_coordinates(gene_coord_df, gene_symbol)
-    print(f"Found {gene_symbol} at {chrom}:{start}-{end}")
-    print(f"Querying VCF region in {vcf_file}...")
-    
-    variants = []
-    vcf = VCF(vcf_file)
-    region = f"{chrom}:{start}-{end}"
-    
-    for variant in vcf(region):
-        variants.extend(parse_variant_record(variant, gene_symbol, source_type="vcf"))
-    
-    print(f"Found {len(variants)} {gene_symbol} missense variants in {vcf_file}")
-    return pd.DataFrame(variants)
+    if not CACHE_FIGURES:
+        return build()
+    key = (gene_data['version'], FIGURE_CODE_VERSION, WEBGL_POINT_THRESHOLD, DENSITY_POINT_LIMIT,
+           OVERLAYS) + tuple(inputs)
+    return FIGURE_CACHE.get_or_build(key, build)
+
+def overlay_of(gene_data, transcript):
+    """Precomputed overlay track of a transcript, None when OVERLAYS is off."""
+    return gene_data['overlays'].get(transcript) if OVERLAYS else None
+
+def load_gene_index():
+    """Gene coordinates and the symbols offered in the gene selector."""
+    global gene_coord, STORE_GENES, ALL_GENES
+    # first, the gene coordinates (only conventional chromosomes are kept)
+    gene_coord = load_gene_coord(GENE_COORD)
+    # Symbols offered in the gene selector: compiled genes first, then every HGNC symbol
+    STORE_GENES = store.list_genes(STORE_DIR)
+    ALL_GENES = STORE_GENES + sorted(set(gene_coord.symbols()) - set(STORE_GENES))
+
+def load_default_genes():
+    """Load the default gene so the first page view is served from cache, then PRELOAD_GENES."""
+    get_gene(TARGET_GENE)
+    for gene_symbol in PRELOAD_GENES:
+        get_gene(gene_symbol)
+
+def load_data(background=False):
+    """
+    Load what the app serves: gene coordinates, custom variant, ClinVar date
+    and the default/preloaded genes. VEP, the ClinVar header and the gene
+    loading run concurrently (the custom variant of a gene waits for VEP).
+    In background mode this returns at once and the progress is in STARTUP.
+    In the foreground (gunicorn --preload) it runs once in the master process;
+    the workers fork afterwards and share the loaded arrays copy-on-write
+    (genes from the store are memory-mapped, so later loads share the page
+    cache too).
+    """
+    STARTUP.start(background)
+    STARTUP.submit('vep', resolve_custom_variant)
+    STARTUP.submit('metadata', load_dataset_metadata)
+    STARTUP.submit('domains', load_domains)
+    STARTUP.submit('gene_index', load_gene_index)
+    STARTUP.submit('default_gene', load_default_genes, after=('gene_index',))
+
+def is_ready():
+    """True once the gene index and the default gene are loaded."""
+    return STARTUP.succeeded(REQUIRED_TASKS)
+
+def route_label(request):
+    """
+    Metrics label of a request: the output of a Dash callback, else the URL
+    rule of the endpoint (e.g. /export/<gene>, not one label per gene).
+    """
+    if request.path.endswith('/_dash-update-component'):
+        # Dash callbacks are named after their (first) output
+        body = request.get_json(silent=True) or {}
+        return body.get('output', request.path).strip('.').split('...')[0]
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
 
-def parse_vcf_row(vcf_row_string, gene_symbol):
+def create_app(background=None):
     """
-    Parses a single tab-separated VCF row string.
+    Start loading the data and build the Dash app. Used by `python app.py` and
+    by the production entry point wsgi.py. background defaults to BACKGROUND_STARTUP.
     """
-    try:
-        print("Parsing custom VCF row string...")
-        fields = vcf_row_string.strip().split('\t')
-        if len(fields) < 8:
-            print("Warning: Custom VCF row is malformed. Skipping.")
-            return pd.DataFrame()
-        
-        chrom, pos, _, ref, alt, _, _, info_str = fields[0:8]
-        info_dict = parse_info_field(info_str)
-        
-        # Add required fields for the parser
-        info_dict['chrom'] = chrom
-        info_dict['pos'] = int(pos)
-        info_dict['ref'] = ref
-        info_dict['alt'] = alt
-        
-        parsed_variants = parse_variant_record(info_dict, gene_symbol, source_type="dict")
-        print(f"Found {len(parsed_variants)} missense variants in custom row.")
-        return pd.DataFrame(parsed_variants)
-    except Exception as e:
-        print(f"Error parsing custom VCF row: {e}")
-        return pd.DataFrame()
-
-# --- Load all data at startup ---
-# Load gnomAD data
-try:
-    print(f"Loading gnomAD variants from {VCF_FILE}...")
-    GNOMAD_DATA = parse_gene_variants_region(VCF_FILE, gene_coord, TARGET_GENE)
-    print(f"Loaded {len(GNOMAD_DATA)} gnomAD {TARGET_GENE} variants")
-except FileNotFoundError:
-    print(f"ERROR: gnomAD VCF file not found at '{VCF_FILE}'. App cannot start.")
-    exit()
-except Exception as e:
-    print(f"An error occurred loading gnomAD VCF: {e}")
-    GNOMAD_DATA = pd.DataFrame()
-
-# Load ClinVar data (optional, always displayed when available)
-try:
-    print(f"Loading ClinVar variants from {CLINVAR_VCF}...")
-    CLINVAR_DATA = parse_gene_variants_region(CLINVAR_VCF, gene_coord, TARGET_GENE)
-    print(f"Loaded {len(CLINVAR_DATA)} ClinVar {TARGET_GENE} variants")
-except FileNotFoundError:
-    print(f"INFO: ClinVar VCF file not found at '{CLINVAR_VCF}'. Skipping.")
-    CLINVAR_DATA = pd.DataFrame()
-except Exception as e:
-    print(f"An error occurred loading ClinVar VCF: {e}")
-    CLINVAR_DATA = pd.DataFrame()
-
-# Parse custom variant row (optional, always displayed when available)
-try:
-    CUSTOM_VARIANT_DATA = parse_vcf_row(VCF_ROW_STRING, TARGET_GENE)
-    if not CUSTOM_VARIANT_DATA.empty:
-        print(f"Loaded custom variant for {TARGET_GENE}")
-except Exception as e:
-    print(f"An error occurred parsing custom variant row: {e}")
-    CUSTOM_VARIANT_DATA = pd.DataFrame()
-
-if GNOMAD_DATA.empty:
-    print("WARNING: No gnomAD variants found! The plot will be empty.")
-    TRANSCRIPTS = []
-else:
-    TRANSCRIPTS = sorted(GNOMAD_DATA['transcript'].unique().tolist())
-    print(f"Found {len(TRANSCRIPTS)} transcripts: {TRANSCRIPTS}")
+    load_data(BACKGROUND_STARTUP if background is None else background)
+    app = dash.Dash(__name__)
+    # A function, so that a page loaded after startup shows the loaded values
+    app.layout = serve_layout
+
+    @app.server.after_request
+    def record_first_byte(response):
+        STARTUP.record_first_byte()
+        return response
+
+    metrics.STRUCTURED_LOGS = STRUCTURED_LOGS
+    profiler = RequestProfiler(PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILER) if PROFILE_DIR else None
+
+    @app.server.before_request
+    def start_request_trace():
+        """Collect the spans of the request (and profile it when asked)."""
+        request = flask.request
+        flask.g.trace_token = start_trace(route=route_label(request), method=request.method, t0=time.perf_counter())
+        forced = request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+        flask.g.profiler = profiler.start(forced) if profiler is not None else None
+
+    @app.server.after_request
+    def measure_response(response):
+        """Response size and, for Dash callbacks, the time spent outside the callback."""
+        trace = current_trace()
+        if trace is not None:
+            trace['status'] = response.status_code
+            trace['seconds'] = time.perf_counter() - trace['t0']
+            # Streamed responses (exports) record their size when the last chunk is out
+            if not response.is_streamed:
+                trace['bytes'] = response.calculate_content_length()
+                RESPONSE_BYTES.observe(trace['route'], trace['bytes'] or 0)
+            if 'callback_seconds' in trace:
+                # Dash dispatch and JSON encoding of the callback output
+                LATENCY.record('serialization', max(trace['seconds'] - trace['callback_seconds'], 0.0))
+        return response
+
+    @app.server.teardown_request
+    def finish_request_trace(error):
+        """Log the request with its spans, write its profile."""
+        token = flask.g.pop('trace_token', None)
+        if token is None:
+            return
+        trace = end_trace(token)
+        seconds = trace.get('seconds', time.perf_counter() - trace['t0'])
+        if error is not None:
+            trace['status'] = 500
+            record_error(f"request {trace['route']}", error)
+        running = flask.g.pop('profiler', None)
+        profile = profiler.stop(running, trace['route'], seconds) if running is not None else None
+        if REQUEST_LOG and trace['route'] != '/metrics':
+            spans = {name: round(value * 1000, 2) for name, value in trace['spans'].items()}
+            log_event('request', f"{trace['method']} {trace['route']} {trace.get('status')} "
+                                 f"{seconds * 1000:.0f} ms {trace.get('bytes')} B {spans}"
+                                 + (f" profile {profile}" if profile else ""),
+                      route=trace['route'], method=trace['method'], status=trace.get('status'),
+                      ms=round(seconds * 1000, 2), bytes=trace.get('bytes'), spans_ms=spans, profile=profile)
+
+    @app.server.route('/healthz')
+    def healthz():
+        """Liveness: the server answers (data may still be loading). Also names the ClinVar release served."""
+        clinvar = {'vcf': CLINVAR_VCF, 'file_date': (DATASET_METADATA['clinvar'] or {}).get('file_date')}
+        return flask.jsonify(dict(status='ok', clinvar=clinvar, **STARTUP.timings()))
+
+    @app.server.route('/readyz')
+    def readyz():
+        """Readiness: 200 once the gene index and the default gene are loaded, 503 before."""
+        ready = is_ready()
+        body = dict(ready=ready, tasks=STARTUP.progress(), **STARTUP.timings())
+        return flask.jsonify(body), 200 if ready else 503
+
+    @app.server.route('/cache-stats')
+    def cache_stats():
+        """Hits, misses, evictions and size of the gene and figure caches, to help sizing them."""
+        return flask.jsonify(dict(GENE_CACHE.stats(), figure_cache=FIGURE_CACHE.stats()))
+
+    @app.server.route('/callback-latency')
+    def callback_latency():
+        """p50/p95/p99 wall time of the recent callback calls."""
+        return flask.jsonify(LATENCY.summary())
+
+    @app.server.route('/metrics')
+    def prometheus_metrics():
+        """Span histograms, response sizes, errors and cache state, in the Prometheus text format."""
+        stats = GENE_CACHE.stats()
+        figures = FIGURE_CACHE.stats()
+        gauges = {
+            'ready': ("1 once the gene index and the default gene are loaded", int(is_ready())),
+            'uptime_seconds': ("Seconds since the process start", STARTUP.timings()['uptime_s']),
+            'gene_cache_entries': ("Genes in the gene cache", stats['entries']),
+            'gene_cache_bytes': ("Approximate memory of the gene cache", stats['bytes']),
+            'figure_cache_entries': ("Plot outputs in the in-process figure cache", figures['entries']),
+            'figure_cache_bytes': ("JSON bytes of the in-process figure cache", figures['bytes']),
+        }
+        counters = {
+            'gene_cache_hits': ("Gene cache hits", stats['hits']),
+            'gene_cache_misses': ("Gene cache misses (gene loads)", stats['misses']),
+            'gene_cache_evictions': ("Gene cache evictions", stats['evictions']),
+            'figure_cache_hits': ("Plot outputs served from memory", figures['hits']),
+            'figure_cache_disk_hits': ("Plot outputs read from FIGURE_CACHE_DIR", figures['disk_hits']),
+            'figure_cache_builds': ("Plot outputs built", figures['builds']),
+        }
+        return flask.Response(prometheus_text(gauges, counters), mimetype='text/plain; version=0.0.4')
+
+    @app.server.route('/export/<gene>')
+    def export(gene):
+        """
+        Rows of a gene as CSV, Parquet or Arrow IPC, streamed in chunks (see
+        export.py). Query: format, transcript, score, threshold_field, threshold_value.
+        """
+        args = flask.request.args
+        fmt = args.get('format', 'csv')
+        transcript, score = args.get('transcript') or None, args.get('score') or None
+        threshold_field = args.get('threshold_field') or None
+        if fmt not in EXPORT_FORMATS:
+            return flask.jsonify(error=f"format must be one of {', '.join(EXPORT_FORMATS)}"), 400
+        if score is not None and score not in SCORE_FIELDS:
+            return flask.jsonify(error=f"unknown score {score}"), 400
+        if threshold_field is not None and threshold_field not in COUNT_FIELDS:
+            return flask.jsonify(error=f"unknown threshold field {threshold_field}"), 400
+        try:
+            threshold_value = float(args.get('threshold_value') or 0)
+        except ValueError:
+            return flask.jsonify(error="threshold_value must be a number"), 400
+        if not is_ready() or gene not in ALL_GENES:
+            return flask.jsonify(error=f"unknown gene {gene}"), 503 if not is_ready() else 404
+        gene_data = get_gene(gene)
+        if transcript is not None and transcript not in gene_data['transcripts']:
+            return flask.jsonify(error=f"no transcript {transcript} in {gene}"), 404
+
+        parts = export_parts(gene_data, gene, transcript, score, threshold_field, threshold_value)
+        filename = export_filename(gene, transcript, score, fmt)
+        chunks = stream_export(parts, fmt, route=route_label(flask.request))
+        return flask.Response(flask.stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt][0],
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+    return app
+
+def startup_message():
+    """One line per unfinished or failed startup task."""
+    labels = {'vep': "Resolving the custom variant with VEP", 'metadata': "Reading the VCF headers",
+              'gene_index': "Loading the gene coordinates", 'domains': "Reading the protein domains",
+              'default_gene': f"Loading {TARGET_GENE} variants"}
+    lines = []
+    for task in STARTUP.progress():
+        label = labels.get(task['name'], task['name'])
+        if task['status'] == 'failed':
+            lines.append(html.Li(f"{label}: failed ({task['error']})", style={'color': 'darkred'}))
+        elif task['status'] != 'done':
+            lines.append(html.Li(f"{label}... ({task['status']})"))
+    return lines
+
+def legend_variant():
+    return " Your Variant: (hg38) " + vcf_string
+
+def legend_clinvar():
+    clinvar_date = (DATASET_METADATA['clinvar'] or {}).get('file_date') or "unknown"
+    return " ClinVar P/LP Variants (date: " + clinvar_date + ")"
+
+def legend_gnomad():
+    versions = dataset_versions(DATASET_METADATA['gnomad'])
+    if not versions:
+        return " gnomADv4.1 Variants"
+    return " gnomAD Variants (" + ", ".join(f"{k}: {v}" for k, v in versions.items()) + ")"
+
+def legend_scores():
+    """Score definitions from the gnomAD VCF header (they carry the score versions)."""
+    descriptions = [f"{score}: {field_description(DATASET_METADATA['gnomad'], score)}"
+                    for score in SCORE_FIELDS if field_description(DATASET_METADATA['gnomad'], score)]
+    return " Scores: " + "; ".join(descriptions) if descriptions else ""
 
 # App layout
-app.layout = html.Div([
-    html.H1(f"missense-visual of {TARGET_GENE}", 
-            style={'textAlign': 'center', 'marginBottom': 30}),
+def serve_layout():
+    """Page layout (evaluated at each page load, so it shows the data loaded so far)."""
+    return html.Div([
+        html.H1(f"missense-visual of {TARGET_GENE}", id='title',
+                style={'textAlign': 'center', 'marginBottom': 30}),
     
-    html.Div([
+        # Startup progress, polled until every startup task is finished
         html.Div([
-            html.Label("Select Transcript:", style={'fontWeight': 'bold'}),
-            dcc.Dropdown(
-                id='transcript-dropdown',
-                options=[{'label': t, 'value': t} for t in TRANSCRIPTS],
-                value=TRANSCRIPTS[0] if TRANSCRIPTS else None,
-                style={'width': '100%'}
-            )
-        ], style={'width': '30%', 'display': 'inline-block', 'marginRight': '2%'}),
-        
+            html.B("Starting up:"),
+            html.Ul(id='startup-tasks', children=startup_message()),
+        ], id='startup-status', style={'marginBottom': 20, 'padding': '10px', 'backgroundColor': '#fff4e0',
+                                       'borderRadius': '5px', 'display': 'none' if STARTUP.finished() else 'block'}),
+        dcc.Interval(id='startup-interval', interval=500, disabled=STARTUP.finished()),
+        dcc.Store(id='data-ready', data=is_ready()),
+    
         html.Div([
-            html.Label("Pathogenicity Score:", style={'fontWeight': 'bold'}),
+            html.Label("Gene:", style={'fontWeight': 'bold'}),
             dcc.Dropdown(
-                id='score-dropdown',
-                options=[
-                    {'label': 'REVEL', 'value': 'REVEL'},
-                    {'label': 'AlphaMissense', 'value': 'am_pathogenicity'},
-                    {'label': 'CADD v1.7', 'value': 'cadd_v1.7'},
-                    {'label': 'MPC2', 'value': 'MPC'},
-                    # === NEW SCORES ADDED TO DROPDOWN ===
-                    {'label': 'MISTIC', 'value': 'MISTIC_score'},
-                    {'label': 'popEVE', 'value': 'popEVE'}
-                ],
-                value='REVEL',
+                id='gene-dropdown',
+                options=[{'label': TARGET_GENE, 'value': TARGET_GENE}],
+                value=TARGET_GENE,
+                clearable=False,
                 style={'width': '100%'}
             )
-        ], style={'width': '30%', 'display': 'inline-block', 'marginRight': '2%'}),
+        ], style={'width': '30%', 'marginBottom': 20}),
+    
+        html.Div([
+            html.Div([
+                html.Label("Select Transcript:", style={'fontWeight': 'bold'}),
+                dcc.Dropdown(
+                    id='transcript-dropdown',
+                    options=[],
+                    value=None,
+                    style={'width': '100%'}
+                )
+            ], style={'width': '30%', 'display': 'inline-block', 'marginRight': '2%'}),
         
+            html.Div([
+                html.Label("Pathogenicity Score:", style={'fontWeight': 'bold'}),
+                dcc.Dropdown(
+                    id='score-dropdown',
+                    options=[
+                        {'label': 'REVEL', 'value': 'REVEL'},
+                        {'label': 'AlphaMissense', 'value': 'am_pathogenicity'},
+                        {'label': 'CADD v1.7', 'value': 'cadd_v1.7'},
+                        {'label': 'MPC2', 'value': 'MPC'},
+                        # === NEW SCORES ADDED TO DROPDOWN ===
+                        {'label': 'MISTIC', 'value': 'MISTIC_score'},
+                        {'label': 'popEVE', 'value': 'popEVE'}
+                    ],
+                    value='REVEL',
+                    style={'width': '100%'}
+                )
+            ], style={'width': '30%', 'display': 'inline-block', 'marginRight': '2%'}),
+        
+            html.Div([
+                html.Label("gnomAD Filter Field:", style={'fontWeight': 'bold'}),
+                dcc.Dropdown(
+                    id='threshold-field-dropdown',
+                    options=[
+                        {'label': 'Allele Count (Exomes + Genomes)', 'value': 'AC_joint'},
+                        {'label': 'Allele Count (Genomes)', 'value': 'AC_genomes'},
+                        {'label': 'Homozygous Count (Exomes + Genomes)', 'value': 'nhomalt_joint'},
+                        {'label': 'Homozygous Count (Genomes)', 'value': 'nhomalt_genomes'}
+                    ],
+                    value='AC_genomes',
+                    style={'width': '100%'}
+                )
+            ], style={'width': '30%', 'display': 'inline-block'}),
+        ], style={'marginBottom': 20}),
+    
         html.Div([
-            html.Label("gnomAD Filter Field:", style={'fontWeight': 'bold'}),
-            dcc.Dropdown(
-                id='threshold-field-dropdown',
-                options=[
-                    {'label': 'Allele Count (Exomes + Genomes)', 'value': 'AC_joint'},
-                    {'label': 'Allele Count (Genomes)', 'value': 'AC_genomes'},
-                    {'label': 'Homozygous Count (Exomes + Genomes)', 'value': 'nhomalt_joint'},
-                    {'label': 'Homozygous Count (Genomes)', 'value': 'nhomalt_genomes'}
-                ],
-                value='AC_genomes',
-                style={'width': '100%'}
+            html.Label("gnomAD Filter Threshold (show variants with count > this value):", 
+                       style={'fontWeight': 'bold'}),
+            dcc.Input(
+                id='threshold-value',
+                type='number',
+                value=0,
+                min=0,
+                step=1,
+                style={'width': '200px', 'marginLeft': '10px'}
+            ),
+            html.Span(" (Set to 0 to show all gnomAD variants)", 
+                      style={'marginLeft': '10px', 'fontStyle': 'italic', 'color': '#666'}),
+            dcc.Checklist(
+                id='density-mode',
+                options=[{'label': ' Density view for large genes (zoom in to see individual variants)',
+                          'value': 'density'}],
+                value=[],
+                style={'display': 'inline-block', 'marginLeft': '30px'}
             )
-        ], style={'width': '30%', 'display': 'inline-block'}),
-    ], style={'marginBottom': 20}),
+        ], style={'marginBottom': 20}),
     
-    html.Div([
-        html.Label("gnomAD Filter Threshold (show variants with count > this value):", 
-                   style={'fontWeight': 'bold'}),
-        dcc.Input(
-            id='threshold-value',
-            type='number',
-            value=0,
-            min=0,
-            step=1,
-            style={'width': '200px', 'marginLeft': '10px'}
-        ),
-        html.Span(" (Set to 0 to show all gnomAD variants)", 
-                  style={'marginLeft': '10px', 'fontStyle': 'italic', 'color': '#666'})
-    ], style={'marginBottom': 30}),
+        html.Div([
+            html.Label("View:", style={'fontWeight': 'bold'}),
+            dcc.RadioItems(
+                id='view-mode',
+                options=[{'label': ' Selected score', 'value': 'single'},
+                         {'label': ' All scores (one panel per score)', 'value': 'panels'}],
+                value='single',
+                inline=True,
+                inputStyle={'marginLeft': '15px'},
+                style={'display': 'inline-block'}
+            )
+        ], style={'marginBottom': 30}),
     
-    html.Div(id='info-display', 
-             style={'marginBottom': 20, 'padding': '10px', 
-                    'backgroundColor': '#f0f0f0', 'borderRadius': '5px'}),
+        html.Div(id='info-display', 
+                 style={'marginBottom': 20, 'padding': '10px', 
+                        'backgroundColor': '#f0f0f0', 'borderRadius': '5px'}),
+        # Download of the displayed rows (the /export endpoint)
+        html.Div(id='export-links', style={'marginBottom': 20}),
     
-    dcc.Graph(id='pathogenicity-plot', style={'height': '600px'}),
+        # Height set by the figure (one row of panels per two scores in the all-scores view)
+        dcc.Graph(id='pathogenicity-plot'),
+        # Figure and unfiltered gnomAD points of the transcript, filtered in the browser
+        dcc.Store(id='plot-data'),
+        # Threshold sent to the server, only in density mode (filtered server-side)
+        dcc.Store(id='server-threshold'),
     
-    html.Div([
-        html.H3("Legend:", style={'marginTop': 5}),
-        html.Ul([
-            html.Li([html.Span("★", style={'color': 'gold', 'fontSize': '20px'}), 
-                    " Your Variant: (hg38) "+ vcf_string]),
-            html.Li([html.Span("◆", style={'color': 'darkred', 'fontSize': '20px'}), 
-                    " ClinVar P/LP Variants (date: " + clinvar_date + ")"]),
-            html.Li([html.Span("●", style={'color': '#17BECF', 'fontSize': '20px'}), 
-                    " gnomADv4.1 Variants"])
-        ])
-    ], style={'marginTop': 5, 'padding': '10px', 'backgroundColor': '#f9f9f9', 
-              'borderRadius': '5px'})
-])
-
-def create_hover_text(df, score_column):
-    """Helper function to create hover text"""
-    hover_text = []
-    for _, row in df.iterrows():
-        # Safely get values with defaults
-        score_val = row.get(score_column)
-        score_str = f"{float(score_val):.3f}" if pd.notna(score_val) else 'N/A'
-        
-        # === ENHANCED HOVER TEXT FOR NEW SCORES ===
-        text = (
-            f"<b>Change:</b> {row.get('aa_change', 'N/A')}<br>"
-            f"<b>Variant:</b> {row.get('chrom', '')}:{row.get('pos', '')} "
-            f"{row.get('ref', '')}>{row.get('alt', '')}<br>"
-            f"<b>{score_column}:</b> {score_str}<br>"
-        )
-        
-        # Add MISTIC prediction if available and relevant
-        if 'MISTIC_pred' in row and pd.notna(row.get('MISTIC_pred')) and score_column == 'MISTIC_score':
-            text += f"<b>MISTIC_pred:</b> {row['MISTIC_pred']}<br>"
-        
-        text += (
-            f"<b>AC_genomes:</b> {row.get('AC_genomes', 0)}<br>"
-            f"<b>AC_joint:</b> {row.get('AC_joint', 0)}<br>"
-            f"<b>nhomalt_genomes:</b> {row.get('nhomalt_genomes', 0)}<br>"
-            f"<b>nhomalt_joint:</b> {row.get('nhomalt_joint', 0)}"
-        )
-        hover_text.append(text)
-    return hover_text
-
-@app.callback(
-    Output('pathogenicity-plot', 'figure'),
-    Output('info-display', 'children'),
+        html.Div([
+            html.H3("Legend:", style={'marginTop': 5}),
+            html.Ul([
+                html.Li([html.Span("★", style={'color': 'gold', 'fontSize': '20px'}), 
+                        html.Span(legend_variant(), id='legend-variant')]),
+                html.Li([html.Span("◆", style={'color': 'darkred', 'fontSize': '20px'}), 
+                        html.Span(legend_clinvar(), id='legend-clinvar')]),
+                html.Li([html.Span("●", style={'color': '#17BECF', 'fontSize': '20px'}), 
+                        html.Span(legend_gnomad(), id='legend-gnomad')]),
+                html.Li([html.Span("▮", style={'color': '#1f77b4', 'opacity': 0.4, 'fontSize': '20px'}),
+                         html.Span(" Shaded bands: protein domains (named at the top); bottom strip: "
+                                   "missense-depleted regions in gnomAD (orange), red where ClinVar P/LP "
+                                   "variants are also dense")]) if OVERLAYS else None,
+                html.Li(legend_scores(), id='legend-scores', style={'listStyleType': 'none'})
+            ])
+        ], style={'marginTop': 5, 'padding': '10px', 'backgroundColor': '#f9f9f9', 
+                  'borderRadius': '5px'})
+    ])
+
+_NO_X_CHANGE = object()
+
+def x_range_from_relayout(relayout):
+    """
+    Zoomed aa_position range from a relayoutData event: (start, end), None when
+    the x axis was reset (autorange), or _NO_X_CHANGE if the event is not about x.
+    """
+    relayout = relayout or {}
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        return float(relayout['xaxis.range[0]']), float(relayout['xaxis.range[1]'])
+    if 'xaxis.range' in relayout:
+        return float(relayout['xaxis.range'][0]), float(relayout['xaxis.range'][1])
+    if relayout.get('xaxis.autorange'):
+        return None
+    return _NO_X_CHANGE
+
+@dash.callback(
+    Output('gene-dropdown', 'options'),
+    Input('gene-dropdown', 'search_value'),
+    State('gene-dropdown', 'value')
+)
+def update_gene_options(search_value, gene):
+    """Offer matching gene symbols as the user types (the full list is too long to ship)."""
+    if not search_value or gene_coord is None:
+        return [{'label': gene, 'value': gene}] if gene else []
+    search = search_value.upper()
+    matches = [g for g in ALL_GENES if g.upper().startswith(search)][:50]
+    options = [{'label': g, 'value': g} for g in matches]
+    # Gene names, aliases and Ensembl IDs resolve to their symbol (the label
+    # keeps the search text, so the dropdown does not filter the option out)
+    resolved = gene_coord.resolve(search_value)
+    if resolved and resolved not in matches:
+        options.insert(0, {'label': f"{resolved} ({search_value.strip()})", 'value': resolved})
+    return options
+
+@dash.callback(
+    Output('startup-tasks', 'children'),
+    Output('startup-status', 'style'),
+    Output('startup-interval', 'disabled'),
+    Output('data-ready', 'data'),
+    Output('legend-variant', 'children'),
+    Output('legend-clinvar', 'children'),
+    Output('legend-gnomad', 'children'),
+    Output('legend-scores', 'children'),
+    Input('startup-interval', 'n_intervals'),
+    State('data-ready', 'data'),
+    State('startup-status', 'style')
+)
+def update_startup_status(n_intervals, data_ready, style):
+    """Show the startup progress; flag the data as ready for the other callbacks."""
+    finished = STARTUP.finished()
+    ready = is_ready()
+    style = dict(style or {}, display='none' if finished and ready else 'block')
+    return (startup_message(), style, finished,
+            ready if ready != data_ready else dash.no_update,
+            legend_variant(), legend_clinvar(), legend_gnomad(), legend_scores())
+
+@dash.callback(
+    Output('transcript-dropdown', 'options'),
+    Output('transcript-dropdown', 'value'),
+    Output('title', 'children'),
+    Input('gene-dropdown', 'value'),
+    Input('data-ready', 'data')
+)
+def update_gene(gene, data_ready):
+    """Load the selected gene (from cache when possible) and list its transcripts."""
+    if not gene:
+        return [], None, "missense-visual"
+    if not data_ready:
+        return [], None, f"missense-visual of {gene} (loading...)"
+    transcripts = get_gene(gene)['transcripts']
+    options = [{'label': t, 'value': t} for t in transcripts]
+    return options, transcripts[0] if transcripts else None, f"missense-visual of {gene}"
+
+@dash.callback(
+    Output('plot-data', 'data'),
+    Input('gene-dropdown', 'value'),
     Input('transcript-dropdown', 'value'),
     Input('score-dropdown', 'value'),
-    Input('threshold-field-dropdown', 'value'),
-    Input('threshold-value', 'value')
+    Input('density-mode', 'value'),
+    Input('view-mode', 'value'),
+    Input('pathogenicity-plot', 'relayoutData'),
+    Input('server-threshold', 'data'),
+    State('threshold-field-dropdown', 'value'),
+    State('threshold-value', 'value')
 )
-def update_plot(transcript, score, threshold_field, threshold_value):
-    if not transcript or not score:
-        return go.Figure(), "Please select a transcript and pathogenicity score"
-    
-    # Create figure
-    fig = go.Figure()
-    info_parts = []
-    
-    # Trace 1: gnomAD data (filtered dynamically by user)
-    try:
-        # Convert threshold_value to numeric, default to 0 if None
-        threshold_val = float(threshold_value) if threshold_value is not None else 0
-        
-        # Filter gnomAD data
-        gnomad_filtered = GNOMAD_DATA[
-            (GNOMAD_DATA['transcript'] == transcript) &
-            (GNOMAD_DATA[score].notna())
-        ].copy()
-        
-        # Apply threshold filter
-        if not gnomad_filtered.empty and threshold_field in gnomad_filtered.columns:
-            # Convert threshold field to numeric
-            gnomad_filtered[threshold_field] = pd.to_numeric(gnomad_filtered[threshold_field], errors='coerce')
-            gnomad_filtered = gnomad_filtered[gnomad_filtered[threshold_field] > threshold_val]
-        
-        if not gnomad_filtered.empty:
-            gnomad_filtered = gnomad_filtered.sort_values('aa_position')
-            
-            # Create color scale based on threshold field
-            color_values = gnomad_filtered[threshold_field].astype(float).replace(0, 1e-9)
-            log_color = np.log10(color_values)
-            
-            fig.add_trace(go.Scatter(
-                x=gnomad_filtered['aa_position'],
-                y=gnomad_filtered[score],
-                mode='markers',
-                name='gnomAD Variants',
-                marker=dict(
-                    size=8,
-                    color=log_color,
-                    colorscale='GnBu',
-                    showscale=True,
-                    colorbar=dict(
-                        title=f"{threshold_field}",
-                        x=1,
-                        thickness=12
-                    ),
-                    line=dict(width=1, color='LightGray')
-                ),
-                text=create_hover_text(gnomad_filtered, score),
-                hoverinfo='text',
-                hovertemplate='%{text}<extra></extra>'
-            ))
-            fig.update_traces(
-                marker_colorbar=dict(
-                    tickvals=np.log10([1, 10, 100, 1000, 10000]),
-                    ticktext=['1', '10', '100', '1000', '10000']
-            )
-    )
-            info_parts.append(f"{len(gnomad_filtered)} gnomAD variants (filtered: {threshold_field} > {threshold_val})")
-        else:
-            info_parts.append(f"No gnomAD variants with {threshold_field} > {threshold_val}")
-    except Exception as e:
-        print(f"Error processing gnomAD data: {e}")
-        info_parts.append(f"Error loading gnomAD variants: {str(e)}")
-    
-    # Trace 2: ClinVar data (ALWAYS displayed when available for the transcript)
-    if not CLINVAR_DATA.empty:
-        try:
-            clinvar_filtered = CLINVAR_DATA[
-                (CLINVAR_DATA['transcript'] == transcript) &
-                (CLINVAR_DATA[score].notna())
-            ].copy()
-            
-            if not clinvar_filtered.empty:
-                fig.add_trace(go.Scatter(
-                    x=clinvar_filtered['aa_position'],
-                    y=clinvar_filtered[score],
-                    mode='markers',
-                    name='ClinVar P/LP',
-                    marker=dict(
-                        color='darkred', 
-                        size=7,
-                        symbol='diamond',
-                        opacity=0.7 # make them a little transparent
-                    ),
-                    text=create_hover_text(clinvar_filtered, score),
-                    hoverinfo='text',
-                    hovertemplate='%{text}<extra></extra>'
-                ))
-                info_parts.append(f"{len(clinvar_filtered)} ClinVar P/LP variants")
-        except Exception as e:
-            print(f"Error processing ClinVar data: {e}")
-            info_parts.append(f"Error loading ClinVar variants: {str(e)}")
-    
-    # Trace 3: Custom Variant (ALWAYS displayed when available for the transcript)
-    if not CUSTOM_VARIANT_DATA.empty:
-        try:
-            custom_filtered = CUSTOM_VARIANT_DATA[
-                (CUSTOM_VARIANT_DATA['transcript'] == transcript) &
-                (CUSTOM_VARIANT_DATA[score].notna())
-            ].copy()
-            
-            if not custom_filtered.empty:
-                fig.add_trace(go.Scatter(
-                    x=custom_filtered['aa_position'],
-                    y=custom_filtered[score],
-                    mode='markers',
-                    name='Custom Variant',
-                    marker=dict(
-                        color='gold',
-                        size=16,
-                        symbol='star',
-                        line=dict(width=1, color='white')
-                    ),
-                    text=create_hover_text(custom_filtered, score),
-                    hoverinfo='text',
-                    hovertemplate='%{text}<extra></extra>'
-                ))
-                info_parts.append(f"1 custom variant")
-        except Exception as e:
-            print(f"Error processing custom variant data: {e}")
-            info_parts.append(f"Error loading custom variant: {str(e)}")
-    
-    # Update layout
-    fig.update_layout(
-#        title=dict(
-#            text=f"<b>{TARGET_GENE} Missense Variants - {transcript} | Score: {score}</b><br>",
-#            x=0.5,
-#            xanchor='center'
-#        ),
-        xaxis=dict(
-            title="<b>Amino Acid Position</b>",
-            gridcolor='lightgray'
-        ),
-        yaxis=dict(
-            title=f"<b>{score} Score</b>",
-            gridcolor='lightgray'
-        ),
-        hovermode='closest',
-        plot_bgcolor='white',
-        height=600,
-        showlegend=False,
-        font=dict(size=12),
-#        margin=dict(r=150)  # Extra margin for colorbar
-    )
+@LATENCY.timed('update_plot', callback=True, ignore=(dash.exceptions.PreventUpdate,))
+def update_plot(gene, transcript, score, density_mode, view_mode, relayout, server_threshold,
+                threshold_field, threshold_value):
+    """
+    Build the figure of a transcript and score, or of all its scores (one panel
+    each) in the all-scores view. Outside density mode the gnomAD points are
+    sent unfiltered and the threshold is applied in the browser
+    (assets/threshold_filter.js), so threshold changes never reach the server.
+    Outputs are cached (cached_figure), except for zoomed density views.
+    """
+    if not gene or not transcript or not score:
+        return {'client': False, 'figure': go.Figure(),
+                'info': "Please select a gene, a transcript and a pathogenicity score"}
     
-    fig.update_xaxes(showgrid=True, zeroline=False)
-    fig.update_yaxes(showgrid=True, zeroline=False)
+    if view_mode == 'panels':
+        # One figure for all the scores; density mode does not apply
+        if dash.ctx.triggered_id in ('pathogenicity-plot', 'server-threshold', 'density-mode', 'score-dropdown'):
+            raise dash.exceptions.PreventUpdate
+        gene_data = get_gene(gene)
+
+        def build_panels():
+            fig, info_parts, gnomad = build_score_panels(
+                gene_data['gnomad'], gene_data['clinvar'], gene_data['custom'], transcript,
+                webgl_threshold=WEBGL_POINT_THRESHOLD, overlay=overlay_of(gene_data, transcript))
+            return {'client': True, 'figure': fig, 'info_parts': info_parts, 'gnomad': gnomad,
+                    'webgl_threshold': WEBGL_POINT_THRESHOLD}
+        return cached_figure(gene_data, ('panels', gene, transcript), build_panels)
     
-    # Create info text
-    if info_parts:
-        info_text = "Displaying: " + " | ".join(info_parts)
-    else:
-        info_text = "No variants to display with current filters."
+    density = 'density' in (density_mode or [])
+    x_range = None
+    if dash.ctx.triggered_id == 'pathogenicity-plot':
+        # Zoom/pan only changes what is sent in density mode
+        x_range = x_range_from_relayout(relayout)
+        if not density or x_range is _NO_X_CHANGE:
+            raise dash.exceptions.PreventUpdate
+    elif density and dash.ctx.triggered_id == 'server-threshold':
+        # Keep the current zoom when only the threshold changes
+        x_range = x_range_from_relayout(relayout)
+    if x_range is _NO_X_CHANGE:
+        x_range = None
     
-    if len(fig.data) == 0:
-        return fig, "⚠️ No variants found for this transcript with the selected score. Check if data is loaded correctly."
-    
-    return fig, info_text
+    gene_data = get_gene(gene)
+
+    def build():
+        fig, info_parts = build_figure_parts(
+            gene_data['gnomad'], gene_data['clinvar'], gene_data['custom'], transcript, score,
+            threshold_field if density else None, threshold_value,
+            x_range=x_range, density=density, webgl_threshold=WEBGL_POINT_THRESHOLD,
+            density_point_limit=DENSITY_POINT_LIMIT, overlay=overlay_of(gene_data, transcript))
+        # Where the custom variant sits in the score distributions (precomputed summaries)
+        custom = gene_data['custom'].rows(transcript, score)
+        if not custom.empty:
+            info_parts.append(describe_variant(
+                gene_data['summary']['gnomad'], gene_data['summary']['clinvar'], transcript, score,
+                float(custom[score].iloc[0]), int(custom['aa_position'].iloc[0])))
+
+        if density:
+            if len(fig.data) == 0:
+                info = "⚠️ No variants found for this transcript with the selected score. Check if data is loaded correctly."
+            else:
+                info = "Displaying: " + " | ".join(info_parts)
+            return {'client': False, 'figure': fig, 'info': info}
+
+        gnomad = gnomad_client_data(fig, gene_data['gnomad'].rows(transcript, score))
+        return {'client': True, 'figure': fig, 'info_parts': info_parts, 'gnomad': gnomad,
+                'webgl_threshold': WEBGL_POINT_THRESHOLD}
+
+    if x_range is not None:
+        # Zoomed density views are rarely requested twice: not cached
+        return build()
+    # Outside density mode the threshold is applied in the browser, so it is not part of the output
+    threshold = (threshold_field, float(threshold_value or 0)) if density else (None, None)
+    return cached_figure(gene_data, ('single', gene, transcript, score, density) + threshold, build)
+
+@dash.callback(
+    Output('export-links', 'children'),
+    Input('gene-dropdown', 'value'),
+    Input('transcript-dropdown', 'value'),
+    Input('score-dropdown', 'value'),
+    Input('view-mode', 'value'),
+    Input('threshold-field-dropdown', 'value'),
+    Input('threshold-value', 'value')
+)
+def update_export_links(gene, transcript, score, view_mode, threshold_field, threshold_value):
+    """Links to the /export endpoint for the rows of the current view."""
+    if not gene or not transcript:
+        return []
+    query = {'transcript': transcript, 'threshold_field': threshold_field, 'threshold_value': threshold_value or 0}
+    if view_mode != 'panels':
+        query['score'] = score
+    links = [html.B("Download the rows: ")]
+    for fmt, label in [('csv', 'CSV'), ('parquet', 'Parquet'), ('arrow', 'Arrow IPC')]:
+        href = f"/export/{gene}?" + urlencode(dict(query, format=fmt))
+        links.append(html.A(label, href=href, style={'marginRight': '10px'}))
+    return links
+
+dash.clientside_callback(
+    ClientsideFunction(namespace='threshold', function_name='filter_plot'),
+    Output('pathogenicity-plot', 'figure'),
+    Output('info-display', 'children'),
+    Input('plot-data', 'data'),
+    Input('threshold-field-dropdown', 'value'),
+    Input('threshold-value', 'value')
+)
+
+dash.clientside_callback(
+    ClientsideFunction(namespace='threshold', function_name='server_threshold'),
+    Output('server-threshold', 'data'),
+    Input('threshold-field-dropdown', 'value'),
+    Input('threshold-value', 'value'),
+    State('density-mode', 'value')
+)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=8050)
+    create_app().run(debug=DEBUG, port=8050)
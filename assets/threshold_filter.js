@@ -0,0 +1,94 @@
+// Browser-side gnomAD threshold filter (see update_plot in app.py).
+// The server sends the unfiltered gnomAD points of the transcript once in the
+// 'plot-data' store; changing the filter field or threshold only re-filters
+// and recolors them here, without a server round-trip.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    threshold: {
+        filter_plot: function(plotData, thresholdField, thresholdValue) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!plotData) {
+                return [noUpdate, noUpdate];
+            }
+            if (!plotData.client) {
+                // Filtered on the server (density mode): wait for the new plot-data
+                const triggered = window.dash_clientside.callback_context.triggered;
+                const fromStore = triggered.some(t => t.prop_id.startsWith('plot-data.'));
+                return fromStore ? [plotData.figure, plotData.info] : [noUpdate, noUpdate];
+            }
+
+            const threshold = (thresholdValue === null || thresholdValue === undefined ||
+                               thresholdValue === '') ? 0 : Number(thresholdValue);
+            // Same formatting as the server-side info text (float)
+            const thresholdText = Number.isInteger(threshold) ? threshold.toFixed(1) : String(threshold);
+            const figure = Object.assign({}, plotData.figure);
+            figure.data = plotData.figure.data.slice();
+            const parts = [];
+            let nGnomad = 0;
+
+            // The rows are filtered once, then each panel (one in the single-score
+            // view, one per score in the all-scores view) takes its y values
+            const gnomad = plotData.gnomad;
+            if (gnomad) {
+                const counts = gnomad.counts[thresholdField] || [];
+                const kept = [], color = [];
+                for (let i = 0; i < gnomad.x.length; i++) {
+                    const count = counts[i] === null || counts[i] === undefined ? 0 : counts[i];
+                    if (count > threshold) {
+                        kept.push(i);
+                        color.push(Math.log10(count === 0 ? 1e-9 : count));
+                    }
+                }
+                const shown = new Set();
+                gnomad.panels.forEach(function(panel) {
+                    const x = [], y = [], customdata = [], panelColor = [];
+                    kept.forEach(function(i, k) {
+                        if (panel.y[i] === null) {
+                            return;
+                        }
+                        x.push(gnomad.x[i]);
+                        y.push(panel.y[i]);
+                        customdata.push(gnomad.customdata[i]);
+                        panelColor.push(color[k]);
+                        shown.add(i);
+                    });
+                    const trace = Object.assign({}, figure.data[panel.trace]);
+                    trace.type = x.length > plotData.webgl_threshold ? 'scattergl' : 'scatter';
+                    trace.x = x;
+                    trace.y = y;
+                    trace.customdata = customdata;
+                    trace.marker = Object.assign({}, trace.marker, {color: panelColor});
+                    if (trace.marker.colorbar) {
+                        trace.marker.colorbar = Object.assign({}, trace.marker.colorbar, {title: {text: thresholdField}});
+                    }
+                    figure.data[panel.trace] = trace;
+                });
+                nGnomad = shown.size;
+                if (figure.layout && figure.layout.coloraxis) {
+                    // Panels share one color axis
+                    const coloraxis = Object.assign({}, figure.layout.coloraxis);
+                    coloraxis.colorbar = Object.assign({}, coloraxis.colorbar, {title: {text: thresholdField}});
+                    figure.layout = Object.assign({}, figure.layout, {coloraxis: coloraxis});
+                }
+            }
+            if (nGnomad > 0) {
+                parts.push(nGnomad + ' gnomAD variants (filtered: ' + thresholdField + ' > ' + thresholdText + ')');
+            } else {
+                parts.push('No gnomAD variants with ' + thresholdField + ' > ' + thresholdText);
+            }
+            const otherParts = plotData.info_parts.slice(1);
+            if (nGnomad === 0 && otherParts.length === 0) {
+                return [figure, '⚠️ No variants found for this transcript with the selected score. ' +
+                                'Check if data is loaded correctly.'];
+            }
+            return [figure, 'Displaying: ' + parts.concat(otherParts).join(' | ')];
+        },
+
+        server_threshold: function(thresholdField, thresholdValue, densityMode) {
+            // Only density mode filters on the server
+            if (!densityMode || densityMode.indexOf('density') < 0) {
+                return window.dash_clientside.no_update;
+            }
+            return {field: thresholdField, value: thresholdValue};
+        }
+    }
+});
@@ -0,0 +1,286 @@
+"""
+Headless batch mode: score and plot many candidate variants without Dash.
+
+Candidates are given as HGVS notations (annotated through the cached VEP
+client) or as a BCSQ-annotated VCF. With --local-scores, their scores are
+taken from the gnomAD/ClinVar VCFs and --score-table files (local_scores.py),
+and chrom-pos-ref-alt lines of the --hgvs file are resolved without VEP. They
+are grouped by gene, each gene's gnomAD/ClinVar data is loaded once, and the
+genes are processed in a process pool. For every candidate and transcript,
+the same figure as the app is written (HTML, PNG and/or SVG) and a row is
+added to summary.tsv.
+
+Usage:
+    python batch.py --hgvs variants.txt --gnomad gnomad.vcf.gz \
+        --clinvar clinvar.vcf.gz --gene-coord gene_coord.csv.gz --out results/
+    python batch.py --vcf candidates.vcf.gz ... --formats html png -j 8
+"""
+import argparse
+import gzip
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import store
+from gene_index import VariantIndex
+from plotting import build_figure
+from variants import COUNT_FIELDS, SCORE_FIELDS, load_gene_coord, parse_info_field, parse_vcf_row
+from local_scores import LocalScorer, local_vcf_row, parse_variant_string, score_vcf_row
+from vep import VepClient, ENSEMBL_SERVER, hgvs_gene, vep_to_vcf_row
+
+FORMATS = ['html', 'png', 'svg']
+
+# Gene coordinates, loaded once per worker process by _init_worker
+_GENE_COORD = None
+
+def read_hgvs_file(path):
+    """One HGVS notation per line (first tab-separated column), '#' lines skipped."""
+    with open(path) as f:
+        return [line.split('\t')[0].strip() for line in f
+                if line.strip() and not line.startswith('#')]
+
+def read_vcf_candidates(path):
+    """Read the data rows of a BCSQ-annotated (optionally gzipped) VCF as candidates."""
+    opener = gzip.open if path.endswith('.gz') else open
+    candidates = []
+    with opener(path, 'rt') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            chrom, pos, vid, ref, alt = fields[0:5]
+            vcf_string = f"{chrom}-{pos}-{ref}-{alt}"
+            candidates.append({
+                'id': vid if vid != '.' else vcf_string,
+                'vcf_row': line.rstrip('\n'),
+                'vcf_string': vcf_string,
+            })
+    return candidates
+
+def annotate_hgvs(hgvs_list, vep_client):
+    """Resolve HGVS notations to annotated VCF rows through VEP (one batch call per 200)."""
+    results = vep_client.annotate(hgvs_list)
+    candidates = []
+    for hgvs in hgvs_list:
+        vcf_row, vcf_string = None, None
+        if results.get(hgvs):
+            vcf_row, vcf_string = vep_to_vcf_row(results[hgvs], hgvs_gene(hgvs))
+        candidates.append({'id': hgvs, 'vcf_row': vcf_row, 'vcf_string': vcf_string})
+    return candidates
+
+def annotate_local(variant_strings, scorer):
+    """Resolve chrom-pos-ref-alt variants to annotated VCF rows from the local sources."""
+    candidates = []
+    for text in variant_strings:
+        vcf_row, vcf_string = local_vcf_row(scorer, text)
+        candidates.append({'id': text, 'vcf_row': vcf_row, 'vcf_string': vcf_string})
+    return candidates
+
+def score_candidates(candidates, scorer):
+    """Replace the scores of the candidates' VCF rows by the local ones. Returns the number found."""
+    n_found = 0
+    for candidate in candidates:
+        if candidate['vcf_row']:
+            candidate['vcf_row'], found = score_vcf_row(scorer, candidate['vcf_row'])
+            n_found += found
+    return n_found
+
+def candidate_genes(vcf_row):
+    """Genes hit by a missense consequence in the BCSQ field of a VCF row."""
+    fields = vcf_row.split('\t')
+    if len(fields) < 8:
+        return []
+    bcsq = parse_info_field(fields[7]).get('BCSQ')
+    if not bcsq or bcsq is True:
+        return []
+    genes = []
+    for entry in bcsq.split(','):
+        parts = entry.split('|')
+        if len(parts) >= 6 and parts[0] == 'missense' and parts[1] not in genes:
+            genes.append(parts[1])
+    return genes
+
+def group_by_gene(candidates):
+    """
+    Group candidates by gene. Returns ({gene: [candidates]}, unresolved) where
+    unresolved are the candidates without an annotated missense consequence.
+    """
+    groups = {}
+    unresolved = []
+    for candidate in candidates:
+        genes = candidate_genes(candidate['vcf_row']) if candidate['vcf_row'] else []
+        if not genes:
+            unresolved.append(candidate)
+        for gene in genes:
+            groups.setdefault(gene, []).append(candidate)
+    return groups, unresolved
+
+def safe_name(text):
+    """File-system friendly version of a variant identifier."""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', text).strip('_')
+
+def _init_worker(gene_coord_file):
+    global _GENE_COORD
+    _GENE_COORD = load_gene_coord(gene_coord_file)
+
+def process_gene(gene, candidates, config):
+    """
+    Load one gene and write the figures of all its candidates.
+    Returns the summary rows (one per candidate and transcript).
+    """
+    gnomad_data = store.load_or_parse(config['store_dir'], gene, 'gnomad', config['gnomad_vcf'], _GENE_COORD)
+    clinvar_data = pd.DataFrame()
+    if config['clinvar_vcf'] or store.has_gene(config['store_dir'], gene, 'clinvar'):
+        clinvar_data = store.load_or_parse(config['store_dir'], gene, 'clinvar', config['clinvar_vcf'], _GENE_COORD)
+    gnomad_index = VariantIndex(gnomad_data)
+    clinvar_index = VariantIndex(clinvar_data)
+
+    gene_dir = os.path.join(config['out_dir'], gene)
+    os.makedirs(gene_dir, exist_ok=True)
+    rows = []
+    for candidate in candidates:
+        custom_data = parse_vcf_row(candidate['vcf_row'], gene)
+        if custom_data.empty:
+            continue
+        custom_index = VariantIndex(custom_data)
+        for transcript in custom_index.transcripts:
+            custom_tx = custom_index.block(transcript)
+            row = {
+                'variant': candidate['id'], 'vcf_string': candidate['vcf_string'], 'gene': gene,
+                'transcript': transcript, 'aa_change': custom_tx['aa_change'].iloc[0],
+                'n_gnomad': gnomad_index.count(transcript),
+                'n_clinvar': clinvar_index.count(transcript),
+                'status': 'ok',
+            }
+            figures = []
+            for score in config['scores']:
+                row[score] = custom_tx[score].iloc[0]
+                if pd.isna(row[score]):
+                    continue
+                fig, _ = build_figure(gnomad_index, clinvar_index, custom_index, transcript, score,
+                                      config['threshold_field'], config['threshold_value'])
+                fig.update_layout(title=f"{gene} {candidate['id']} - {transcript} | {score}")
+                base = os.path.join(gene_dir, f"{safe_name(candidate['id'])}_{transcript}_{safe_name(score)}")
+                for fmt in config['formats']:
+                    path = f"{base}.{fmt}"
+                    if fmt == 'html':
+                        fig.write_html(path, include_plotlyjs='cdn')
+                    else:
+                        fig.write_image(path)
+                    figures.append(os.path.relpath(path, config['out_dir']))
+            row['figures'] = ','.join(figures)
+            rows.append(row)
+    return rows
+
+def _error_rows(gene, candidates, error):
+    """Summary rows of the candidates of a gene that could not be processed."""
+    return [{'variant': c['id'], 'vcf_string': c['vcf_string'], 'gene': gene, 'status': f"error: {error}"}
+            for c in candidates]
+
+def run_batch(candidates, config, gene_coord_file, jobs=None):
+    """Process every gene of the candidates, in a process pool when jobs > 1."""
+    groups, unresolved = group_by_gene(candidates)
+    rows = [{'variant': c['id'], 'vcf_string': c['vcf_string'], 'status': 'no missense annotation'}
+            for c in unresolved]
+    jobs = jobs or os.cpu_count()
+    jobs = max(1, min(jobs, len(groups)))
+    print(f"{len(candidates)} candidates in {len(groups)} genes, {len(unresolved)} unresolved, {jobs} workers")
+
+    t0 = time.time()
+    if jobs == 1:
+        _init_worker(gene_coord_file)
+        for done, (gene, gene_candidates) in enumerate(groups.items(), 1):
+            try:
+                rows.extend(process_gene(gene, gene_candidates, config))
+                print(f"[{done}/{len(groups)}] {gene} done")
+            except Exception as e:
+                print(f"[{done}/{len(groups)}] {gene} FAILED: {e}")
+                rows.extend(_error_rows(gene, gene_candidates, e))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(gene_coord_file,)) as pool:
+            futures = {pool.submit(process_gene, gene, gene_candidates, config): gene
+                       for gene, gene_candidates in groups.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                gene = futures[future]
+                try:
+                    rows.extend(future.result())
+                    print(f"[{done}/{len(futures)}] {gene} done")
+                except Exception as e:
+                    print(f"[{done}/{len(futures)}] {gene} FAILED: {e}")
+                    rows.extend(_error_rows(gene, groups[gene], e))
+    print(f"Processed {len(groups)} genes in {time.time() - t0:.1f}s")
+
+    summary = pd.DataFrame(rows)
+    columns = ['variant', 'vcf_string', 'gene', 'transcript', 'aa_change'] + config['scores'] + \
+              ['n_gnomad', 'n_clinvar', 'status', 'figures']
+    return summary.reindex(columns=columns)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score and plot candidate missense variants without Dash.")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('--hgvs', help="Text/TSV file with one HGVS notation per line")
+    inputs.add_argument('--vcf', help="BCSQ-annotated VCF of candidate variants")
+    parser.add_argument('--gnomad', required=True, help="gnomad_ms.fully_annotated.vcf.gz")
+    parser.add_argument('--clinvar', help="clinvar_plp_ms.fully_annotated.vcf.gz")
+    parser.add_argument('--gene-coord', required=True, help="gene_coord.csv.gz or its index (see gene_resolver.py)")
+    parser.add_argument('--store', help="Compiled gene store (see store.py), used when a gene is in it")
+    parser.add_argument('--out', required=True, help="Output directory")
+    parser.add_argument('--scores', nargs='+', default=['REVEL'], choices=SCORE_FIELDS)
+    parser.add_argument('--formats', nargs='+', default=['html'], choices=FORMATS,
+                        help="Figure formats (png/svg need the kaleido package)")
+    parser.add_argument('--threshold-field', default='AC_genomes',
+                        choices=COUNT_FIELDS)
+    parser.add_argument('--threshold-value', type=float, default=0)
+    parser.add_argument('--local-scores', action='store_true',
+                        help="Score the candidates from the --gnomad/--clinvar VCFs and --score-table files")
+    parser.add_argument('--score-table', action='append', default=[],
+                        help="bgzipped, tabix-indexed score table (repeatable, implies --local-scores; needs pysam)")
+    parser.add_argument('--vep-cache', default='vep_cache.sqlite')
+    parser.add_argument('--vep-server', default=ENSEMBL_SERVER)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    if set(args.formats) & {'png', 'svg'}:
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            parser.error("PNG/SVG export needs the kaleido package (pip install kaleido)")
+
+    scorer = None
+    if args.local_scores or args.score_table:
+        scorer = LocalScorer([args.gnomad, args.clinvar], args.score_table)
+
+    if args.hgvs:
+        notations = read_hgvs_file(args.hgvs)
+        genomic = [text for text in notations if parse_variant_string(text)] if scorer else []
+        candidates = annotate_local(genomic, scorer) if genomic else []
+        hgvs_list = [text for text in notations if text not in genomic]
+        if hgvs_list:
+            client = VepClient(server=args.vep_server, cache_path=args.vep_cache)
+            candidates += annotate_hgvs(hgvs_list, client)
+    else:
+        candidates = read_vcf_candidates(args.vcf)
+    if scorer is not None:
+        t0 = time.time()
+        n_found = score_candidates(candidates, scorer)
+        scorer.close()
+        print(f"Scored {n_found}/{len(candidates)} candidates from the local sources in {time.time() - t0:.2f}s")
+
+    config = {
+        'gnomad_vcf': args.gnomad, 'clinvar_vcf': args.clinvar, 'store_dir': args.store,
+        'out_dir': args.out, 'scores': args.scores, 'formats': args.formats,
+        'threshold_field': args.threshold_field, 'threshold_value': args.threshold_value,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    summary = run_batch(candidates, config, args.gene_coord, jobs=args.jobs)
+    summary_path = os.path.join(args.out, 'summary.tsv')
+    summary.to_csv(summary_path, sep='\t', index=False, float_format='%.6g')
+    print(f"Wrote {len(summary)} rows to {summary_path}")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,75 @@
+"""
+Benchmark of the vectorized BCSQ parsing of parse_gene_variants_region against
+the original per-record path (parse_variant_record on every record, then
+pd.DataFrame of the list of dicts). Both outputs are checked to be identical.
+
+Usage (from the repository root):
+    python benchmarks/bench_bcsq_parsing.py --vcf gnomad_ms.fully_annotated.vcf.gz \
+        --gene-coord gene_coord.csv.gz --gene TTN --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from cyvcf2 import VCF
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from variants import (VARIANT_COLUMNS, get_gene_coordinates, load_gene_coord,  # noqa: E402
+                      parse_gene_variants_region, parse_variant_record)
+
+def parse_per_record(vcf_file, gene_coord, gene_symbol):
+    """The original implementation: one parse_variant_record call per record."""
+    chrom, start, end = get_gene_coordinates(gene_coord, gene_symbol)
+    variants = []
+    for variant in VCF(vcf_file)(f"{chrom}:{start}-{end}"):
+        variants.extend(parse_variant_record(variant, gene_symbol, source_type="vcf"))
+    return pd.DataFrame(variants)
+
+def normalize(df):
+    """Common representation for comparison: numbers as float64, missing values as NaN."""
+    out = pd.DataFrame(index=range(len(df)))
+    for col in VARIANT_COLUMNS:
+        values = df[col].reset_index(drop=True) if col in df.columns else pd.Series([None] * len(df))
+        numeric = pd.to_numeric(values, errors='coerce')
+        if numeric.notna().sum() == values.notna().sum():
+            out[col] = numeric.astype(np.float64)
+        else:
+            out[col] = values.astype(object).where(values.notna(), None)
+    return out
+
+def timed(func, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--vcf', required=True)
+    parser.add_argument('--gene-coord', required=True)
+    parser.add_argument('--gene', default='TTN')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    gene_coord = load_gene_coord(args.gene_coord)
+    quiet = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, quiet
+    try:
+        t_record, per_record = timed(lambda: parse_per_record(args.vcf, gene_coord, args.gene), args.repeat)
+        t_bulk, bulk = timed(lambda: parse_gene_variants_region(args.vcf, gene_coord, args.gene), args.repeat)
+    finally:
+        sys.stdout = stdout
+
+    pd.testing.assert_frame_equal(normalize(per_record), normalize(bulk))
+    print(f"{args.gene}: {len(bulk)} transcript rows, outputs identical")
+    print(f"per-record : {t_record:8.3f} s")
+    print(f"vectorized : {t_bulk:8.3f} s  ({t_record / t_bulk:.1f}x faster)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Timings of the load and callback hot paths on the synthetic fixtures of
+make_fixtures.py, one row per path and gene size:
+
+- parse_gene_variants_region: region query and parsing of the gnomAD VCF
+- parse_vcf_row: parsing of the custom variant row (from the recorded VEP response)
+- create_hover_data: hover data of the largest transcript
+- update_plot: the Dash plot callback on a loaded gene, with the JSON encoding
+  of its output (what the browser receives), figure cache disabled
+- update_plot_cached: the same, served from the figure cache (repeat view)
+
+Results can be saved (--save) and compared to a saved baseline (--baseline):
+the script exits with 1 when a median is slower than the baseline by more than
+--tolerance (or when the baseline holds none of the measured paths), so it
+can gate a CI job; benchmarks/test_hot_paths.py runs this check under pytest.
+
+Usage (from the repository root):
+    python benchmarks/make_fixtures.py --out bench_fixtures
+    python benchmarks/bench_hot_paths.py --fixtures bench_fixtures --save baseline.json
+    python benchmarks/bench_hot_paths.py --fixtures bench_fixtures --baseline baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dash  # noqa: E402
+import plotly  # noqa: E402
+
+import app  # noqa: E402
+from gene_index import VariantIndex  # noqa: E402
+from plotting import create_hover_data  # noqa: E402
+from variants import load_gene_coord, parse_gene_variants_region, parse_vcf_row  # noqa: E402
+from vep import vep_to_vcf_row  # noqa: E402
+
+def timed(func, repeat):
+    """Seconds of each of `repeat` calls of func, after a warm-up call (prints silenced)."""
+    samples = []
+    for i in range(repeat + 1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            func()
+            if i > 0:
+                samples.append(time.perf_counter() - t0)
+    return samples
+
+def summarize(samples):
+    p50, p95 = np.percentile(np.array(samples) * 1000, [50, 95])
+    return {'median_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'runs': len(samples)}
+
+def bench_gene(fixtures, gene, responses, gene_coord, repeat):
+    """Timings of every hot path for one fixture gene."""
+    results = {}
+    results['parse_gene_variants_region'] = timed(
+        lambda: parse_gene_variants_region(fixtures['gnomad_vcf'], gene_coord, gene['gene']), repeat)
+
+    vcf_row, _ = vep_to_vcf_row(responses[gene['hgvs']], gene['gene'])
+    results['parse_vcf_row'] = timed(lambda: parse_vcf_row(vcf_row, gene['gene']), repeat * 20)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        gnomad = VariantIndex(parse_gene_variants_region(fixtures['gnomad_vcf'], gene_coord, gene['gene']))
+    transcript = max(gnomad.transcripts, key=gnomad.count)
+    rows = gnomad.rows(transcript, 'REVEL')
+    results['create_hover_data'] = timed(lambda: create_hover_data(rows, 'REVEL'), repeat)
+
+    # The Dash callback, on the gene loaded in the app's cache (as after a first view)
+    app.VCF_ROW_STRING = vcf_row
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.get_gene(gene['gene'])
+    ctx = SimpleNamespace(triggered_id='transcript-dropdown')
+
+    def update_plot():
+        with mock.patch.object(dash, 'ctx', ctx):
+            output = app.update_plot(gene['gene'], transcript, 'REVEL', [], 'single', None, None, 'AC_joint', 0)
+        return json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder)
+    app.CACHE_FIGURES = False
+    results['update_plot'] = timed(update_plot, repeat)
+    app.CACHE_FIGURES = True
+    results['update_plot_cached'] = timed(update_plot, repeat)
+    return {path: summarize(samples) for path, samples in results.items()}
+
+def compare(results, baseline, tolerance):
+    """Lines of the medians slower than the baseline by more than tolerance (a fraction)."""
+    regressions = []
+    for gene, paths in results.items():
+        for path, stats in paths.items():
+            before = baseline.get(gene, {}).get(path)
+            if before and stats['median_ms'] > before['median_ms'] * (1 + tolerance):
+                regressions.append(f"{gene} {path}: {stats['median_ms']:.2f} ms "
+                                   f"(baseline {before['median_ms']:.2f} ms)")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the load and callback hot paths on synthetic fixtures.")
+    parser.add_argument('--fixtures', required=True, help="Directory written by make_fixtures.py")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement (default: 5)")
+    parser.add_argument('--genes', nargs='+', help="Only these fixture genes (e.g. BENCH1K BENCH200K)")
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed slowdown against the baseline (default: 0.25, i.e. +25%%)")
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.fixtures, 'fixtures.json')) as f:
+        fixtures = json.load(f)
+    with open(fixtures['vep_responses']) as f:
+        responses = json.load(f)
+    gene_coord = load_gene_coord(fixtures['gene_coord'])
+    app.VCF_FILE, app.CLINVAR_VCF, app.STORE_DIR = fixtures['gnomad_vcf'], fixtures['clinvar_vcf'], None
+    app.gene_coord = gene_coord
+
+    results = {}
+    print(f"{'gene':<12} {'records':>8} {'path':<28} {'median':>10} {'p95':>10}")
+    for gene in fixtures['genes']:
+        if args.genes and gene['gene'] not in args.genes:
+            continue
+        results[gene['gene']] = bench_gene(fixtures, gene, responses, gene_coord, args.repeat)
+        for path, stats in results[gene['gene']].items():
+            print(f"{gene['gene']:<12} {gene['size']:>8} {path:<28} "
+                  f"{stats['median_ms']:>7.2f} ms {stats['p95_ms']:>7.2f} ms")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not any(path in baseline.get(gene, {}) for gene, paths in results.items() for path in paths):
+            print(f"No measurement of this run is in {args.baseline} (baseline of other fixtures?)")
+            return 1
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,109 @@
+"""
+Callback latency of the figure building, before and after the per-transcript
+index: the "before" path filters the full tables on every call (transcript
+mask, score.notna(), copy, to_numeric on the threshold field, sort), the
+"after" path slices the precomputed VariantIndex. Reports p50/p99 of the
+filtering step over all transcript/score/threshold combinations, and of the
+whole build_figure call over a sample of them.
+
+Usage (from the repository root):
+    python benchmarks/bench_update_plot.py --vcf gnomad_ms.fully_annotated.vcf.gz \
+        --clinvar clinvar_plp_ms.fully_annotated.vcf.gz --gene-coord gene_coord.csv.gz --gene TTN
+"""
+import argparse
+import contextlib
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gene_index import VariantIndex  # noqa: E402
+from plotting import build_figure  # noqa: E402
+from variants import SCORE_FIELDS, load_gene_coord, parse_gene_variants_region  # noqa: E402
+
+THRESHOLD_FIELDS = ['AC_joint', 'AC_genomes', 'nhomalt_joint', 'nhomalt_genomes']
+
+def filter_full_table(df, transcript, score, threshold_field=None, threshold_val=None):
+    """The filtering update_plot did before the index, on the full table."""
+    filtered = df[(df['transcript'] == transcript) & (df[score].notna())].copy()
+    if threshold_field is not None and not filtered.empty:
+        filtered[threshold_field] = pd.to_numeric(filtered[threshold_field], errors='coerce')
+        filtered = filtered[filtered[threshold_field] > threshold_val]
+    return filtered.sort_values('aa_position')
+
+class FullTableIndex(VariantIndex):
+    """VariantIndex-compatible wrapper re-filtering the full table on every call."""
+
+    def __init__(self, df):
+        self.frame = df
+
+    def rows(self, transcript, score):
+        return filter_full_table(self.frame, transcript, score)
+
+def percentiles(samples):
+    p50, p99 = np.percentile(np.array(samples) * 1000, [50, 99])
+    return f"p50 {p50:8.2f} ms   p99 {p99:8.2f} ms"
+
+def run_filtering(gnomad, gnomad_index, combos):
+    before, after = [], []
+    for transcript, score, field, value in combos:
+        t0 = time.perf_counter()
+        filter_full_table(gnomad, transcript, score, field, value)
+        before.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        rows = gnomad_index.rows(transcript, score)
+        rows[rows[field].to_numpy() > value]
+        after.append(time.perf_counter() - t0)
+    return before, after
+
+def run(gnomad, clinvar, custom, combos):
+    samples = []
+    for transcript, score, field, value in combos:
+        t0 = time.perf_counter()
+        build_figure(gnomad, clinvar, custom, transcript, score, field, value)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--vcf', required=True)
+    parser.add_argument('--clinvar')
+    parser.add_argument('--gene-coord', required=True)
+    parser.add_argument('--gene', default='TTN')
+    parser.add_argument('--figure-samples', type=int, default=20,
+                        help="Number of callback inputs timed through the whole build_figure")
+    args = parser.parse_args(argv)
+
+    gene_coord = load_gene_coord(args.gene_coord)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        gnomad = parse_gene_variants_region(args.vcf, gene_coord, args.gene)
+        clinvar = parse_gene_variants_region(args.clinvar, gene_coord, args.gene) if args.clinvar else pd.DataFrame()
+    transcripts = sorted(gnomad['transcript'].unique())
+    combos = list(itertools.product(transcripts, SCORE_FIELDS, THRESHOLD_FIELDS, [0, 5]))
+    print(f"{args.gene}: {len(gnomad)} gnomAD rows, {len(clinvar)} ClinVar rows, {len(combos)} callback inputs")
+
+    t0 = time.perf_counter()
+    gnomad_index, clinvar_index = VariantIndex(gnomad), VariantIndex(clinvar)
+    t_index = time.perf_counter() - t0
+    print(f"index build (once per gene load): {t_index * 1000:.1f} ms")
+
+    before, after = run_filtering(gnomad, gnomad_index, combos)
+    print("filtering only")
+    print(f"  full-table filtering : {percentiles(before)}")
+    print(f"  per-transcript index : {percentiles(after)}")
+
+    sample = combos[::max(1, len(combos) // args.figure_samples)][:args.figure_samples]
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        before = run(FullTableIndex(gnomad), FullTableIndex(clinvar), FullTableIndex(pd.DataFrame()), sample)
+        after = run(gnomad_index, clinvar_index, VariantIndex(pd.DataFrame()), sample)
+    print(f"whole build_figure ({len(sample)} inputs)")
+    print(f"  full-table filtering : {percentiles(before)}")
+    print(f"  per-transcript index : {percentiles(after)}")
+
+if __name__ == '__main__':
+    main()
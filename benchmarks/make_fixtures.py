@@ -0,0 +1,208 @@
+"""
+Synthetic inputs for the benchmarks, so they run without the real data and
+without network: BCSQ-annotated gnomAD-like and ClinVar-like VCFs (bgzipped,
+CSI-indexed), a gene_coord.csv.gz for them, and a recorded VEP response per
+gene (JSON, and pre-loaded in a VEP cache that vep.VepClient reads offline).
+
+One synthetic gene is made per size (number of VCF records), named after it
+(BENCH1K, BENCH200K...), with --transcripts transcripts; every record is a
+missense variant on most transcripts and carries all the scores.
+
+Needs pysam for the bgzip/CSI indexing (pip install pysam).
+
+Usage (from the repository root):
+    python benchmarks/make_fixtures.py --out bench_fixtures --sizes 1000 10000 50000 200000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from vep import DEFAULT_OPTIONS, VepCache, cache_key  # noqa: E402
+
+CHROM = '1'
+GENE_SPACING = 20_000_000
+AA = np.array(list('ACDEFGHIKLMNPQRSTVWY'))
+BASES = np.array(list('ACGT'))
+
+HEADER = """##fileformat=VCFv4.2
+##fileDate=20250101
+##source=missense_visual synthetic benchmark fixture
+##reference=GRCh38
+##contig=<ID={chrom},length=248956422>
+##INFO=<ID=BCSQ,Number=.,Type=String,Description="Local consequence annotation from BCFtools/csq, Format: Consequence|gene|transcript|biotype|strand|amino_acid_change|dna_change">
+##INFO=<ID=AC_joint,Number=1,Type=Integer,Description="Alternate allele count, exomes + genomes">
+##INFO=<ID=AC_genomes,Number=1,Type=Integer,Description="Alternate allele count, genomes">
+##INFO=<ID=nhomalt_joint,Number=1,Type=Integer,Description="Homozygous count, exomes + genomes">
+##INFO=<ID=nhomalt_genomes,Number=1,Type=Integer,Description="Homozygous count, genomes">
+##INFO=<ID=REVEL,Number=1,Type=Float,Description="REVEL score">
+##INFO=<ID=am_pathogenicity,Number=1,Type=Float,Description="AlphaMissense pathogenicity">
+##INFO=<ID=cadd_v1.7,Number=1,Type=Float,Description="CADD v1.7 PHRED">
+##INFO=<ID=MPC,Number=1,Type=Float,Description="MPC2 score">
+##INFO=<ID=MISTIC_score,Number=1,Type=Float,Description="MISTIC score">
+##INFO=<ID=MISTIC_pred,Number=1,Type=String,Description="MISTIC prediction">
+##INFO=<ID=popEVE,Number=1,Type=Float,Description="popEVE score">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+"""
+
+def size_label(size):
+    """Gene name of a fixture size: BENCH1K, BENCH200K, BENCH1500..."""
+    if size % 1_000_000 == 0:
+        return f"BENCH{size // 1_000_000}M"
+    if size % 1000 == 0:
+        return f"BENCH{size // 1000}K"
+    return f"BENCH{size}"
+
+def transcript_ids(gene_index, n_transcripts):
+    return [f"ENST9{gene_index:04d}{t:06d}" for t in range(n_transcripts)]
+
+def gene_records(rng, gene, gene_index, size, n_transcripts, start, clinvar=False):
+    """VCF lines of size records of one synthetic gene (sorted by position)."""
+    transcripts = transcript_ids(gene_index, n_transcripts)
+    # About 3 alternate alleles per position over the coding span
+    pos = np.sort(start + rng.integers(0, max(size, 1000), size))
+    aa_pos = (pos - start) // 3 + 1
+    ref = BASES[rng.integers(0, 4, size)]
+    alt = BASES[(np.searchsorted(BASES, ref) + rng.integers(1, 4, size)) % 4]
+    ref_aa, alt_aa = AA[rng.integers(0, 20, size)], AA[rng.integers(0, 20, size)]
+    # Transcript t is missense on 90% of the records, with its aa numbering shifted (isoforms)
+    on_transcript = rng.random((size, n_transcripts)) < 0.9
+    scores = {
+        'REVEL': rng.random(size), 'am_pathogenicity': rng.random(size), 'cadd_v1.7': rng.random(size) * 40,
+        'MPC': rng.random(size) * 3, 'MISTIC_score': rng.random(size), 'popEVE': -rng.random(size) * 10,
+    }
+    has_score = rng.random((size, len(scores))) < 0.9
+    if not clinvar:
+        ac_joint = rng.geometric(0.05, size)
+        ac_genomes = rng.binomial(ac_joint, 0.1)
+        nhomalt_joint = rng.binomial(ac_joint // 2, 0.02)
+        nhomalt_genomes = rng.binomial(nhomalt_joint, 0.1)
+    pred = np.where(scores['MISTIC_score'] > 0.5, 'D', 'B')
+
+    lines = []
+    for i in range(size):
+        bcsq = []
+        for t, transcript in enumerate(transcripts):
+            if on_transcript[i, t]:
+                aa = aa_pos[i] + 7 * t
+                bcsq.append(f"missense|{gene}|{transcript}|protein_coding|+|"
+                            f"{aa}{ref_aa[i]}>{aa}{alt_aa[i]}|{pos[i]}{ref[i]}>{alt[i]}")
+        if not bcsq:
+            bcsq.append(f"synonymous|{gene}|{transcripts[0]}|protein_coding|+|{aa_pos[i]}{ref_aa[i]}|"
+                        f"{pos[i]}{ref[i]}>{alt[i]}")
+        info = ["BCSQ=" + ",".join(bcsq)]
+        if not clinvar:
+            info += [f"AC_joint={ac_joint[i]}", f"AC_genomes={ac_genomes[i]}",
+                     f"nhomalt_joint={nhomalt_joint[i]}", f"nhomalt_genomes={nhomalt_genomes[i]}"]
+        for j, (name, values) in enumerate(scores.items()):
+            if has_score[i, j]:
+                info.append(f"{name}={values[i]:.3f}")
+        if has_score[i, 4]:
+            info.append(f"MISTIC_pred={pred[i]}")
+        lines.append((int(pos[i]), f"{CHROM}\t{pos[i]}\t.\t{ref[i]}\t{alt[i]}\t.\tPASS\t{';'.join(info)}\n"))
+    return lines
+
+def write_vcf(path, lines):
+    """Write, bgzip and CSI-index a VCF (path ends with .vcf; writes path.gz and path.gz.csi)."""
+    import pysam
+    with open(path, 'w') as f:
+        f.write(HEADER.format(chrom=CHROM))
+        for _, line in sorted(lines, key=lambda item: item[0]):
+            f.write(line)
+    pysam.tabix_index(path, preset='vcf', csi=True, force=True)
+    return f"{path}.gz"
+
+def vep_response(rng, gene_index, size, n_transcripts, start):
+    """A VEP hgvs endpoint result (same fields as Ensembl's) for a missense variant of the gene."""
+    gene = size_label(size)
+    transcripts = transcript_ids(gene_index, n_transcripts)
+    aa = max(size // 6, 1)
+    pos = start + 3 * (aa - 1)
+    hgvs = f"{transcripts[0]}({gene}):c.{3 * (aa - 1) + 1}G>C"
+    revel, am, cadd = (round(float(x), 3) for x in (rng.random(), rng.random(), rng.random() * 40))
+    consequences = [{
+        'gene_symbol': gene, 'transcript_id': transcript, 'biotype': 'protein_coding', 'strand': 1,
+        'consequence_terms': ['missense_variant'], 'amino_acids': 'A/P', 'protein_start': aa + 7 * t,
+        'cadd_phred': cadd, 'revel': revel,
+        'alphamissense': {'am_pathogenicity': am, 'am_class': 'likely_pathogenic' if am > 0.56 else 'ambiguous'},
+    } for t, transcript in enumerate(transcripts)]
+    return hgvs, {
+        'input': hgvs, 'vcf_string': f"{CHROM}-{pos}-G-C",
+        'colocated_variants': [{'id': f"rs{900000000 + gene_index}"}],
+        'transcript_consequences': consequences,
+    }
+
+def make_fixtures(out_dir, sizes, n_transcripts=4, clinvar_fraction=0.1, seed=0):
+    """Write the fixtures of every size into out_dir. Returns the fixture manifest."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    gnomad_lines, clinvar_lines, coords, responses = [], [], [], {}
+    genes = []
+    for i, size in enumerate(sizes):
+        gene = size_label(size)
+        start = 1_000_000 + i * GENE_SPACING
+        end = start + max(size, 1000) + 3 * 7 * n_transcripts
+        print(f"{gene}: {size} gnomAD records, {int(size * clinvar_fraction)} ClinVar records, "
+              f"{n_transcripts} transcripts")
+        gnomad_lines += gene_records(rng, gene, i, size, n_transcripts, start)
+        clinvar_lines += gene_records(rng, gene, i, max(int(size * clinvar_fraction), 1), n_transcripts, start,
+                                      clinvar=True)
+        coords.append(f"ENSG9{i:010d},ENSG9{i:010d}.1,{start},{end},{gene},{gene},{CHROM}\n")
+        hgvs, response = vep_response(rng, i, size, n_transcripts, start)
+        responses[hgvs] = response
+        genes.append({'gene': gene, 'size': size, 'hgvs': hgvs, 'transcripts': transcript_ids(i, n_transcripts)})
+
+    gnomad_vcf = write_vcf(os.path.join(out_dir, 'gnomad.vcf'), gnomad_lines)
+    clinvar_vcf = write_vcf(os.path.join(out_dir, 'clinvar.vcf'), clinvar_lines)
+    gene_coord = os.path.join(out_dir, 'gene_coord.csv.gz')
+    with gzip.open(gene_coord, 'wt') as f:
+        f.write("Gene stable ID,Gene stable ID version,Gene start (bp),Gene end (bp),"
+                "Gene name,HGNC symbol,Chromosome/scaffold name\n")
+        f.writelines(coords)
+
+    # Recorded VEP answers, as JSON and in a cache usable with VepClient(offline=True)
+    vep_responses = os.path.join(out_dir, 'vep_responses.json')
+    with open(vep_responses, 'w') as f:
+        json.dump(responses, f, indent=1)
+    vep_cache = os.path.join(out_dir, 'vep_cache.sqlite')
+    if os.path.exists(vep_cache):
+        os.remove(vep_cache)
+    cache = VepCache(vep_cache)
+    cache.put_many([(cache_key(hgvs, DEFAULT_OPTIONS), hgvs, DEFAULT_OPTIONS, result)
+                    for hgvs, result in responses.items()])
+    cache.close()
+
+    manifest = {
+        'gnomad_vcf': os.path.abspath(gnomad_vcf), 'clinvar_vcf': os.path.abspath(clinvar_vcf),
+        'gene_coord': os.path.abspath(gene_coord), 'vep_responses': os.path.abspath(vep_responses),
+        'vep_cache': os.path.abspath(vep_cache), 'transcripts': n_transcripts, 'seed': seed, 'genes': genes,
+    }
+    with open(os.path.join(out_dir, 'fixtures.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    print(f"Fixtures written to {out_dir}")
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic annotated VCFs and a VEP fixture.")
+    parser.add_argument('--out', required=True, help="Output directory")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000, 200000],
+                        help="VCF records of each synthetic gene (default: 1000 10000 50000 200000)")
+    parser.add_argument('--transcripts', type=int, default=4, help="Transcripts per gene (default: 4)")
+    parser.add_argument('--clinvar-fraction', type=float, default=0.1,
+                        help="ClinVar records per gnomAD record (default: 0.1)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args(argv)
+    try:
+        import pysam  # noqa: F401
+    except ImportError:
+        parser.error("pysam is needed to bgzip and index the VCFs (pip install pysam)")
+    make_fixtures(args.out, args.sizes, args.transcripts, args.clinvar_fraction, args.seed)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
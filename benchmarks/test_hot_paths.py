@@ -0,0 +1,142 @@
+"""
+Correctness checks of the hot paths on the synthetic fixtures of
+make_fixtures.py (generated once per run into a temporary directory, needs
+pysam): the vectorized BCSQ parsing against the original per-record parser,
+store round-trips, and the edges of the sliding windows. The benchmark
+baseline comparison also runs when BENCH_FIXTURES and BENCH_BASELINE point to
+a fixture directory and a saved baseline.
+
+Usage (from the repository root):
+    python -m pytest -q benchmarks
+    BENCH_FIXTURES=bench_fixtures BENCH_BASELINE=baseline.json python -m pytest -q benchmarks
+"""
+import contextlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pysam')
+
+import bench_hot_paths  # noqa: E402
+import make_fixtures  # noqa: E402
+import store  # noqa: E402
+from bench_bcsq_parsing import normalize, parse_per_record  # noqa: E402
+from overlays import window_counts  # noqa: E402
+from score_summary import WINDOW_SIZE, WINDOW_STEP, window_of, window_quantiles  # noqa: E402
+from variants import COMPACT_COLUMNS, compact_variants, load_gene_coord, parse_gene_variants_region  # noqa: E402
+
+SIZES = [1000, 3000]
+
+def quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+@pytest.fixture(scope='module')
+def fixtures(tmp_path_factory):
+    out_dir = str(tmp_path_factory.mktemp('fixtures'))
+    return quiet(make_fixtures.make_fixtures, out_dir, SIZES, 3, 0.2, 1)
+
+@pytest.fixture(scope='module')
+def gene_coord(fixtures):
+    return quiet(load_gene_coord, fixtures['gene_coord'])
+
+def comparable(df):
+    """A compact table with plain object categories and a fresh index, for assert_frame_equal."""
+    df = compact_variants(df).reset_index(drop=True)
+    for col in store.CATEGORY_COLUMNS:
+        df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df
+
+@pytest.mark.parametrize('source', ['gnomad_vcf', 'clinvar_vcf'])
+@pytest.mark.parametrize('size', SIZES)
+def test_vectorized_parse_matches_per_record(fixtures, gene_coord, source, size):
+    gene = make_fixtures.size_label(size)
+    per_record = quiet(parse_per_record, fixtures[source], gene_coord, gene)
+    bulk = quiet(parse_gene_variants_region, fixtures[source], gene_coord, gene)
+    assert len(bulk) > 0
+    pd.testing.assert_frame_equal(normalize(per_record), normalize(bulk))
+
+@pytest.mark.parametrize('size', SIZES)
+def test_store_round_trip(fixtures, gene_coord, tmp_path, size):
+    gene = make_fixtures.size_label(size)
+    df = quiet(parse_gene_variants_region, fixtures['gnomad_vcf'], gene_coord, gene)
+    store.write_gene(str(tmp_path), gene, 'gnomad', df, source_vcf=fixtures['gnomad_vcf'])
+
+    loaded = store.load_gene(str(tmp_path), gene, 'gnomad')
+    assert list(loaded.columns) == COMPACT_COLUMNS
+    expected = df.sort_values(['transcript', 'aa_position'], kind='stable')
+    pd.testing.assert_frame_equal(comparable(loaded), comparable(expected))
+    summary = store.load_summary(str(tmp_path), gene, 'gnomad')
+    assert summary is not None and len(summary.keys) > 0
+
+def test_store_complete_source_without_partition(fixtures, gene_coord, tmp_path):
+    store_dir = str(tmp_path)
+    assert not store.has_gene(store_dir, 'NOROWS', 'clinvar')
+    store.mark_complete(store_dir, 'clinvar', fixtures['clinvar_vcf'])
+    assert store.has_gene(store_dir, 'NOROWS', 'clinvar')
+    assert not store.has_partition(store_dir, 'NOROWS', 'clinvar')
+    assert store.list_genes(store_dir) == []
+    empty = store.load_gene(store_dir, 'NOROWS', 'clinvar')
+    assert empty.empty and list(empty.columns) == COMPACT_COLUMNS
+    store.mark_complete(store_dir, 'clinvar', complete=False)
+    assert not store.has_gene(store_dir, 'NOROWS', 'clinvar')
+
+@pytest.mark.parametrize('length', [20, 30, 31, 35, 40, 41, 100])
+def test_window_counts_edges(length):
+    positions = np.arange(1, length + 1)
+    counts, starts, ends = window_counts(positions, length)
+    assert starts[0] == 1 and ends[-1] == length
+    assert np.all(starts >= 1) and np.all(ends <= length)
+    assert np.all(np.diff(starts) > 0)
+    # Every window but a short protein's only one is WINDOW_SIZE long
+    widths = ends - starts + 1
+    assert np.all(widths == min(WINDOW_SIZE, length))
+    assert np.array_equal(counts, widths)
+    # The regular windows are the score summary windows
+    regular = (starts - 1) % WINDOW_STEP == 0
+    assert np.array_equal(starts[regular], np.arange(regular.sum()) * WINDOW_STEP + 1)
+
+def test_window_quantiles_edges():
+    # One value per position: window k holds aa WINDOW_STEP * k + 1 to WINDOW_STEP * k + WINDOW_SIZE
+    positions = np.arange(1, 101)
+    n_windows = (100 - 1) // WINDOW_STEP + 1
+    counts, quantiles = window_quantiles(positions, positions.astype(float), n_windows)
+    for k in range(n_windows):
+        start = k * WINDOW_STEP + 1
+        members = positions[(positions >= start) & (positions <= start + WINDOW_SIZE - 1)]
+        assert counts[k] == len(members)
+        assert quantiles[k, 0] == pytest.approx(np.quantile(members, 0.05))
+        assert quantiles[k, -1] == pytest.approx(np.quantile(members, 0.95))
+    assert window_of(1) == 0
+    assert window_of((WINDOW_SIZE + 1) / 2 + WINDOW_STEP) == 1
+
+def test_baseline_check(fixtures, tmp_path):
+    gene = make_fixtures.size_label(SIZES[0])
+    results = str(tmp_path / 'results.json')
+    argv = ['--fixtures', os.path.dirname(fixtures['gene_coord']), '--genes', gene, '--repeat', '1']
+    assert quiet(bench_hot_paths.main, argv + ['--save', results]) == 0
+    with open(results) as f:
+        saved = json.load(f)
+
+    for factor, status in [(1000, 0), (0.001, 1)]:
+        baseline = {gene: {path: dict(stats, median_ms=stats['median_ms'] * factor)
+                           for path, stats in saved[gene].items()}}
+        with open(tmp_path / 'baseline.json', 'w') as f:
+            json.dump(baseline, f)
+        assert quiet(bench_hot_paths.main, argv + ['--baseline', str(tmp_path / 'baseline.json')]) == status
+    # A baseline of other fixtures is not a pass
+    with open(tmp_path / 'baseline.json', 'w') as f:
+        json.dump({'OTHER': saved[gene]}, f)
+    assert quiet(bench_hot_paths.main, argv + ['--baseline', str(tmp_path / 'baseline.json')]) == 1
+
+@pytest.mark.skipif(not (os.environ.get('BENCH_FIXTURES') and os.environ.get('BENCH_BASELINE')),
+                    reason="set BENCH_FIXTURES and BENCH_BASELINE to compare against a saved baseline")
+def test_no_regression_against_baseline():
+    argv = ['--fixtures', os.environ['BENCH_FIXTURES'], '--baseline', os.environ['BENCH_BASELINE']]
+    if os.environ.get('BENCH_TOLERANCE'):
+        argv += ['--tolerance', os.environ['BENCH_TOLERANCE']]
+    assert bench_hot_paths.main(argv) == 0
@@ -0,0 +1,139 @@
+"""
+Bounded in-process LRU cache, capped by entry count and by memory bytes.
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+def nbytes(value):
+    """
+    Approximate memory footprint of a cached value: DataFrames are measured
+    with memory_usage(deep=True), dicts/lists/tuples are summed recursively.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+class LRUCache:
+    """
+    Thread-safe LRU cache. An entry is evicted when either max_entries or
+    max_bytes is exceeded; the most recently inserted entry is always kept.
+    """
+
+    def __init__(self, max_entries=8, max_bytes=None, sizeof=nbytes, name='cache'):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.name = name
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    @property
+    def current_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                del self._sizes[key]
+            self._data[key] = value
+            self._sizes[key] = size
+            self._evict()
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() on a miss.
+        Concurrent misses on the same key wait for a single load.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    return self._data[key]
+            try:
+                value = loader()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry when key is None."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self._sizes.clear()
+            else:
+                self._data.pop(key, None)
+                self._sizes.pop(key, None)
+
+    def _evict(self):
+        # Called with the lock held
+        def over():
+            if self.max_entries is not None and len(self._data) > self.max_entries:
+                return True
+            return self.max_bytes is not None and sum(self._sizes.values()) > self.max_bytes
+        while len(self._data) > 1 and over():
+            key, _ = self._data.popitem(last=False)
+            del self._sizes[key]
+            self.evictions += 1
+            print(f"{self.name}: evicted {key}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._data),
+                'bytes': sum(self._sizes.values()),
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'keys': [str(k) for k in self._data],
+            }
+
+_MISSING = object()
@@ -0,0 +1,171 @@
+"""
+Incremental refresh of the ClinVar data when a new release is out.
+
+The new annotated ClinVar VCF is diffed against the previous one by (chrom,
+pos, ref, alt): records added, removed, or whose annotations (BCSQ, counts,
+scores) changed. A gene's rows are the missense BCSQ entries naming it, so only
+the genes named by these records change. Then:
+- the ClinVar partitions of the changed genes compiled in the store are
+  rewritten from the new VCF; the other partitions, and every gnomAD one, are
+  left as they are;
+- the ClinVar header metadata cached in the store (release date) is refreshed;
+- a release manifest (JSON: the new and previous VCFs and the changed genes)
+  is written atomically, by default to <store>/_metadata/clinvar_release.json.
+Running app instances poll the manifest and switch to the new VCF without a
+restart (see app.check_clinvar_release): a cached gene swaps in its new ClinVar
+rows at its next view, or only its version when the release did not change
+it; gnomAD is never reloaded. Keep the previous VCF in place until then.
+
+Usage:
+    python clinvar_refresh.py --previous clinvar_plp_ms.2026-09.fully_annotated.vcf.gz \
+        --new clinvar_plp_ms.2026-10.fully_annotated.vcf.gz --gene-coord gene_coord.csv.gz --store store/
+"""
+import argparse
+import json
+import os
+import time
+
+from cyvcf2 import VCF
+
+import store
+from metadata import load_metadata, read_cached_metadata
+from variants import RECORD_FIELDS, collect_records, explode_missense, load_gene_coord
+
+MANIFEST_VERSION = 1
+
+def read_release(vcf_file):
+    """
+    {(chrom, pos, ref, alt): (annotations, genes)} of the records of a ClinVar
+    VCF with a missense entry, genes being the symbols of these entries.
+    """
+    vcf = VCF(vcf_file)
+    columns = collect_records(vcf, "missense|")
+    vcf.close()
+    record_index, gene = explode_missense(columns['BCSQ'])[:2]
+    genes = [set() for _ in columns['pos']]
+    for i, symbol in zip(record_index.tolist(), gene.to_pylist()):
+        genes[i].add(symbol)
+    annotations = zip(*(columns[name] for name in RECORD_FIELDS))
+    keys = zip(columns['chrom'], columns['pos'], columns['ref'], columns['alt'])
+    return {key: (tuple(values), frozenset(symbols)) for key, values, symbols in zip(keys, annotations, genes)}
+
+def diff_releases(previous, current):
+    """
+    Records added, removed and changed between two releases (read_release),
+    and the set of genes they name.
+    """
+    added = current.keys() - previous.keys()
+    removed = previous.keys() - current.keys()
+    changed = {key for key in current.keys() & previous.keys() if current[key][0] != previous[key][0]}
+    genes = set()
+    for key in added | changed:
+        genes |= current[key][1]
+    for key in removed | changed:
+        genes |= previous[key][1]
+    return {'added': added, 'removed': removed, 'changed': changed, 'genes': genes}
+
+def manifest_path(store_dir):
+    """Default release manifest of a store."""
+    return os.path.join(store_dir, '_metadata', 'clinvar_release.json')
+
+def write_manifest(path, manifest):
+    """Write the release manifest atomically (readers see the old or the new one)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+def read_manifest(path):
+    """The release manifest at path, or None (missing, unreadable or other version)."""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+def refresh_store(store_dir, gene_coord, genes, vcf_file):
+    """
+    Rewrite the ClinVar partition of the genes compiled in the store (for any
+    source) from vcf_file, or of every gene of gene_coord when the ClinVar
+    source is complete (compiled with --all: new genes get a partition).
+    Returns the genes rewritten.
+    """
+    if store.is_complete(store_dir, 'clinvar'):
+        compiled = set(gene_coord.symbols())
+    else:
+        compiled = set(store.list_genes(store_dir))
+    rewritten = []
+    for gene_symbol in sorted(genes & compiled):
+        try:
+            n = store.compile_gene(store_dir, gene_symbol, 'clinvar', vcf_file, gene_coord)
+        except Exception as e:
+            print(f"{gene_symbol} clinvar: FAILED ({e})")
+            continue
+        print(f"{gene_symbol} clinvar: {n} rows")
+        rewritten.append(gene_symbol)
+    return rewritten
+
+def refresh_clinvar(previous_vcf, new_vcf, store_dir=None, gene_coord=None, manifest=None):
+    """
+    Diff new_vcf against previous_vcf, update the store and write the release
+    manifest (to manifest, or the store's). Returns the manifest.
+    """
+    t0 = time.time()
+    previous = read_release(previous_vcf)
+    current = read_release(new_vcf)
+    diff = diff_releases(previous, current)
+    print(f"{len(current)} records in {new_vcf} ({len(previous)} before): {len(diff['added'])} added, "
+          f"{len(diff['removed'])} removed, {len(diff['changed'])} changed, in {len(diff['genes'])} genes "
+          f"({time.time() - t0:.1f}s)")
+
+    rewritten = []
+    if store_dir:
+        rewritten = refresh_store(store_dir, gene_coord, diff['genes'], new_vcf)
+        if store.is_complete(store_dir, 'clinvar'):
+            store.mark_complete(store_dir, 'clinvar', new_vcf)
+        metadata = load_metadata(new_vcf, 'clinvar', store_dir)
+    else:
+        metadata = load_metadata(new_vcf, 'clinvar')
+    release = {
+        'version': MANIFEST_VERSION,
+        'vcf': os.path.abspath(new_vcf),
+        'stamp': store.data_stamp(None, None, 'clinvar', new_vcf),
+        'previous_vcf': os.path.abspath(previous_vcf),
+        'previous_stamp': store.data_stamp(None, None, 'clinvar', previous_vcf),
+        'file_date': (metadata or {}).get('file_date'),
+        'changed_genes': sorted(diff['genes']),
+        'store_genes': rewritten,
+        'counts': {name: len(diff[name]) for name in ('added', 'removed', 'changed')},
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    path = manifest or manifest_path(store_dir)
+    write_manifest(path, release)
+    print(f"Rewrote {len(rewritten)} store genes, wrote the release manifest {path} in {time.time() - t0:.1f}s")
+    return release
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the ClinVar data from a new release, gene by gene.")
+    parser.add_argument('--new', required=True, help="Annotated VCF of the new ClinVar release")
+    parser.add_argument('--previous', help="Annotated VCF of the release in use (default: the store's)")
+    parser.add_argument('--store', help="Compiled gene store to update (see store.py)")
+    parser.add_argument('--gene-coord', help="gene_coord.csv.gz or its index (needed with --store)")
+    parser.add_argument('--manifest', help="Release manifest to write (default: <store>/_metadata/clinvar_release.json)")
+    args = parser.parse_args(argv)
+    if not args.store and not args.manifest:
+        parser.error("give --store or --manifest")
+    if args.store and not args.gene_coord:
+        parser.error("--store needs --gene-coord")
+
+    previous = args.previous or (read_cached_metadata(args.store, 'clinvar') or {}).get('vcf')
+    if not previous or not os.path.exists(previous):
+        parser.error("give --previous (the store has no readable ClinVar VCF recorded)")
+    if os.path.abspath(previous) == os.path.abspath(args.new):
+        parser.error("--new is the release in use: write the new release to another file")
+    gene_coord = load_gene_coord(args.gene_coord) if args.gene_coord else None
+    refresh_clinvar(previous, args.new, args.store, gene_coord, args.manifest)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,342 @@
+"""
+Genome-wide compilation of the per-gene store, sharded over the genome.
+
+Compiling gene by gene (store.compile_gene) runs one region query per gene in
+a single thread, and reads the records of overlapping genes several times.
+Here the chromosomes are cut into fixed-size shards aligned on CSI bins; a
+process pool reads every shard once (each worker with its own VCF handle),
+keeps the missense entries of all the genes whose loci overlap the record, and
+checkpoints the shard rows to <store>/_compile/<source>/. Once every shard is
+done, the rows are merged into the per-gene store, one pool task per
+chromosome; each gene's rows are taken from its shards in genome order, so the
+result does not depend on the scheduling. A task reads the shards of its
+chromosome one at a time and writes each gene after its last shard, so it holds
+one shard plus the rows of the genes spanning a shard boundary, not the whole
+chromosome. An interrupted job restarts from the shards (and chromosomes)
+already done; the checkpoint is removed once the store is written.
+
+Usage (through store.py):
+    python store.py compile --gnomad gnomad.vcf.gz --clinvar clinvar.vcf.gz \
+        --gene-coord gene_coord.csv.gz --out store/ --all -j 16
+"""
+import json
+import os
+import shutil
+import time
+import warnings
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from cyvcf2 import VCF
+
+import store
+from metadata import load_metadata
+from variants import VARIANT_COLUMNS, collect_records, explode_missense, load_gene_coord, variant_frame
+
+CHECKPOINT_VERSION = 1
+# Shards of 2^23 bp (8 Mb): a bin level of the CSI index (min_shift 14, 3 bits per level)
+SHARD_SHIFT = 23
+
+_WORKER = {}
+
+def plan_shards(gene_coord, shift=SHARD_SHIFT):
+    """
+    (chrom, start, end) shards covering the gene loci, chromosomes in the same
+    (string) order as GeneResolver.regions, shards in position order.
+    """
+    chroms = gene_coord.arrays['chrom'].astype(str)
+    shards = []
+    for chrom in sorted(set(chroms.tolist())):
+        on_chrom = chroms == chrom
+        first = int(gene_coord.arrays['start'][on_chrom].min() - 1) >> shift
+        last = int(gene_coord.arrays['end'][on_chrom].max() - 1) >> shift
+        shards.extend((chrom, (k << shift) + 1, (k + 1) << shift) for k in range(first, last + 1))
+    return shards
+
+def checkpoint_dir(store_dir, source):
+    return os.path.join(store_dir, '_compile', source)
+
+def shard_path(store_dir, source, i, shard):
+    chrom, start, _ = shard
+    return os.path.join(checkpoint_dir(store_dir, source), f"{i:05d}_{chrom}_{start}.parquet")
+
+def merged_path(store_dir, source, chrom):
+    return os.path.join(checkpoint_dir(store_dir, source), f"{chrom}.merged")
+
+def in_gene_loci(df, gene_coord):
+    """Rows whose record overlaps a locus of their gene (as a region query of the gene would return)."""
+    keep = np.zeros(len(df), dtype=bool)
+    if df.empty:
+        return keep
+    genes = df['gene'].to_numpy()
+    chrom = df['chrom'].astype(str).to_numpy()
+    pos = df['pos'].to_numpy()
+    end = pos + df['ref'].astype(str).str.len().to_numpy() - 1
+    for gene in np.unique(genes):
+        try:
+            regions = gene_coord.regions(gene)
+        except ValueError:
+            continue  # not in the gene coordinates
+        rows = genes == gene
+        for r_chrom, r_start, r_end in regions:
+            keep |= rows & (chrom == r_chrom) & (pos <= r_end) & (end >= r_start)
+    return keep
+
+def _init_worker(vcf_file, gene_coord_file):
+    _WORKER['vcf'] = VCF(vcf_file)
+    _WORKER['gene_coord'] = load_gene_coord(gene_coord_file)
+
+def extract_shard(shard, path):
+    """
+    Read one shard with the worker's VCF handle and checkpoint its gene rows
+    to path (parquet). Records belong to the shard of their POS. Returns the
+    number of records read and of rows kept.
+    """
+    chrom, start, end = shard
+    vcf = _WORKER['vcf']
+    stats = {'records': 0}
+    records = (v for v in vcf(f"{chrom}:{start}-{end}") if start <= v.POS <= end) \
+        if chrom in vcf.seqnames else iter(())
+    with warnings.catch_warnings():
+        # Shards without records (gaps, centromeres) are expected
+        warnings.filterwarnings('ignore', message='no intervals found')
+        columns = collect_records(records, "missense|", stats)
+    idx, gene, transcript, biotype, aa_change, aa_position = explode_missense(columns['BCSQ'])
+    df = variant_frame(columns, idx, gene.to_numpy(zero_copy_only=False),
+                       transcript, biotype, aa_change, aa_position)
+    df = df[in_gene_loci(df, _WORKER['gene_coord'])].reset_index(drop=True)
+    df['gene'] = df['gene'].astype(str)  # typed even when the shard is empty (merge filters on it)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    return stats['records'], len(df)
+
+def job_manifest(vcf_file, gene_coord_file, shards):
+    """Parameters a checkpoint must match to be resumed."""
+    stat = os.stat(vcf_file)
+    return {
+        'version': CHECKPOINT_VERSION,
+        'vcf': os.path.abspath(vcf_file), 'vcf_size': stat.st_size, 'vcf_mtime': stat.st_mtime,
+        'gene_coord': os.path.abspath(gene_coord_file),
+        'shard_shift': SHARD_SHIFT, 'n_shards': len(shards),
+    }
+
+def open_checkpoint(store_dir, source, manifest, restart=False):
+    """Create the checkpoint directory of a source, discarding a stale or unwanted one."""
+    ckpt = checkpoint_dir(store_dir, source)
+    path = os.path.join(ckpt, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if restart or previous != manifest:
+            print(f"{source}: discarding the previous checkpoint"
+                  f"{'' if restart else ' (other VCF, gene coordinates or shards)'}")
+            shutil.rmtree(ckpt)
+    os.makedirs(ckpt, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+
+def extract_shards(store_dir, source, vcf_file, gene_coord_file, shards, jobs):
+    """Extract the shards missing from the checkpoint. Returns the failed shards."""
+    todo = [(i, shard) for i, shard in enumerate(shards)
+            if not os.path.exists(shard_path(store_dir, source, i, shard))]
+    print(f"{source}: {len(shards)} shards, {len(shards) - len(todo)} already done, {jobs} workers")
+    failed = []
+    n_records = n_rows = 0
+    t0 = time.time()
+
+    def report(done, shard, records, rows):
+        nonlocal n_records, n_rows
+        n_records += records
+        n_rows += rows
+        elapsed = time.time() - t0
+        eta = elapsed / done * (len(todo) - done)
+        chrom, start, end = shard
+        print(f"[{done}/{len(todo)}] {source} {chrom}:{start}-{end}: {records} records, {rows} rows "
+              f"({n_records / max(elapsed, 1e-9):,.0f} records/s, ETA {eta:.0f}s)")
+
+    def fail(done, shard, error):
+        print(f"[{done}/{len(todo)}] {source} {shard[0]}:{shard[1]}-{shard[2]}: FAILED ({error})")
+        failed.append(shard)
+
+    if jobs == 1:
+        _init_worker(vcf_file, gene_coord_file)
+        for done, (i, shard) in enumerate(todo, 1):
+            try:
+                report(done, shard, *extract_shard(shard, shard_path(store_dir, source, i, shard)))
+            except Exception as e:
+                fail(done, shard, e)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(vcf_file, gene_coord_file)) as pool:
+            futures = {pool.submit(extract_shard, shard, shard_path(store_dir, source, i, shard)): shard
+                       for i, shard in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    report(done, futures[future], *future.result())
+                except Exception as e:
+                    fail(done, futures[future], e)
+    elapsed = time.time() - t0
+    print(f"{source}: read {n_records} records into {n_rows} rows in {elapsed:.1f}s "
+          f"({n_records / max(elapsed, 1e-9):,.0f} records/s)")
+    return failed
+
+def merge_genes(store_dir, source, vcf_file, paths, genes, last_shard=None, filters=None):
+    """
+    Write genes to the store from the rows of the shard files (in order). The
+    files are read one at a time and a gene is written once its last shard
+    (last_shard[gene], an index in paths; default: the last file) is read.
+    Genes without rows get no partition (the source is marked complete once
+    merged, see store.is_complete); the partition left by an earlier compile
+    is removed. Returns (number of genes written, genes that failed).
+    """
+    last_shard = last_shard or {}
+    due = {}
+    for gene in genes:
+        due.setdefault(last_shard.get(gene, len(paths) - 1), []).append(gene)
+    wanted = set(genes)
+    pending, failed = {}, []
+    written = 0
+
+    def write(gene):
+        nonlocal written
+        parts = pending.pop(gene, [])
+        try:
+            if parts:
+                store.write_gene(store_dir, gene, source, pd.concat(parts, ignore_index=True), source_vcf=vcf_file)
+                written += 1
+            elif store.has_partition(store_dir, gene, source):
+                shutil.rmtree(store.gene_dir(store_dir, gene, source))
+                if not os.listdir(os.path.join(store_dir, gene)):
+                    os.rmdir(os.path.join(store_dir, gene))
+        except Exception as e:
+            print(f"{gene} {source}: FAILED ({e})")
+            failed.append(gene)
+
+    for i, path in enumerate(paths):
+        part = pd.read_parquet(path, columns=VARIANT_COLUMNS, filters=filters)
+        part = part[part['gene'].isin(wanted)]
+        for gene, rows in part.groupby('gene', sort=False):
+            pending.setdefault(gene, []).append(rows)
+        for gene in due.pop(i, []):
+            write(gene)
+    # Genes past the last file (or no files at all)
+    for gene in [gene for genes_due in due.values() for gene in genes_due]:
+        write(gene)
+    return written, failed
+
+def merge_chromosome(store_dir, source, vcf_file, chrom, paths, genes, last_shard):
+    """
+    Write the genes of one chromosome, then mark the chromosome as merged if
+    none failed. Returns (genes written, genes failed).
+    """
+    written, failed = merge_genes(store_dir, source, vcf_file, paths, genes, last_shard)
+    if not failed:
+        open(merged_path(store_dir, source, chrom), 'w').close()
+    return written, failed
+
+def merge_shards(store_dir, source, vcf_file, gene_coord, shards, jobs):
+    """
+    Write the per-gene store from the checkpointed shards, one task per
+    chromosome in the process pool; genes with loci on several chromosomes
+    are written last, from all their shards. Only the genes of gene_coord
+    with rows are written. Chromosomes merged before an interruption are
+    skipped. Returns the genes that failed.
+    """
+    gene_regions = {gene: gene_coord.regions(gene) for gene in gene_coord.symbols()}
+    by_chrom = {}
+    for gene, regions in gene_regions.items():
+        chroms = {r[0] for r in regions}
+        by_chrom.setdefault(chroms.pop() if len(chroms) == 1 else None, []).append(gene)
+    split_genes = by_chrom.pop(None, [])
+    paths, starts = {}, {}
+    for i, shard in enumerate(shards):
+        paths.setdefault(shard[0], []).append(shard_path(store_dir, source, i, shard))
+        starts.setdefault(shard[0], []).append(shard[1])
+    # Index (in its chromosome's shards) of the shard holding the last rows of a gene
+    last_shard = {gene: bisect_right(starts.get(regions[0][0], []), max(r[2] for r in regions)) - 1
+                  for gene, regions in gene_regions.items() if gene not in split_genes}
+    todo = [chrom for chrom in sorted(paths) if not os.path.exists(merged_path(store_dir, source, chrom))]
+    print(f"{source}: merging {len(gene_regions)} genes, {len(paths) - len(todo)} chromosomes already merged")
+
+    t0 = time.time()
+    tasks = []
+    for chrom in todo:
+        genes = by_chrom.get(chrom, [])
+        tasks.append((store_dir, source, vcf_file, chrom, paths[chrom], genes,
+                      {gene: last_shard[gene] for gene in genes}))
+    failed = []
+
+    def report(done, chrom, n, chrom_failed):
+        failed.extend(chrom_failed)
+        print(f"[{done}/{len(tasks)}] {source} chromosome {chrom} merged: {n} genes with rows"
+              f"{f', {len(chrom_failed)} FAILED' if chrom_failed else ''} ({time.time() - t0:.1f}s)")
+
+    def fail(done, chrom, error):
+        failed.extend(by_chrom.get(chrom, []))
+        print(f"[{done}/{len(tasks)}] {source} chromosome {chrom}: FAILED ({error})")
+
+    if jobs == 1:
+        for done, task in enumerate(tasks, 1):
+            try:
+                report(done, task[3], *merge_chromosome(*task))
+            except Exception as e:
+                fail(done, task[3], e)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(merge_chromosome, *task): task[3] for task in tasks}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    report(done, futures[future], *future.result())
+                except Exception as e:
+                    fail(done, futures[future], e)
+    if split_genes:
+        shard_files = [path for chrom in sorted(paths) for path in paths[chrom]]
+        written, split_failed = merge_genes(store_dir, source, vcf_file, shard_files, sorted(split_genes),
+                                            filters=[('gene', 'in', split_genes)])
+        failed.extend(split_failed)
+        print(f"{source}: {len(split_genes)} genes on several chromosomes merged, {written} with rows")
+    return failed
+
+def compile_genome(store_dir, gene_coord_file, gnomad_vcf=None, clinvar_vcf=None, jobs=None, restart=False):
+    """
+    Compile every gene of gene_coord from the gnomAD and/or ClinVar VCFs into
+    the store, with jobs worker processes (default: all cores). Returns the
+    failed (source, shard) and (source, gene) pairs; the store is only
+    written for a source once all its shards are extracted, and its
+    checkpoint is kept (and the source not marked complete) until every
+    gene is written.
+    """
+    gene_coord = load_gene_coord(gene_coord_file)
+    shards = plan_shards(gene_coord)
+    jobs = max(1, min(jobs or os.cpu_count(), len(shards)))
+    os.makedirs(store_dir, exist_ok=True)
+    failed = []
+    t0 = time.time()
+    for source, vcf_file in [('gnomad', gnomad_vcf), ('clinvar', clinvar_vcf)]:
+        if not vcf_file:
+            continue
+        load_metadata(vcf_file, source, store_dir)
+        # Missing partitions only mean "no rows" once the whole source is merged
+        store.mark_complete(store_dir, source, complete=False)
+        open_checkpoint(store_dir, source, job_manifest(vcf_file, gene_coord_file, shards), restart)
+        source_failed = extract_shards(store_dir, source, vcf_file, gene_coord_file, shards, jobs)
+        if source_failed:
+            print(f"{source}: {len(source_failed)} shards failed, rerun to retry them (the others are kept)")
+            failed.extend((source, shard) for shard in source_failed)
+            continue
+        genes_failed = merge_shards(store_dir, source, vcf_file, gene_coord, shards, jobs)
+        if genes_failed:
+            print(f"{source}: {len(genes_failed)} genes failed, rerun to retry their chromosomes")
+            failed.extend((source, gene) for gene in genes_failed)
+            continue
+        store.mark_complete(store_dir, source, vcf_file)
+        shutil.rmtree(checkpoint_dir(store_dir, source))
+    try:
+        os.rmdir(os.path.join(store_dir, '_compile'))
+    except OSError:
+        pass  # a source still has a checkpoint
+    print(f"Compiled the genome into {store_dir} in {time.time() - t0:.1f}s ({len(failed)} failures)")
+    return failed
@@ -0,0 +1,194 @@
+"""
+Export of the rows behind a plot: the gnomAD, ClinVar and custom rows of a
+gene, optionally restricted to a transcript and to the rows with a score, the
+gnomAD rows filtered by threshold as in the app.
+
+The rows are selected as positions into the loaded (or memory-mapped store)
+tables, then written in chunks of EXPORT_CHUNK_ROWS rows as Arrow IPC stream,
+Parquet (one row group per chunk) or CSV: only one chunk is ever copied, and
+the output is produced as it is written (served by the app's /export/<gene>
+endpoint as a streamed response).
+
+Usage:
+    python export.py --gene SCN1A --gnomad gnomad_ms.fully_annotated.vcf.gz \
+        --clinvar clinvar_plp_ms.fully_annotated.vcf.gz --gene-coord gene_coord.csv.gz \
+        --transcript ENST00000303395 --score REVEL --threshold-field AC_joint --threshold-value 5 \
+        --format parquet --out SCN1A.parquet
+"""
+import argparse
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+import store
+from gene_index import VariantIndex
+from metrics import LATENCY, RESPONSE_BYTES
+from variants import (COMPACT_COLUMNS, COUNT_FIELDS, POSITION_FIELDS, SCORE_FIELDS, load_gene_coord,
+                      parse_vcf_row)
+
+EXPORT_CHUNK_ROWS = 65536
+EXPORT_SOURCES = ('gnomad', 'clinvar', 'custom')
+# format: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+
+def export_schema():
+    """Arrow schema of the exported rows: source, gene, then the compact columns."""
+    fields = [pa.field('source', pa.string()), pa.field('gene', pa.string())]
+    for col in COMPACT_COLUMNS:
+        if col in POSITION_FIELDS:
+            fields.append(pa.field(col, pa.int32()))
+        elif col in COUNT_FIELDS:
+            fields.append(pa.field(col, pa.uint32()))
+        elif col in SCORE_FIELDS:
+            fields.append(pa.field(col, pa.float32()))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+def export_positions(index, transcript=None, score=None, threshold_field=None, threshold_value=None):
+    """Positions in index.frame of the selected rows (threshold: count > value)."""
+    positions = index.positions(transcript, score)
+    if threshold_field is not None and threshold_field in index.frame.columns:
+        threshold = float(threshold_value) if threshold_value is not None else 0
+        positions = positions[index.frame[threshold_field].to_numpy()[positions] > threshold]
+    return positions
+
+def export_parts(gene_data, gene, transcript=None, score=None, threshold_field=None, threshold_value=None,
+                 sources=EXPORT_SOURCES):
+    """
+    (source, gene, frame, positions) of each source of a loaded gene (the dict
+    of app.load_gene). The threshold filters the gnomAD rows only.
+    """
+    parts = []
+    for source in sources:
+        index = gene_data[source]
+        if index.empty:
+            continue
+        field = threshold_field if source == 'gnomad' else None
+        positions = export_positions(index, transcript, score, field, threshold_value)
+        parts.append((source, gene, index.frame, positions))
+    return parts
+
+def record_batch(frame, positions, source, gene, schema):
+    """RecordBatch of the rows of frame at positions (only these rows are copied)."""
+    n = len(positions)
+    arrays = []
+    for field in schema:
+        if field.name in ('source', 'gene'):
+            arrays.append(pa.array([source if field.name == 'source' else gene] * n, type=pa.string()))
+        elif field.name not in frame.columns:
+            arrays.append(pa.nulls(n, type=field.type))
+        else:
+            arrays.append(pa.Array.from_pandas(frame[field.name].take(positions)).cast(field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class _ChunkSink:
+    """Write-only file object keeping the bytes written until take() hands them out."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def open_writer(fmt, sink, schema):
+    """Arrow IPC stream, Parquet or CSV writer of batches of schema into sink."""
+    if fmt == 'arrow':
+        return pa.ipc.new_stream(sink, schema)
+    if fmt == 'parquet':
+        return pq.ParquetWriter(sink, schema)
+    return pa_csv.CSVWriter(sink, schema)
+
+def stream_export(parts, fmt, chunk_rows=EXPORT_CHUNK_ROWS, route=None):
+    """
+    Yield the bytes of the export of parts (see export_parts) in fmt, chunk by
+    chunk. Its duration is recorded once the last chunk is out, and its size
+    under route (the response size label of the app request, if any).
+    """
+    t0 = time.perf_counter()
+    schema = export_schema()
+    sink = _ChunkSink()
+    writer = open_writer(fmt, pa.PythonFile(sink, mode='w'), schema)
+    for source, gene, frame, positions in parts:
+        for start in range(0, len(positions), chunk_rows):
+            writer.write_batch(record_batch(frame, positions[start:start + chunk_rows], source, gene, schema))
+            data = sink.take()
+            if data:
+                yield data
+    writer.close()
+    yield sink.take()
+    LATENCY.record(f"export_{fmt}", time.perf_counter() - t0)
+    if route is not None:
+        RESPONSE_BYTES.observe(route, sink.position)
+
+def export_filename(gene, transcript, score, fmt):
+    """Default file name of an export, e.g. SCN1A_ENST00000303395_REVEL.csv."""
+    return f"{gene}_{transcript or 'all-transcripts'}_{score or 'all-scores'}.{EXPORT_FORMATS[fmt][1]}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the gnomAD/ClinVar/custom rows of a gene.")
+    parser.add_argument('--gene', required=True)
+    parser.add_argument('--gnomad', help="gnomad_ms.fully_annotated.vcf.gz (not needed for compiled genes)")
+    parser.add_argument('--clinvar', help="clinvar_plp_ms.fully_annotated.vcf.gz")
+    parser.add_argument('--gene-coord', help="gene_coord.csv.gz or its index (not needed for compiled genes)")
+    parser.add_argument('--store', help="Compiled gene store (see store.py), used when the gene is in it")
+    parser.add_argument('--vcf-row', help="Annotated VCF row of a custom variant to export with the gene")
+    parser.add_argument('--transcript', help="Only this transcript (default: all)")
+    parser.add_argument('--score', choices=SCORE_FIELDS, help="Only the rows with this score (default: all)")
+    parser.add_argument('--threshold-field', choices=COUNT_FIELDS, help="Keep the gnomAD rows with field > value")
+    parser.add_argument('--threshold-value', type=float, default=0)
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--out', help="Output file (default: <gene>_<transcript>_<score>.<format>)")
+    args = parser.parse_args(argv)
+
+    gene_coord = load_gene_coord(args.gene_coord) if args.gene_coord else None
+    gene_data = {}
+    for source, vcf_file in [('gnomad', args.gnomad), ('clinvar', args.clinvar)]:
+        if store.has_gene(args.store, args.gene, source) or (vcf_file and gene_coord is not None):
+            gene_data[source] = VariantIndex(store.load_or_parse(args.store, args.gene, source, vcf_file, gene_coord))
+        else:
+            gene_data[source] = VariantIndex(pd.DataFrame())
+    gene_data['custom'] = VariantIndex(parse_vcf_row(args.vcf_row, args.gene) if args.vcf_row else pd.DataFrame())
+    if all(index.empty for index in gene_data.values()):
+        print(f"No rows for {args.gene}: compile it in --store or give --gnomad/--clinvar and --gene-coord")
+        return 1
+
+    parts = export_parts(gene_data, args.gene, args.transcript, args.score, args.threshold_field,
+                         args.threshold_value)
+    out = args.out or export_filename(args.gene, args.transcript, args.score, args.format)
+    t0 = time.time()
+    with open(out, 'wb') as f:
+        for data in stream_export(parts, args.format):
+            f.write(data)
+    n_rows = sum(len(positions) for _, _, _, positions in parts)
+    print(f"Exported {n_rows} rows to {out} ({os.path.getsize(out) / 1e6:.1f} MB) in {time.time() - t0:.2f}s")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+"""
+Cache of the generated figures: the output of the app's plot callback (figure,
+info text and the gnomAD points filtered in the browser).
+
+Entries are keyed on the callback inputs that change the output and on the
+version of the gene data (the files it was loaded from and the custom variant,
+see app.gene_version), plus a digest of the plotting code, so that a changed
+VCF, store or custom variant never serves an old figure.
+
+An output is kept as its Plotly JSON decoded once into plain dicts, lists and
+strings (the arrays stay base64 strings): a hit skips the figure building, and
+Dash re-encodes it much faster than the figure objects. Two levels:
+- an in-process LRU (cache.LRUCache) bounded by entry count and JSON bytes;
+- optionally, a directory shared by the workers and kept across restarts,
+  one JSON file per entry written atomically, pruned oldest-first above its
+  byte budget.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from plotly.io.json import to_json_plotly
+
+from cache import LRUCache
+from metrics import LATENCY
+
+def source_digest(*paths):
+    """Short digest of the content of source files (the code building the figures)."""
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+def cache_key(parts):
+    """File-name safe key of a tuple of JSON-able parts."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+class FigureCache:
+    """Two-level (memory, optional directory) cache of callback outputs."""
+
+    def __init__(self, max_entries=256, max_bytes=None, cache_dir=None, dir_max_bytes=None, name='figure-cache'):
+        # Entries are (output, JSON size): the size is what max_bytes bounds
+        self.memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes, sizeof=lambda entry: entry[1],
+                               name=name)
+        self.cache_dir = cache_dir
+        self.dir_max_bytes = dir_max_bytes
+        self._dir_bytes = None
+        self._dir_lock = threading.Lock()
+        self.disk_hits = 0
+        self.builds = 0
+
+    def get_or_build(self, parts, build):
+        """
+        The output cached for parts (a tuple of the inputs and data version),
+        calling build() on a miss of both levels.
+        """
+        key = cache_key(parts)
+        output, _ = self.memory.get_or_load(key, lambda: self._load(key, build))
+        return output
+
+    def _load(self, key, build):
+        text = self._read(key)
+        if text is None:
+            output = build()
+            with LATENCY.span('figure_cache_encode'):
+                text = to_json_plotly(output)
+            self._write(key, text)
+            self.builds += 1
+        else:
+            self.disk_hits += 1
+        return json.loads(text), len(text)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                text = f.read()
+            # Recently used entries are pruned last
+            os.utime(path)
+            return text
+        except OSError:
+            return None
+
+    def _write(self, key, text):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp, 'w') as f:
+                f.write(text)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"WARNING: could not write the figure cache file {path} ({e})")
+            return
+        with self._dir_lock:
+            if self._dir_bytes is None:
+                self._dir_bytes = sum(size for _, size, _ in self._dir_files())
+            else:
+                self._dir_bytes += len(text)
+            if self.dir_max_bytes is not None and self._dir_bytes > self.dir_max_bytes:
+                self._prune()
+
+    def _dir_files(self):
+        """(path, size, mtime) of the cache files (other workers' included)."""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _prune(self):
+        # Called with _dir_lock held: remove the least recently used files
+        # until the directory is back under 90% of its budget
+        files = sorted(self._dir_files(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for path, size, _ in files:
+            if total <= self.dir_max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._dir_bytes = total
+        print(f"figure cache: pruned {removed} files from {self.cache_dir}")
+
+    def invalidate(self):
+        """Drop the in-process entries (the directory entries are keyed on the data version)."""
+        self.memory.invalidate()
+
+    def stats(self):
+        stats = self.memory.stats()
+        del stats['keys']
+        stats.update(disk_hits=self.disk_hits, builds=self.builds, cache_dir=self.cache_dir,
+                     dir_bytes=self._dir_bytes, dir_max_bytes=self.dir_max_bytes)
+        return stats
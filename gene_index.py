@@ -0,0 +1,103 @@
+"""
+Per-transcript, per-score index of a variant table, built once at load time.
+
+The table is converted to the compact schema (variants.compact_variants) and
+sorted by (transcript, aa_position) (unless it already is, as compiled store
+tables are), so each transcript is a contiguous block. For every
+transcript and score, the positions of the rows with a non-null score are
+precomputed, so the callbacks slice rows instead of rescanning and re-sorting
+the table.
+"""
+import numpy as np
+import pandas as pd
+
+from variants import SCORE_FIELDS, compact_variants
+
+def is_sorted(transcripts, positions):
+    """True if the rows are sorted by (transcript, aa_position)."""
+    same = transcripts[1:] == transcripts[:-1]
+    return bool(np.all((transcripts[1:] > transcripts[:-1]) | (same & (positions[1:] >= positions[:-1]))))
+
+class VariantIndex:
+    """Sorted variant table with per-transcript blocks and per-score row positions."""
+
+    def __init__(self, df):
+        df = compact_variants(df) if df is not None else pd.DataFrame()
+        if df.empty or 'transcript' not in df.columns:
+            self.frame = df.reset_index(drop=True)
+            self._blocks = {}
+            self._rows = {}
+            return
+
+        transcripts = df['transcript'].astype(str).to_numpy()
+        if not is_sorted(transcripts, df['aa_position'].to_numpy()):
+            df = df.sort_values(['transcript', 'aa_position'], kind='stable')
+            transcripts = df['transcript'].astype(str).to_numpy()
+        # Frames from the store are already sorted and compact: they are kept
+        # as is, so their memory-mapped columns are not copied
+        self.frame = df.reset_index(drop=True)
+
+        # Start/end of each transcript block (the table is sorted by transcript)
+        bounds = np.flatnonzero(transcripts[1:] != transcripts[:-1]) + 1
+        starts = np.concatenate([[0], bounds])
+        ends = np.concatenate([bounds, [len(df)]])
+        self._blocks = {transcripts[s]: (int(s), int(e)) for s, e in zip(starts, ends)}
+
+        # Positions (within the block) of the rows with a non-null score
+        self._rows = {}
+        for score in SCORE_FIELDS:
+            if score not in df.columns:
+                continue
+            notna = df[score].notna().to_numpy()
+            for transcript, (s, e) in self._blocks.items():
+                self._rows[(transcript, score)] = np.flatnonzero(notna[s:e])
+
+    @property
+    def empty(self):
+        return self.frame.empty
+
+    @property
+    def transcripts(self):
+        return sorted(self._blocks)
+
+    @property
+    def nbytes(self):
+        return int(self.frame.memory_usage(deep=True).sum()) + \
+            sum(rows.nbytes for rows in self._rows.values())
+
+    def __len__(self):
+        return len(self.frame)
+
+    def block(self, transcript):
+        """All rows of a transcript, sorted by aa_position."""
+        s, e = self._blocks.get(transcript, (0, 0))
+        return self.frame.iloc[s:e]
+
+    def rows(self, transcript, score):
+        """Rows of a transcript with a non-null score, sorted by aa_position."""
+        if (transcript, score) not in self._rows:
+            return self.frame.iloc[0:0]
+        return self.block(transcript).take(self._rows[(transcript, score)])
+
+    def positions(self, transcript=None, score=None):
+        """
+        Positions in frame of the rows of a transcript (every transcript if
+        None), with a non-null score if given, sorted by transcript and aa_position.
+        """
+        transcripts = self.transcripts if transcript is None else [transcript]
+        parts = []
+        for name in transcripts:
+            s, e = self._blocks.get(name, (0, 0))
+            if score is None:
+                parts.append(np.arange(s, e))
+            elif (name, score) in self._rows:
+                parts.append(s + self._rows[(name, score)])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def count(self, transcript, score=None):
+        """Number of rows of a transcript (with a non-null score if given)."""
+        if score is None:
+            s, e = self._blocks.get(transcript, (0, 0))
+            return e - s
+        rows = self._rows.get((transcript, score))
+        return 0 if rows is None else len(rows)
@@ -0,0 +1,292 @@
+"""
+Gene resolver: compact index of the gene coordinate table.
+
+Genes are looked up by HGNC symbol, gene name, alias/previous symbol (from an
+optional HGNC table) or Ensembl gene ID (with or without version), by binary
+search (np.searchsorted) in a sorted array of the upper-cased keys, and by
+genomic position through per-chromosome sorted interval arrays.
+The index is serialized to a .npz file (plain arrays, no pickle), so loading
+it does not need pandas nor the gzipped CSV.
+
+Usage:
+    python gene_resolver.py build --gene-coord gene_coord.csv.gz \
+        [--hgnc hgnc_complete_set.txt] [--out gene_coord.idx.npz]
+    python gene_resolver.py lookup --index gene_coord.idx.npz SCN1A ENSG00000144285 2:166000000
+"""
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+
+# Chromosomes kept from the gene coordinate table (drop alt haplotypes/scaffolds)
+CONV_CHROMS = [str(i) for i in range(1, 23)] + ['X', 'Y', 'MT']
+
+INDEX_VERSION = 1
+# Arrays of the serialized index, one element per gene locus
+LOCUS_ARRAYS = ['symbol', 'name', 'ensg', 'ensg_version', 'chrom', 'start', 'end']
+# Lookup keys in priority order: a key claimed by an earlier kind is not
+# reassigned by a later one (an alias never shadows a symbol)
+KEY_KINDS = ['symbol', 'ensg', 'ensg_version', 'name', 'alias']
+
+def index_path(gene_coord_file):
+    """Default location of the prebuilt index of a gene_coord.csv.gz file."""
+    base = gene_coord_file[:-len('.csv.gz')] if gene_coord_file.endswith('.csv.gz') else gene_coord_file
+    return f"{base}.idx.npz"
+
+def read_hgnc_aliases(hgnc_file):
+    """
+    (alias, symbol) pairs from the HGNC complete set (tab-separated, with the
+    'symbol', 'alias_symbol' and 'prev_symbol' columns, '|'-separated lists).
+    """
+    import pandas as pd
+    hgnc = pd.read_csv(hgnc_file, sep='\t', usecols=['symbol', 'alias_symbol', 'prev_symbol'], dtype=str)
+    pairs = []
+    for column in ['alias_symbol', 'prev_symbol']:
+        for symbol, aliases in zip(hgnc['symbol'], hgnc[column]):
+            if isinstance(aliases, str):
+                pairs.extend((alias, symbol) for alias in aliases.split('|') if alias)
+    return pairs
+
+def build_keys(arrays, aliases=()):
+    """
+    Sorted lookup keys (upper case) and the locus row of each key, following
+    the KEY_KINDS priority. A key has one entry per locus of its gene.
+    """
+    symbol_rows = {}
+    for row, symbol in enumerate(arrays['symbol'].tolist()):
+        symbol_rows.setdefault(symbol.upper(), []).append(row)
+    kind_of_key = {}
+    entries = set()
+    for kind in KEY_KINDS:
+        if kind == 'alias':
+            pairs = [(alias, row) for alias, symbol in aliases for row in symbol_rows.get(symbol.upper(), [])]
+        else:
+            pairs = enumerate(arrays[kind].tolist())
+            pairs = [(key, row) for row, key in pairs]
+        for key, row in pairs:
+            key = key.upper()
+            if key and kind_of_key.setdefault(key, kind) == kind:
+                entries.add((key, row))
+    entries = sorted(entries)
+    keys = np.array([key for key, _ in entries], dtype=str)
+    rows = np.array([row for _, row in entries], dtype=np.int32)
+    return keys, rows
+
+class GeneResolver:
+    """
+    Gene loci (sorted by chromosome and start) with key and interval lookups.
+    `keys`/`key_rows` are the sorted lookup keys built by build_keys.
+    """
+
+    def __init__(self, arrays, keys, key_rows, aliases=()):
+        self.arrays = arrays
+        self.keys = keys
+        self.key_rows = key_rows
+        self.aliases = list(aliases)
+
+        # Per-chromosome slices of the loci. max_end is the running maximum of
+        # the ends, used to find the first locus that can still overlap a position.
+        chrom = self.arrays['chrom']
+        self._chroms = {}
+        bounds = np.flatnonzero(chrom[1:] != chrom[:-1]) + 1
+        for s, e in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(chrom)]])):
+            if e > s:
+                self._chroms[str(chrom[s])] = (int(s), int(e))
+        self._max_end = np.empty(len(chrom), dtype=np.int64)
+        for s, e in self._chroms.values():
+            self._max_end[s:e] = np.maximum.accumulate(self.arrays['end'][s:e])
+
+    @classmethod
+    def from_arrays(cls, arrays, aliases=()):
+        """Build from per-locus arrays (LOCUS_ARRAYS) in any order."""
+        order = np.lexsort((arrays['start'], arrays['chrom']))
+        arrays = {name: np.asarray(arrays[name])[order] for name in LOCUS_ARRAYS}
+        aliases = [(str(a), str(s)) for a, s in aliases]
+        keys, key_rows = build_keys(arrays, aliases)
+        return cls(arrays, keys, key_rows, aliases)
+
+    @classmethod
+    def from_frame(cls, gene_coord_df, aliases=()):
+        """Build from the gene coordinate table (conventional chromosomes only)."""
+        df = gene_coord_df[gene_coord_df['Chromosome/scaffold name'].astype(str).isin(CONV_CHROMS)]
+        name = df['Gene name'].fillna('').astype(str)
+        # Genes without an HGNC symbol are known by their gene name
+        symbol = df['HGNC symbol'].fillna('').astype(str)
+        symbol = symbol.where(symbol != '', name)
+        arrays = {
+            'symbol': symbol.to_numpy(dtype=str),
+            'name': name.to_numpy(dtype=str),
+            'ensg': df['Gene stable ID'].fillna('').astype(str).to_numpy(dtype=str),
+            'ensg_version': df['Gene stable ID version'].fillna('').astype(str).to_numpy(dtype=str),
+            'chrom': df['Chromosome/scaffold name'].astype(str).to_numpy(dtype=str),
+            'start': df['Gene start (bp)'].to_numpy(dtype=np.int64),
+            'end': df['Gene end (bp)'].to_numpy(dtype=np.int64),
+        }
+        return cls.from_arrays(arrays, aliases)
+
+    @classmethod
+    def from_csv(cls, gene_coord_file, hgnc_file=None):
+        """Build from gene_coord.csv.gz (and the HGNC complete set for aliases)."""
+        import pandas as pd
+        df = pd.read_csv(gene_coord_file, compression='gzip')
+        return cls.from_frame(df, read_hgnc_aliases(hgnc_file) if hgnc_file else ())
+
+    def save(self, path):
+        """Serialize the index to a .npz file."""
+        alias = np.array([a for a, _ in self.aliases], dtype=str)
+        alias_symbol = np.array([s for _, s in self.aliases], dtype=str)
+        tmp = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez_compressed(tmp, version=np.array(INDEX_VERSION), keys=self.keys, key_rows=self.key_rows,
+                            alias=alias, alias_symbol=alias_symbol, **self.arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save()."""
+        with np.load(path, allow_pickle=False) as npz:
+            if int(npz['version']) != INDEX_VERSION:
+                raise ValueError(f"Gene index {path} has version {int(npz['version'])}, expected "
+                                 f"{INDEX_VERSION}. Rebuild it with `python gene_resolver.py build`.")
+            arrays = {name: npz[name] for name in LOCUS_ARRAYS}
+            aliases = zip(npz['alias'].tolist(), npz['alias_symbol'].tolist())
+            return cls(arrays, npz['keys'], npz['key_rows'], aliases)
+
+    def __len__(self):
+        return len(self.arrays['symbol'])
+
+    def __contains__(self, query):
+        return len(self._rows(query)) > 0
+
+    def _rows(self, query):
+        """Locus rows of a key (binary search in the sorted keys)."""
+        key = str(query).strip().upper()
+        lo, hi = np.searchsorted(self.keys, key, side='left'), np.searchsorted(self.keys, key, side='right')
+        if lo == hi and key.startswith('ENSG') and '.' in key:
+            # Other version of a known Ensembl ID
+            return self._rows(key.split('.')[0])
+        return self.key_rows[lo:hi].tolist()
+
+    def symbols(self):
+        """Sorted list of the distinct gene symbols."""
+        return sorted(set(self.arrays['symbol'].tolist()) - {''})
+
+    def locus(self, row):
+        """One locus as a dict."""
+        return {
+            'symbol': str(self.arrays['symbol'][row]), 'name': str(self.arrays['name'][row]),
+            'ensg': str(self.arrays['ensg'][row]), 'chrom': str(self.arrays['chrom'][row]),
+            'start': int(self.arrays['start'][row]), 'end': int(self.arrays['end'][row]),
+        }
+
+    def lookup(self, query):
+        """
+        Loci of a gene given its symbol, name, alias or Ensembl ID (case-insensitive).
+        A gene can have several loci (e.g. PAR genes on X and Y). Empty list if unknown.
+        """
+        return [self.locus(row) for row in self._rows(query)]
+
+    def resolve(self, query):
+        """HGNC symbol of a gene given any of its keys, or None if unknown."""
+        loci = self.lookup(query)
+        return loci[0]['symbol'] if loci else None
+
+    def regions(self, query):
+        """
+        (chrom, start, end) regions to query for a gene: its loci, with the
+        overlapping loci of a chromosome merged. Raises ValueError if unknown.
+        """
+        loci = sorted(self.lookup(query), key=lambda locus: (locus['chrom'], locus['start']))
+        if not loci:
+            raise ValueError(f"Gene {query} not found in the gene coordinates")
+        regions = []
+        for locus in loci:
+            if regions and regions[-1][0] == locus['chrom'] and locus['start'] <= regions[-1][2]:
+                regions[-1][2] = max(regions[-1][2], locus['end'])
+            else:
+                regions.append([locus['chrom'], locus['start'], locus['end']])
+        return [tuple(r) for r in regions]
+
+    def overlapping(self, chrom, start, end=None):
+        """Loci overlapping chrom:start-end (or the single position start), sorted by start."""
+        chrom = str(chrom)
+        if chrom.startswith('chr'):
+            chrom = chrom[3:]
+        end = start if end is None else end
+        if chrom not in self._chroms:
+            return []
+        s, e = self._chroms[chrom]
+        # Loci starting after `end` cannot overlap; before `first`, all loci end before `start`
+        last = s + int(np.searchsorted(self.arrays['start'][s:e], end, side='right'))
+        first = s + int(np.searchsorted(self._max_end[s:e], start, side='left'))
+        rows = first + np.flatnonzero(self.arrays['end'][first:last] >= start)
+        return [self.locus(row) for row in rows]
+
+def load_gene_resolver(path, hgnc_file=None):
+    """
+    Load a gene resolver from a prebuilt .npz index, or from gene_coord.csv.gz.
+    For a CSV, a sibling index (see index_path) newer than the CSV is used
+    instead; the first CSV load writes it when its directory is writable, so
+    later starts skip pandas and the CSV parsing.
+    """
+    if path.endswith('.npz'):
+        return GeneResolver.load(path)
+    prebuilt = index_path(path)
+    if hgnc_file is None and os.path.exists(prebuilt) and os.path.getmtime(prebuilt) >= os.path.getmtime(path):
+        return GeneResolver.load(prebuilt)
+    resolver = GeneResolver.from_csv(path, hgnc_file)
+    if hgnc_file is None and os.access(os.path.dirname(os.path.abspath(prebuilt)), os.W_OK):
+        try:
+            resolver.save(prebuilt)
+            print(f"Wrote the gene index {prebuilt} (used by the next loads)")
+        except OSError as e:
+            print(f"WARNING: could not write the gene index {prebuilt} ({e})")
+    return resolver
+
+def parse_position(text):
+    """'chrom:pos' or 'chrom:start-end' (commas allowed) to (chrom, start, end), None otherwise."""
+    match = re.fullmatch(r'(?:chr)?([0-9XYMT]+):([\d,]+)(?:-([\d,]+))?', text.strip(), flags=re.I)
+    if not match:
+        return None
+    start = int(match.group(2).replace(',', ''))
+    end = int(match.group(3).replace(',', '')) if match.group(3) else start
+    return match.group(1).upper(), start, end
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the gene coordinate index.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('build', help="Build the index from gene_coord.csv.gz")
+    p.add_argument('--gene-coord', required=True, help="gene_coord.csv.gz")
+    p.add_argument('--hgnc', help="HGNC complete set (hgnc_complete_set.txt), for aliases and previous symbols")
+    p.add_argument('--out', help="Index file (default: next to the CSV, .idx.npz)")
+
+    p = sub.add_parser('lookup', help="Resolve genes (symbol, name, alias, ENSG) or positions (chrom:pos[-end])")
+    p.add_argument('--index', required=True, help="Index file or gene_coord.csv.gz")
+    p.add_argument('queries', nargs='+')
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        t0 = time.time()
+        resolver = GeneResolver.from_csv(args.gene_coord, args.hgnc)
+        out = args.out or index_path(args.gene_coord)
+        resolver.save(out)
+        print(f"Indexed {len(resolver)} loci ({len(resolver.aliases)} aliases) into {out} "
+              f"in {time.time() - t0:.1f}s")
+        return 0
+
+    t0 = time.time()
+    resolver = load_gene_resolver(args.index)
+    print(f"Loaded {len(resolver)} loci in {(time.time() - t0) * 1000:.0f} ms")
+    for query in args.queries:
+        position = parse_position(query)
+        loci = resolver.overlapping(*position) if position else resolver.lookup(query)
+        if not loci:
+            print(f"{query}\tnot found")
+        for locus in loci:
+            print(f"{query}\t{locus['symbol']}\t{locus['ensg']}\t{locus['chrom']}:{locus['start']}-{locus['end']}")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
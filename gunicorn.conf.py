@@ -0,0 +1,19 @@
+"""
+gunicorn settings for wsgi.py (`gunicorn -c gunicorn.conf.py wsgi:server`).
+"""
+import gc
+import os
+
+bind = os.environ.get('MISSENSE_VISUAL_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('MISSENSE_VISUAL_WORKERS', 4))
+# Threads serve concurrent callbacks of one worker from the same gene cache
+threads = int(os.environ.get('MISSENSE_VISUAL_THREADS', 4))
+# Load the data once in the master, before the workers are forked
+preload_app = True
+# Large genes can take a while to load on a cache miss
+timeout = 300
+
+def pre_fork(server, worker):
+    # Move the preloaded objects out of the garbage collector's generations, so
+    # collections in the workers do not touch (and copy) their pages
+    gc.freeze()
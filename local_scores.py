@@ -0,0 +1,228 @@
+"""
+Offline scoring of a variant (chrom, pos, ref, alt) from local indexed files.
+
+Every source is queried with a one-base region query on its index, then the
+records are matched exactly on ref and alt:
+- BCSQ-annotated VCFs (the gnomAD and ClinVar VCFs of the app, or any VCF
+  whose INFO fields are named as SCORE_FIELDS), read through cyvcf2;
+- bgzipped, tabix-indexed score tables (e.g. AlphaMissense_hg38.tsv.gz or
+  CADD whole_genome_SNVs.tsv.gz), whose last '#' header line names the
+  columns (see COLUMN_ALIASES), read through pysam (pip install pysam).
+Sources are read in order: the first one with a value gives each score, and
+the first VCF holding the variant gives its BCSQ. Results are kept in an
+exact-match index, so a variant is only looked up once.
+
+Usage:
+    python local_scores.py --vcf gnomad_ms.fully_annotated.vcf.gz \
+        --vcf clinvar_plp_ms.fully_annotated.vcf.gz --table AlphaMissense_hg38.tsv.gz 2-166000000-C-G
+"""
+import argparse
+import re
+import time
+
+from cyvcf2 import VCF
+
+from variants import SCORE_FIELDS, parse_info_field
+
+# INFO fields taken from the sources (MISTIC_pred goes with MISTIC_score)
+LOCAL_FIELDS = SCORE_FIELDS + ['MISTIC_pred']
+# Score table columns read as a field, besides the columns named as LOCAL_FIELDS
+COLUMN_ALIASES = {
+    'chr': 'chrom', '#chr': 'chrom', 'chrom': 'chrom', '#chrom': 'chrom',
+    'pos': 'pos', 'grch38_pos': 'pos', 'ref': 'ref', 'alt': 'alt',
+    'phred': 'cadd_v1.7',
+}
+
+def parse_variant_string(text):
+    """(chrom, pos, ref, alt) of a chrom-pos-ref-alt string (e.g. VEP's vcf_string), or None."""
+    match = re.fullmatch(r'(?:chr)?([0-9XYMT]+)[-:_](\d+)[-:_]([ACGTN]+)[-:_>]([ACGTN]+)', text.strip(),
+                         flags=re.IGNORECASE)
+    if not match:
+        return None
+    chrom, pos, ref, alt = match.groups()
+    return chrom.upper(), int(pos), ref.upper(), alt.upper()
+
+def contig_name(chrom, contigs):
+    """The name of chrom in a file's contigs (with or without 'chr'), or None."""
+    for name in (chrom, f"chr{chrom}", chrom[3:] if chrom.startswith('chr') else None):
+        if name in contigs:
+            return name
+    return None
+
+def read_table_columns(tabix_file):
+    """Field of each column of a score table (None for the columns not used)."""
+    header = [line for line in tabix_file.header if line.startswith('#')]
+    if not header:
+        raise ValueError(f"{tabix_file.filename} has no '#' header line naming its columns")
+    names = header[-1].rstrip('\n').split('\t')
+    return [name if name in LOCAL_FIELDS else COLUMN_ALIASES.get(name.lower()) for name in names]
+
+class VcfSource:
+    """A BCSQ-annotated (or score-annotated) indexed VCF."""
+
+    def __init__(self, path):
+        self.path = path
+        self.vcf = VCF(path)
+        self.contigs = set(self.vcf.seqnames)
+
+    def query(self, chrom, pos, ref, alt):
+        """INFO fields (BCSQ and LOCAL_FIELDS) and ID of the record matching exactly, or None."""
+        contig = contig_name(chrom, self.contigs)
+        if contig is None:
+            return None
+        for record in self.vcf(f"{contig}:{pos}-{pos}"):
+            if record.POS == pos and record.REF == ref and alt in record.ALT:
+                info = record.INFO
+                fields = {name: info.get(name) for name in ['BCSQ'] + LOCAL_FIELDS}
+                fields['ID'] = record.ID
+                return fields
+        return None
+
+    def close(self):
+        self.vcf.close()
+
+class TableSource:
+    """A bgzipped, tabix-indexed score table (one row per chrom, pos, ref, alt)."""
+
+    def __init__(self, path):
+        import pysam
+        self.path = path
+        self.tabix = pysam.TabixFile(path)
+        self.contigs = set(self.tabix.contigs)
+        self.columns = read_table_columns(self.tabix)
+        missing = {'chrom', 'pos', 'ref', 'alt'} - set(self.columns)
+        if missing:
+            raise ValueError(f"{path} has no {', '.join(sorted(missing))} column")
+
+    def query(self, chrom, pos, ref, alt):
+        """Fields (LOCAL_FIELDS) of the row matching exactly, or None."""
+        contig = contig_name(chrom, self.contigs)
+        if contig is None:
+            return None
+        for line in self.tabix.fetch(contig, pos - 1, pos):
+            row = {field: value for field, value in zip(self.columns, line.split('\t')) if field}
+            if int(row['pos']) == pos and row['ref'] == ref and row['alt'] == alt:
+                return {name: row[name] for name in LOCAL_FIELDS if row.get(name) not in (None, '', '.')}
+        return None
+
+    def close(self):
+        self.tabix.close()
+
+class LocalScorer:
+    """Scores of variants looked up in local VCFs and score tables (see module docstring)."""
+
+    def __init__(self, vcf_files=(), score_tables=()):
+        self.sources = [VcfSource(path) for path in vcf_files if path]
+        if score_tables:
+            try:
+                import pysam  # noqa: F401
+            except ImportError:
+                raise ImportError("Score tables are read with pysam (pip install pysam)")
+            self.sources += [TableSource(path) for path in score_tables]
+        self._found = {}
+
+    def lookup(self, chrom, pos, ref, alt):
+        """
+        Fields of a variant: BCSQ and ID (from the first VCF holding it) and the
+        LOCAL_FIELDS found in any source. None when no source holds it.
+        """
+        key = (str(chrom), int(pos), ref, alt)
+        if key not in self._found:
+            fields = None
+            for source in self.sources:
+                found = source.query(*key)
+                if found is None:
+                    continue
+                fields = fields or {}
+                for name, value in found.items():
+                    if value is not None and fields.get(name) is None:
+                        fields[name] = value
+            self._found[key] = fields
+        return self._found[key]
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+def format_value(value):
+    """INFO text of a field value (floats read as float32 by cyvcf2 without the float noise)."""
+    return f"{value:.7g}" if isinstance(value, float) else str(value)
+
+def info_with_fields(info_str, fields):
+    """
+    An INFO string with the LOCAL_FIELDS of fields set (replacing the values
+    already there) and fields' BCSQ added when the INFO has none.
+    """
+    info = parse_info_field(info_str) if info_str and info_str != '.' else {}
+    if 'BCSQ' not in info and fields.get('BCSQ'):
+        info = {'BCSQ': fields['BCSQ'], **info}
+    for name in LOCAL_FIELDS:
+        if fields.get(name) is not None:
+            info[name] = format_value(fields[name])
+    return ";".join(key if value is True else f"{key}={value}" for key, value in info.items())
+
+def local_vcf_row(scorer, vcf_string):
+    """
+    Build an annotated VCF row (same layout as vep.vep_to_vcf_row) for a
+    chrom-pos-ref-alt string from the local sources alone. Returns
+    (vcf_row, vcf_string) or (None, None) when the variant is not found or has
+    no BCSQ annotation (it is in none of the VCFs).
+    """
+    variant = parse_variant_string(vcf_string)
+    if variant is None:
+        print(f"Warning: '{vcf_string}' is not a chrom-pos-ref-alt variant.")
+        return None, None
+    fields = scorer.lookup(*variant)
+    if not fields or not fields.get('BCSQ'):
+        return None, None
+    chrom, pos, ref, alt = variant
+    rsid = fields.get('ID') or '.'
+    vcf_row = "\t".join(map(str, [chrom, pos, rsid, ref, alt, '.', '.', info_with_fields('', fields)]))
+    return vcf_row, f"{chrom}-{pos}-{ref}-{alt}"
+
+def score_vcf_row(scorer, vcf_row):
+    """
+    A VCF row (e.g. from VEP) with its scores replaced by the local ones, and
+    the local BCSQ added if it has none. Returns (vcf_row, found).
+    """
+    fields = vcf_row.split('\t')
+    if len(fields) < 8:
+        return vcf_row, False
+    chrom, pos, _, ref, alt = fields[0:5]
+    found = scorer.lookup(chrom, int(pos), ref, alt)
+    if not found:
+        return vcf_row, False
+    fields[7] = info_with_fields(fields[7], found)
+    return "\t".join(fields), True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score variants (chrom-pos-ref-alt) from local indexed files.")
+    parser.add_argument('variants', nargs='+', help="Variants as chrom-pos-ref-alt, e.g. 2-166000000-C-G")
+    parser.add_argument('--vcf', action='append', default=[],
+                        help="Annotated, indexed VCF (repeatable; e.g. the gnomAD and ClinVar VCFs)")
+    parser.add_argument('--table', action='append', default=[],
+                        help="bgzipped, tabix-indexed score table (repeatable; needs pysam)")
+    args = parser.parse_args(argv)
+    if not args.vcf and not args.table:
+        parser.error("give at least one --vcf or --table")
+
+    scorer = LocalScorer(args.vcf, args.table)
+    n_missing = 0
+    for text in args.variants:
+        variant = parse_variant_string(text)
+        if variant is None:
+            parser.error(f"'{text}' is not a chrom-pos-ref-alt variant")
+        t0 = time.perf_counter()
+        fields = scorer.lookup(*variant)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if not fields:
+            n_missing += 1
+            print(f"{text}\tNOT FOUND\t{elapsed:.1f} ms")
+            continue
+        scores = ";".join(f"{name}={format_value(fields[name])}" for name in LOCAL_FIELDS if fields.get(name) is not None)
+        print(f"{text}\t{scores or 'no score'}\t{elapsed:.1f} ms")
+    scorer.close()
+    return 1 if n_missing else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
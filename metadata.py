@@ -0,0 +1,106 @@
+"""
+Dataset metadata read from the VCF headers (file date, sources and versions,
+INFO field definitions).
+
+Only the header is read (through cyvcf2), never the records. The metadata is
+cached as JSON in the compiled store (<store_dir>/_metadata/<source>.json), so
+a store-only deployment knows its dataset versions without the VCFs.
+"""
+import json
+import os
+import re
+
+from cyvcf2 import VCF
+
+METADATA_VERSION = 1
+# Generic header keys shown as dataset versions, besides the keys containing "version"
+VERSION_KEYS = ('source', 'reference', 'fileDate')
+
+def read_vcf_metadata(vcf_file):
+    """Header metadata of a VCF (constant time: the records are not read)."""
+    vcf = VCF(vcf_file)
+    info = {}
+    for record in vcf.header_iter():
+        fields = record.info()
+        if fields.get('HeaderType') == 'INFO':
+            info[fields['ID']] = {
+                'type': fields.get('Type'),
+                'number': fields.get('Number'),
+                'description': fields.get('Description', '').strip('"'),
+            }
+    # Unstructured ##key=value lines (fileDate, source, tool versions and commands)
+    generic = {}
+    for line in vcf.raw_header.splitlines():
+        match = re.match(r'##([^=<]+)=([^<].*)$', line)
+        if match:
+            generic.setdefault(match.group(1), match.group(2).strip())
+    vcf.close()
+    stat = os.stat(vcf_file)
+    return {
+        'version': METADATA_VERSION,
+        'vcf': os.path.abspath(vcf_file),
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+        'file_date': generic.get('fileDate'),
+        'header': generic,
+        'info': info,
+    }
+
+def metadata_path(store_dir, source):
+    """Cache file of the metadata of one source in a compiled store."""
+    return os.path.join(store_dir, '_metadata', f"{source}.json")
+
+def write_metadata(store_dir, source, metadata):
+    """Cache the metadata of a source in the store."""
+    path = metadata_path(store_dir, source)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(metadata, f, indent=1)
+    os.replace(tmp, path)
+
+def read_cached_metadata(store_dir, source):
+    """Cached metadata of a source, or None."""
+    path = metadata_path(store_dir, source) if store_dir else None
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        metadata = json.load(f)
+    return metadata if metadata.get('version') == METADATA_VERSION else None
+
+def is_current(metadata, vcf_file):
+    """True if cached metadata was read from this VCF as it is now (or the VCF is not available)."""
+    if not vcf_file or not os.path.exists(vcf_file):
+        return True
+    stat = os.stat(vcf_file)
+    return (metadata.get('vcf') == os.path.abspath(vcf_file) and metadata.get('size') == stat.st_size
+            and metadata.get('mtime') == stat.st_mtime)
+
+def load_metadata(vcf_file, source, store_dir=None):
+    """
+    Metadata of a source: from the store cache when it matches the VCF, else
+    read from the VCF header (and cached when there is a store). None when
+    neither the cache nor the VCF is available.
+    """
+    cached = read_cached_metadata(store_dir, source)
+    if cached is not None and is_current(cached, vcf_file):
+        return cached
+    if not vcf_file or not os.path.exists(vcf_file):
+        return None
+    metadata = read_vcf_metadata(vcf_file)
+    if store_dir and os.path.isdir(store_dir):
+        write_metadata(store_dir, source, metadata)
+    return metadata
+
+def dataset_versions(metadata):
+    """Version-like header entries (source, reference, *version*), in header order."""
+    if not metadata:
+        return {}
+    return {key: value for key, value in metadata['header'].items()
+            if key in VERSION_KEYS or 'version' in key.lower()}
+
+def field_description(metadata, field):
+    """Description of an INFO field (e.g. the version of a score), or None."""
+    if not metadata:
+        return None
+    return metadata['info'].get(field, {}).get('description') or None
@@ -0,0 +1,243 @@
+"""
+Instrumentation of the load and callback hot paths.
+
+Timing spans (`with LATENCY.span('bcsq_parsing'):`, or the timed decorator)
+record their wall time:
+- in a bounded window of recent calls per span, whose percentiles
+  (p50/p95/p99) are served as JSON by the app;
+- in cumulative histograms, served with the error counters and the response
+  sizes in the Prometheus text format (prometheus_text, the app's /metrics);
+- in the trace of the current request, if one is started (start_trace): the
+  app logs one line per request with its spans, as JSON when STRUCTURED_LOGS
+  is set.
+RequestProfiler dumps opt-in per-request profiles (cProfile, or pyinstrument).
+"""
+import contextlib
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Print the request lines and errors as JSON (one object per line)
+STRUCTURED_LOGS = False
+METRIC_PREFIX = 'missense_visual'
+SPAN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)
+
+# Spans of the request being served by this thread (None outside a request)
+_TRACE = contextvars.ContextVar('trace', default=None)
+
+class Histogram:
+    """Cumulative histogram (Prometheus semantics) of values per label value."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._counts = {}
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            counts = self._counts.setdefault(label, [0] * (len(self.buckets) + 1))
+            counts[np.searchsorted(self.buckets, value)] += 1
+            self._sums[label] = self._sums.get(label, 0.0) + value
+
+    def lines(self, metric, label_name, help_text):
+        """Prometheus exposition lines of the histogram."""
+        out = [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        with self._lock:
+            items = sorted((label, list(counts), self._sums[label]) for label, counts in self._counts.items())
+        for label, counts, total in items:
+            cumulative = np.cumsum(counts)
+            for bound, count in zip(self.buckets, cumulative):
+                out.append(f'{metric}_bucket{{{label_name}="{label}",le="{bound:g}"}} {count}')
+            out.append(f'{metric}_bucket{{{label_name}="{label}",le="+Inf"}} {cumulative[-1]}')
+            out.append(f'{metric}_sum{{{label_name}="{label}"}} {total:.6f}')
+            out.append(f'{metric}_count{{{label_name}="{label}"}} {cumulative[-1]}')
+        return out
+
+class LatencyRecorder:
+    """Keeps the last `window` durations (seconds) of each named operation."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.histogram = Histogram(SPAN_BUCKETS)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            self._counts[name] = self._counts.get(name, 0) + 1
+        self.histogram.observe(name, seconds)
+        trace = _TRACE.get()
+        if trace is not None:
+            trace['spans'][name] = trace['spans'].get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Context manager recording the duration of its block under `name`."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def timed(self, name, callback=False, ignore=()):
+        """
+        Decorator recording the duration of every call under `name`. For Dash
+        callbacks (callback=True) the request trace also keeps the callback
+        time, and exceptions other than `ignore` (e.g. PreventUpdate) are
+        counted and logged before being raised again.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except ignore:
+                    raise
+                except Exception as e:
+                    if callback:
+                        record_error(name, e)
+                    raise
+                finally:
+                    seconds = time.perf_counter() - t0
+                    self.record(name, seconds)
+                    trace = _TRACE.get()
+                    if callback and trace is not None:
+                        trace['callback'] = name
+                        trace['callback_seconds'] = trace.get('callback_seconds', 0.0) + seconds
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """{name: {count, p50_ms, p95_ms, p99_ms, max_ms}} over the recent window."""
+        with self._lock:
+            samples = {name: np.array(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+        out = {}
+        for name, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            out[name] = {
+                'count': counts[name], 'window': len(values),
+                'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2),
+                'max_ms': round(values.max() * 1000, 2),
+            }
+        return out
+
+LATENCY = LatencyRecorder()
+# Size of the responses, per Dash callback output or Flask endpoint
+RESPONSE_BYTES = Histogram(SIZE_BUCKETS)
+_ERRORS = {}
+_ERRORS_LOCK = threading.Lock()
+
+def log_event(event, message=None, **fields):
+    """Print an event: a JSON object with STRUCTURED_LOGS, else the message (or the fields)."""
+    if STRUCTURED_LOGS:
+        print(json.dumps(dict(event=event, time=round(time.time(), 3), pid=os.getpid(), **fields),
+                         default=str), flush=True)
+    else:
+        print(message or f"{event}: " + " ".join(f"{key}={value}" for key, value in fields.items()))
+
+def record_error(where, error):
+    """Count an error (per place) and log it."""
+    with _ERRORS_LOCK:
+        _ERRORS[where] = _ERRORS.get(where, 0) + 1
+    log_event('error', f"Error in {where}: {error}", where=where, error=repr(error))
+
+def start_trace(**fields):
+    """Start collecting the spans of the current request; returns the token for end_trace."""
+    return _TRACE.set(dict(fields, spans={}))
+
+def current_trace():
+    return _TRACE.get()
+
+def end_trace(token):
+    """Stop collecting the spans of the request, returning its trace."""
+    trace = _TRACE.get()
+    _TRACE.reset(token)
+    return trace
+
+def prometheus_text(gauges=None, counters=None):
+    """
+    Every metric in the Prometheus text format. gauges and counters: {name:
+    (help, value)} of process-level values added as gauges (e.g. the gene
+    cache size) and counters (counts since the start, e.g. the gene cache
+    hits; exported as name_total).
+    """
+    lines = LATENCY.histogram.lines(f"{METRIC_PREFIX}_span_seconds", 'span',
+                                    "Wall time of the instrumented spans and callbacks")
+    lines += RESPONSE_BYTES.lines(f"{METRIC_PREFIX}_response_bytes", 'route',
+                                  "Response body size per Dash callback output or endpoint")
+    lines += [f"# HELP {METRIC_PREFIX}_errors_total Errors per callback or processing step",
+              f"# TYPE {METRIC_PREFIX}_errors_total counter"]
+    with _ERRORS_LOCK:
+        lines += [f'{METRIC_PREFIX}_errors_total{{where="{where}"}} {count}' for where, count in sorted(_ERRORS.items())]
+    for name, (help_text, value) in (gauges or {}).items():
+        lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}", f"# TYPE {METRIC_PREFIX}_{name} gauge",
+                  f"{METRIC_PREFIX}_{name} {0 if value is None else value}"]
+    for name, (help_text, value) in (counters or {}).items():
+        lines += [f"# HELP {METRIC_PREFIX}_{name}_total {help_text}",
+                  f"# TYPE {METRIC_PREFIX}_{name}_total counter",
+                  f"{METRIC_PREFIX}_{name}_total {value or 0}"]
+    return "\n".join(lines) + "\n"
+
+class RequestProfiler:
+    """
+    Opt-in profiles of single requests, written to out_dir: cProfile (.prof,
+    open with `python -m pstats` or snakeviz) or pyinstrument (.html, needs
+    `pip install pyinstrument`). One request is profiled at a time.
+    """
+
+    def __init__(self, out_dir, sample_rate=0.0, tool='cprofile'):
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+        self.tool = tool
+        self._busy = threading.Lock()
+        self._rng = np.random.default_rng()
+        if tool == 'pyinstrument':
+            import pyinstrument  # noqa: F401
+
+    def start(self, forced=False):
+        """A running profiler if this request is profiled (forced or sampled), else None."""
+        if not forced and not (self.sample_rate and self._rng.random() < self.sample_rate):
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        if self.tool == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop(self, profiler, name, seconds):
+        """Stop a profiler and write its dump. Returns the file path."""
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            base = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{re.sub(r'[^A-Za-z0-9._-]+', '_', name)}"
+            base = os.path.join(self.out_dir, f"{base}_{seconds * 1000:.0f}ms")
+            if self.tool == 'pyinstrument':
+                profiler.stop()
+                path = f"{base}.html"
+                with open(path, 'w') as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.disable()
+                path = f"{base}.prof"
+                profiler.dump_stats(path)
+            return path
+        finally:
+            self._busy.release()
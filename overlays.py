@@ -0,0 +1,188 @@
+"""
+Overlay tracks drawn behind the variant plots, precomputed per transcript when
+a gene is loaded (app.load_gene), so a figure only attaches them:
+
+- protein domains: aa intervals from a domain table (DOMAINS_FILE in app.py),
+  e.g. an Ensembl BioMart export of the Pfam or InterPro domains, drawn as
+  light labelled bands;
+- regional constraint: gnomAD missense density vs ClinVar P/LP density in
+  the sliding aa windows of the score summaries (score_summary.WINDOW_SIZE
+  wide, every WINDOW_STEP), so that a flagged region lines up with the window
+  quoted for the custom variant; counted from the loaded variant tables with
+  one bincount and cumulative sum per source.
+  Windows whose gnomAD density is below DEPLETION_RATIO times the transcript
+  mean are missense-depleted (orange strip at the bottom of the plot); red
+  when the ClinVar P/LP density there is also ENRICHMENT_RATIO times its mean.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from score_summary import WINDOW_SIZE, WINDOW_STEP
+
+DEPLETION_RATIO = 0.5
+ENRICHMENT_RATIO = 2.0
+# No constraint track for transcripts with fewer gnomAD variants (too noisy)
+MIN_GNOMAD_VARIANTS = 50
+
+DOMAIN_COLORS = ['#1f77b4', '#9467bd', '#2ca02c', '#8c564b', '#e377c2', '#17becf']
+DEPLETED_COLOR = '#ff7f0e'
+ENRICHED_COLOR = '#d62728'
+# Height of the constraint strip, as a fraction of the plot height
+STRIP_HEIGHT = 0.04
+
+# Domain table columns (lower case) read as a field: BioMart, InterPro or plain names
+DOMAIN_COLUMN_ALIASES = {
+    'transcript': 'transcript', 'transcript_id': 'transcript', 'transcript stable id': 'transcript',
+    'start': 'start', 'pfam start': 'start', 'interpro start': 'start', 'aa_start': 'start',
+    'end': 'end', 'pfam end': 'end', 'interpro end': 'end', 'aa_end': 'end',
+    'name': 'name', 'domain': 'name', 'pfam id': 'name', 'interpro short description': 'name',
+    'interpro description': 'name',
+}
+
+class DomainTable:
+    """Domain intervals (aa start, end, name) of every transcript, sorted by transcript and start."""
+
+    def __init__(self, df):
+        df = df.sort_values(['transcript', 'start'], kind='stable').reset_index(drop=True)
+        self.transcripts = df['transcript'].to_numpy(dtype=str)
+        self.starts = df['start'].to_numpy(dtype=np.int32)
+        self.ends = df['end'].to_numpy(dtype=np.int32)
+        self.names = df['name'].to_numpy(dtype=str)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def domains(self, transcript):
+        """(start, end, name) of the domains of a transcript."""
+        s = np.searchsorted(self.transcripts, transcript, side='left')
+        e = np.searchsorted(self.transcripts, transcript, side='right')
+        return list(zip(self.starts[s:e].tolist(), self.ends[s:e].tolist(), self.names[s:e].tolist()))
+
+def load_domain_table(path):
+    """
+    Read a domain table: tab-separated (comma-separated for .csv), with a
+    transcript, start, end and name column (see DOMAIN_COLUMN_ALIASES).
+    Transcript versions are dropped, rows without an interval are skipped.
+    """
+    sep = ',' if '.csv' in os.path.basename(path) else '\t'
+    df = pd.read_csv(path, sep=sep, dtype=str)
+    columns = {}
+    for column in df.columns:
+        field = DOMAIN_COLUMN_ALIASES.get(column.strip().lower())
+        if field and field not in columns.values():
+            columns[column] = field
+    missing = {'transcript', 'start', 'end', 'name'} - set(columns.values())
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(sorted(missing))} column")
+    df = df[list(columns)].rename(columns=columns).dropna(subset=['transcript', 'start', 'end'])
+    df['transcript'] = df['transcript'].str.split('.').str[0]
+    df['start'] = pd.to_numeric(df['start'], errors='coerce')
+    df['end'] = pd.to_numeric(df['end'], errors='coerce')
+    df['name'] = df['name'].fillna('domain')
+    df = df.dropna(subset=['start', 'end']).drop_duplicates()
+    return DomainTable(df)
+
+def window_counts(positions, length, size=WINDOW_SIZE, step=WINDOW_STEP):
+    """
+    Number of positions in each sliding window of a protein of length aa
+    (window k: aa step*k+1 to step*k+size, only windows within the protein,
+    plus a last window ending at length when the steps skip the C-terminus).
+    Returns (counts, window starts, window ends).
+    """
+    positions = np.clip(np.asarray(positions, dtype=np.int64), 1, length)
+    # cumulative[p]: number of positions <= p
+    cumulative = np.cumsum(np.bincount(positions, minlength=length + 1))
+    n_windows = max(length - size, 0) // step + 1
+    starts = np.arange(n_windows) * step
+    if starts[-1] + size < length:
+        starts = np.append(starts, length - size)
+    ends = np.minimum(starts + size, length)
+    return cumulative[ends] - cumulative[starts], starts + 1, ends
+
+def runs(flags):
+    """First and last index of each run of True in a boolean array."""
+    padded = np.concatenate([[False], flags, [False]])
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    return changes[0::2], changes[1::2] - 1
+
+def constraint_regions(gnomad_positions, clinvar_positions, length):
+    """
+    Missense-depleted regions of a transcript: [{start, end, level}], level
+    'depleted', or 'enriched' where ClinVar P/LP is also dense (see module
+    docstring). Overlapping flagged windows are merged.
+    """
+    if len(gnomad_positions) < MIN_GNOMAD_VARIANTS or length < WINDOW_SIZE:
+        return []
+    gnomad, starts, ends = window_counts(gnomad_positions, length)
+    clinvar, _, _ = window_counts(clinvar_positions, length)
+    widths = ends - starts + 1
+    gnomad_ratio = gnomad / widths / (len(gnomad_positions) / length)
+    depleted = gnomad_ratio < DEPLETION_RATIO
+    if len(clinvar_positions):
+        enriched = depleted & (clinvar / widths / (len(clinvar_positions) / length) >= ENRICHMENT_RATIO)
+    else:
+        enriched = np.zeros_like(depleted)
+    regions = []
+    for level, flags in (('depleted', depleted), ('enriched', enriched)):
+        first, last = runs(flags)
+        regions += [{'start': int(starts[i]), 'end': int(ends[j]), 'level': level} for i, j in zip(first, last)]
+    return regions
+
+def track_shapes(domains, regions):
+    """Plotly layout shapes of a track (on the x axis and the y axis domain)."""
+    colors = {name: DOMAIN_COLORS[i % len(DOMAIN_COLORS)]
+              for i, name in enumerate(sorted({name for _, _, name in domains}))}
+    shapes = [dict(type='rect', layer='below', xref='x', yref='y domain', x0=start - 0.5, x1=end + 0.5,
+                   y0=0, y1=1, fillcolor=colors[name], opacity=0.12, line_width=0,
+                   label=dict(text=name, textposition='top center', font=dict(size=10)))
+              for start, end, name in domains]
+    shapes += [dict(type='rect', layer='below', xref='x', yref='y domain', x0=region['start'] - 0.5,
+                    x1=region['end'] + 0.5, y0=0, y1=STRIP_HEIGHT, line_width=0, opacity=0.6,
+                    fillcolor=ENRICHED_COLOR if region['level'] == 'enriched' else DEPLETED_COLOR)
+               for region in regions]
+    return shapes
+
+def aa_positions(index, transcript):
+    """aa_position of the rows of a transcript in a VariantIndex."""
+    if index.empty:
+        return np.zeros(0, dtype=np.int64)
+    return index.block(transcript)['aa_position'].to_numpy()
+
+def build_tracks(gnomad_index, clinvar_index, domain_table=None):
+    """
+    Overlay track of every transcript of a gene (VariantIndex of each source):
+    {transcript: {'domains', 'regions', 'shapes'}}.
+    """
+    tracks = {}
+    for transcript in sorted(set(gnomad_index.transcripts) | set(clinvar_index.transcripts)):
+        gnomad, clinvar = aa_positions(gnomad_index, transcript), aa_positions(clinvar_index, transcript)
+        domains = domain_table.domains(transcript) if domain_table is not None else []
+        length = int(max([gnomad.max(initial=0), clinvar.max(initial=0)] + [end for _, end, _ in domains]))
+        regions = constraint_regions(gnomad, clinvar, length)
+        tracks[transcript] = {'domains': domains, 'regions': regions, 'shapes': track_shapes(domains, regions)}
+    return tracks
+
+def panel_shapes(track, axis_numbers, labels_on=()):
+    """The shapes of a track for subplots (axis numbers 1, 2...), domain labels only on labels_on."""
+    shapes = []
+    for n in axis_numbers:
+        suffix = '' if n == 1 else str(n)
+        for shape in track['shapes']:
+            shape = dict(shape, xref=f"x{suffix}", yref=f"y{suffix} domain")
+            if n not in labels_on:
+                shape.pop('label', None)
+            shapes.append(shape)
+    return shapes
+
+def track_info(track):
+    """Info text of a track (e.g. "2 domains, 1 missense-depleted region"), or None."""
+    parts = []
+    n_domains = len(track['domains'])
+    n_regions = sum(region['level'] == 'depleted' for region in track['regions'])
+    if n_domains:
+        parts.append(f"{n_domains} domain{'s' if n_domains > 1 else ''}")
+    if n_regions:
+        parts.append(f"{n_regions} missense-depleted region{'s' if n_regions > 1 else ''}")
+    return ", ".join(parts) or None
@@ -0,0 +1,468 @@
+"""
+Figure building shared by the Dash app (app.py) and the headless batch mode (batch.py).
+"""
+import math
+
+import plotly.graph_objs as go
+import pandas as pd
+import numpy as np
+from plotly.subplots import make_subplots
+
+from metrics import LATENCY, record_error
+from overlays import panel_shapes, track_info
+from variants import SCORE_FIELDS
+
+# Above this many points the gnomAD/ClinVar traces are drawn with WebGL (Scattergl)
+WEBGL_POINT_THRESHOLD = 20000
+# Density mode: above this many gnomAD points in view, a binned heatmap is drawn instead
+DENSITY_POINT_LIMIT = 5000
+DENSITY_X_BINS = 300
+DENSITY_Y_BINS = 60
+
+# Name of the gnomAD scatter trace, looked up by the browser-side threshold
+# filter (assets/threshold_filter.js)
+GNOMAD_TRACE_NAME = 'gnomAD Variants'
+
+HOVER_COUNT_FIELDS = ['AC_genomes', 'AC_joint', 'nhomalt_genomes', 'nhomalt_joint']
+
+SCORE_LABELS = {
+    'REVEL': 'REVEL', 'am_pathogenicity': 'AlphaMissense', 'cadd_v1.7': 'CADD v1.7',
+    'MPC': 'MPC2', 'MISTIC_score': 'MISTIC', 'popEVE': 'popEVE',
+}
+# Score panels: columns of the grid and height of one row (pixels)
+PANEL_COLUMNS = 2
+PANEL_ROW_HEIGHT = 320
+
+def _text_column(df, column, default=''):
+    """String values of a column (default when the column is absent)."""
+    if column not in df.columns:
+        return np.full(len(df), default, dtype=object)
+    return df[column].astype(str).to_numpy(dtype=object)
+
+def hover_template(score_column, include_pred=False):
+    """
+    hovertemplate of the customdata built by create_hover_data (include_pred:
+    the customdata has the MISTIC_pred column, shown for MISTIC_score only).
+    """
+    template = (
+        "<b>Change:</b> %{customdata[0]}<br>"
+        "<b>Variant:</b> %{customdata[1]}<br>"
+        f"<b>{score_column}:</b> %{{y:.3f}}<br>"
+    )
+    if include_pred and score_column == 'MISTIC_score':
+        template += "%{customdata[2]}"
+    offset = 3 if include_pred else 2
+    for i, field in enumerate(HOVER_COUNT_FIELDS):
+        template += f"<b>{field}:</b> %{{customdata[{offset + i}]}}" + ("<br>" if i < 3 else "")
+    return template + "<extra></extra>"
+
+@LATENCY.timed('hover_text')
+def create_hover_data(df, score_column, include_pred=None):
+    """
+    Tooltip content of a trace as a Plotly (customdata, hovertemplate) pair.
+    customdata holds one row per point (change, variant, optional MISTIC_pred
+    line, then the four counts); the browser fills the template, and the score
+    is read from the y value. Same fields as the former per-row hover text.
+    include_pred defaults to adding the MISTIC_pred column for MISTIC_score only;
+    the score panels always add it, to share one customdata across scores.
+    """
+    include_pred = score_column == 'MISTIC_score' if include_pred is None else include_pred
+    variant = (_text_column(df, 'chrom') + ':' + _text_column(df, 'pos') + ' ' +
+               _text_column(df, 'ref') + '>' + _text_column(df, 'alt'))
+    columns = [_text_column(df, 'aa_change', 'N/A'), variant]
+
+    # Add MISTIC prediction if available and relevant
+    if include_pred:
+        pred = df['MISTIC_pred'] if 'MISTIC_pred' in df.columns else pd.Series(np.nan, index=df.index)
+        columns.append(np.where(pred.notna(), "<b>MISTIC_pred:</b> " + pred.astype(str) + "<br>", ""))
+
+    for field in HOVER_COUNT_FIELDS:
+        values = df[field].to_numpy() if field in df.columns else np.zeros(len(df), dtype=np.int64)
+        columns.append(values)
+
+    customdata = np.empty((len(df), len(columns)), dtype=object)
+    for i, values in enumerate(columns):
+        customdata[:, i] = values
+    return customdata, hover_template(score_column, include_pred)
+
+def scatter_class(n_points, webgl_threshold=WEBGL_POINT_THRESHOLD):
+    """go.Scattergl for large traces (SVG rendering gets sluggish), go.Scatter otherwise."""
+    return go.Scattergl if n_points > webgl_threshold else go.Scatter
+
+def crop_to_range(rows, x_range, margin=0.5):
+    """
+    Rows (sorted by aa_position) within the zoomed x range, widened by `margin`
+    of its width on each side so that small pans do not show empty borders.
+    """
+    if x_range is None or rows.empty:
+        return rows
+    lo, hi = x_range
+    pad = (hi - lo) * margin
+    x = rows['aa_position'].to_numpy()
+    start, end = np.searchsorted(x, lo - pad, side='left'), np.searchsorted(x, hi + pad, side='right')
+    return rows.iloc[start:end]
+
+def density_trace(rows, score, x_range=None):
+    """Heatmap of the number of variants per aa_position bin x score bin."""
+    x = rows['aa_position'].to_numpy(dtype=float)
+    y = rows[score].to_numpy(dtype=float)
+    x_lo, x_hi = x_range if x_range is not None else (x.min(), x.max())
+    x_edges = np.linspace(x_lo, max(x_hi, x_lo + 1), DENSITY_X_BINS + 1)
+    y_edges = np.linspace(y.min(), max(y.max(), y.min() + 1e-6), DENSITY_Y_BINS + 1)
+    counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges])
+    z = counts.T
+    z[z == 0] = np.nan
+    return go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=z,
+        name=GNOMAD_TRACE_NAME,
+        colorscale='GnBu',
+        colorbar=dict(title="variants", x=1, thickness=12),
+        hovertemplate="<b>aa_position:</b> %{x:.0f}<br><b>" + score +
+                      ":</b> %{y:.3f}<br><b>gnomAD variants:</b> %{z}<extra></extra>"
+    )
+
+def json_floats(values):
+    """
+    List of the values for JSON, None where missing. float32 values are written
+    in their shortest decimal form (0.481, not 0.48100000619888306).
+    """
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return [None if text == 'nan' else float(text) for text in values.astype(str)]
+    return [None if pd.isna(v) else float(v) for v in values]
+
+@LATENCY.timed('client_payload')
+def client_payload(rows, customdata, panels):
+    """
+    gnomAD points for the browser-side threshold filter (assets/threshold_filter.js):
+    the x, hover data and counts of the rows, once, and for each panel the
+    index of its (empty) trace in the figure and the y of every row (None
+    where the panel has no value, e.g. a missing score).
+    """
+    return {
+        'x': rows['aa_position'].tolist(),
+        'customdata': customdata.tolist(),
+        'counts': {field: rows[field].tolist() for field in HOVER_COUNT_FIELDS if field in rows.columns},
+        'panels': [{'trace': trace, 'y': json_floats(y)} for trace, y in panels],
+    }
+
+def gnomad_client_data(fig, gnomad_rows):
+    """
+    Move the points of the unfiltered gnomAD trace of a figure (built with
+    threshold_field=None from gnomad_rows) to a client_payload. The trace is
+    left empty in the figure. Returns None when the figure has no gnomAD points.
+    """
+    traces = [i for i, t in enumerate(fig.data) if t.name == GNOMAD_TRACE_NAME and t.type in ('scatter', 'scattergl')]
+    if not traces:
+        return None
+    trace = fig.data[traces[0]]
+    data = client_payload(gnomad_rows, np.asarray(trace.customdata), [(traces[0], np.asarray(trace.y))])
+    trace.update(x=[], y=[], customdata=[])
+    return data
+
+def build_figure(gnomad_index, clinvar_index, custom_index, transcript, score, threshold_field, threshold_value,
+                 x_range=None, density=False, webgl_threshold=WEBGL_POINT_THRESHOLD,
+                 density_point_limit=DENSITY_POINT_LIMIT, overlay=None):
+    """
+    Build the gnomAD / ClinVar / custom variant figure of one transcript and score.
+    The data is given as VariantIndex objects (see gene_index.py), so the rows
+    of the transcript are sliced rather than filtered from the full tables.
+    x_range (aa_position start, end) restricts the gnomAD points sent to the
+    zoomed window. With density=True, more than density_point_limit gnomAD
+    points in view are drawn as a binned heatmap, refined to individual points
+    once zoomed in far enough. overlay is the transcript's precomputed track
+    (overlays.build_tracks), drawn as shaded bands.
+    Returns (figure, info_text).
+    """
+    fig, info_parts = build_figure_parts(gnomad_index, clinvar_index, custom_index, transcript, score,
+                                         threshold_field, threshold_value, x_range=x_range, density=density,
+                                         webgl_threshold=webgl_threshold, density_point_limit=density_point_limit,
+                                         overlay=overlay)
+    if len(fig.data) == 0:
+        return fig, "⚠️ No variants found for this transcript with the selected score. Check if data is loaded correctly."
+    if info_parts:
+        info_text = "Displaying: " + " | ".join(info_parts)
+    else:
+        info_text = "No variants to display with current filters."
+    return fig, info_text
+
+@LATENCY.timed('figure_build')
+def build_figure_parts(gnomad_index, clinvar_index, custom_index, transcript, score, threshold_field, threshold_value,
+                       x_range=None, density=False, webgl_threshold=WEBGL_POINT_THRESHOLD,
+                       density_point_limit=DENSITY_POINT_LIMIT, overlay=None):
+    """
+    build_figure, returning the figure and the list of info parts (the first
+    one is always the gnomAD part). threshold_field=None leaves the gnomAD
+    points unfiltered and uncolored, for filtering in the browser.
+    """
+    # Create figure
+    fig = go.Figure()
+    info_parts = []
+    
+    # Trace 1: gnomAD data (filtered dynamically by user)
+    try:
+        # Convert threshold_value to numeric, default to 0 if None
+        threshold_val = float(threshold_value) if threshold_value is not None else 0
+        
+        with LATENCY.span('filtering'):
+            # gnomAD rows of the transcript with a score (already sorted by aa_position)
+            gnomad_filtered = gnomad_index.rows(transcript, score)
+
+            # Apply threshold filter (threshold columns are numeric in the index)
+            if threshold_field is not None and not gnomad_filtered.empty and threshold_field in gnomad_filtered.columns:
+                gnomad_filtered = gnomad_filtered[gnomad_filtered[threshold_field].to_numpy() > threshold_val]
+            gnomad_filtered = crop_to_range(gnomad_filtered, x_range)
+        in_view = " in view" if x_range is not None else ""
+        filter_text = f" (filtered: {threshold_field} > {threshold_val})" if threshold_field is not None else ""
+        
+        if not gnomad_filtered.empty and density and len(gnomad_filtered) > density_point_limit:
+            fig.add_trace(density_trace(gnomad_filtered, score, x_range))
+            density_text = "density view, zoom in to see individual variants"
+            if threshold_field is not None:
+                density_text = f"filtered: {threshold_field} > {threshold_val}, {density_text}"
+            info_parts.append(f"{len(gnomad_filtered)} gnomAD variants{in_view} ({density_text})")
+        elif not gnomad_filtered.empty:
+            # Create color scale based on threshold field
+            log_color = None
+            if threshold_field is not None:
+                color_values = gnomad_filtered[threshold_field].astype(float).replace(0, 1e-9)
+                log_color = np.log10(color_values)
+            hover_data, hover_template = create_hover_data(gnomad_filtered, score)
+            
+            fig.add_trace(scatter_class(len(gnomad_filtered), webgl_threshold)(
+                x=gnomad_filtered['aa_position'],
+                y=gnomad_filtered[score],
+                mode='markers',
+                name=GNOMAD_TRACE_NAME,
+                marker=dict(
+                    size=8,
+                    color=log_color,
+                    colorscale='GnBu',
+                    showscale=True,
+                    colorbar=dict(
+                        title=threshold_field or '',
+                        x=1,
+                        thickness=12
+                    ),
+                    line=dict(width=1, color='LightGray')
+                ),
+                customdata=hover_data,
+                hovertemplate=hover_template
+            ))
+            fig.update_traces(
+                marker_colorbar=dict(
+                    tickvals=np.log10([1, 10, 100, 1000, 10000]),
+                    ticktext=['1', '10', '100', '1000', '10000']
+            )
+    )
+            info_parts.append(f"{len(gnomad_filtered)} gnomAD variants{in_view}{filter_text}")
+        elif threshold_field is not None:
+            info_parts.append(f"No gnomAD variants{in_view} with {threshold_field} > {threshold_val}")
+        else:
+            info_parts.append(f"No gnomAD variants{in_view}")
+    except Exception as e:
+        record_error('figure.gnomad', e)
+        info_parts.append(f"Error loading gnomAD variants: {str(e)}")
+    
+    # Trace 2: ClinVar data (ALWAYS displayed when available for the transcript)
+    if not clinvar_index.empty:
+        try:
+            clinvar_filtered = clinvar_index.rows(transcript, score)
+            
+            if not clinvar_filtered.empty:
+                hover_data, hover_template = create_hover_data(clinvar_filtered, score)
+                fig.add_trace(scatter_class(len(clinvar_filtered), webgl_threshold)(
+                    x=clinvar_filtered['aa_position'],
+                    y=clinvar_filtered[score],
+                    mode='markers',
+                    name='ClinVar P/LP',
+                    marker=dict(
+                        color='darkred', 
+                        size=7,
+                        symbol='diamond',
+                        opacity=0.7 # make them a little transparent
+                    ),
+                    customdata=hover_data,
+                    hovertemplate=hover_template
+                ))
+                info_parts.append(f"{len(clinvar_filtered)} ClinVar P/LP variants")
+        except Exception as e:
+            record_error('figure.clinvar', e)
+            info_parts.append(f"Error loading ClinVar variants: {str(e)}")
+    
+    # Trace 3: Custom Variant (ALWAYS displayed when available for the transcript)
+    if not custom_index.empty:
+        try:
+            custom_filtered = custom_index.rows(transcript, score)
+            
+            if not custom_filtered.empty:
+                hover_data, hover_template = create_hover_data(custom_filtered, score)
+                fig.add_trace(go.Scatter(
+                    x=custom_filtered['aa_position'],
+                    y=custom_filtered[score],
+                    mode='markers',
+                    name='Custom Variant',
+                    marker=dict(
+                        color='gold',
+                        size=16,
+                        symbol='star',
+                        line=dict(width=1, color='white')
+                    ),
+                    customdata=hover_data,
+                    hovertemplate=hover_template
+                ))
+                info_parts.append(f"1 custom variant")
+        except Exception as e:
+            record_error('figure.custom', e)
+            info_parts.append(f"Error loading custom variant: {str(e)}")
+    
+    # Update layout
+    fig.update_layout(
+#        title=dict(
+#            text=f"<b>{TARGET_GENE} Missense Variants - {transcript} | Score: {score}</b><br>",
+#            x=0.5,
+#            xanchor='center'
+#        ),
+        xaxis=dict(
+            title="<b>Amino Acid Position</b>",
+            gridcolor='lightgray'
+        ),
+        yaxis=dict(
+            title=f"<b>{score} Score</b>",
+            gridcolor='lightgray'
+        ),
+        hovermode='closest',
+        plot_bgcolor='white',
+        # Keep the user's zoom across updates of the same transcript and score
+        uirevision=f"{transcript}|{score}",
+        height=600,
+        showlegend=False,
+        font=dict(size=12),
+#        margin=dict(r=150)  # Extra margin for colorbar
+    )
+    
+    fig.update_xaxes(showgrid=True, zeroline=False)
+    fig.update_yaxes(showgrid=True, zeroline=False)
+
+    # Domains and constrained regions, precomputed with the gene data
+    if overlay is not None and len(fig.data) > 0:
+        fig.update_layout(shapes=overlay['shapes'])
+        if track_info(overlay):
+            info_parts.append(track_info(overlay))
+    
+    return fig, info_parts
+
+@LATENCY.timed('figure_build_panels')
+def build_score_panels(gnomad_index, clinvar_index, custom_index, transcript, scores=SCORE_FIELDS,
+                       threshold_field=None, threshold_value=None, webgl_threshold=WEBGL_POINT_THRESHOLD,
+                       overlay=None):
+    """
+    Small multiples: one panel per score with data for the transcript, in a
+    single figure. The rows of the transcript are sliced, threshold-filtered
+    and turned into hover data once per source; each panel then takes the
+    rows where its score is set. With threshold_field=None the gnomAD points
+    are left out of the figure and returned as one client_payload shared by
+    the panels, for the browser-side threshold filter. The overlay track is
+    drawn in every panel, with the domain names on the first row.
+    Returns (figure, info_parts, gnomad_payload or None).
+    """
+    gnomad = gnomad_index.block(transcript)
+    threshold_val = float(threshold_value) if threshold_value is not None else 0
+    if threshold_field is not None and not gnomad.empty and threshold_field in gnomad.columns:
+        gnomad = gnomad[gnomad[threshold_field].to_numpy() > threshold_val]
+    clinvar = clinvar_index.block(transcript)
+    custom = custom_index.block(transcript)
+    scores = [s for s in scores if any(index.count(transcript, s) for index in (gnomad_index, clinvar_index, custom_index))]
+    if not scores:
+        return go.Figure(), [], None
+
+    n_rows = math.ceil(len(scores) / PANEL_COLUMNS)
+    fig = make_subplots(rows=n_rows, cols=PANEL_COLUMNS, shared_xaxes=True,
+                        subplot_titles=[SCORE_LABELS.get(s, s) for s in scores],
+                        vertical_spacing=0.3 / n_rows, horizontal_spacing=0.08)
+    # Hover data computed once per source, with the same columns for every score
+    hover = {name: create_hover_data(df, 'MISTIC_score', include_pred=True)[0]
+             for name, df in [('gnomad', gnomad), ('clinvar', clinvar), ('custom', custom)]}
+    log_color = None
+    if threshold_field is not None and not gnomad.empty and threshold_field in gnomad.columns:
+        log_color = np.log10(gnomad[threshold_field].astype(float).replace(0, 1e-9).to_numpy())
+
+    panels = []
+    for i, score in enumerate(scores):
+        row, col = i // PANEL_COLUMNS + 1, i % PANEL_COLUMNS + 1
+        template = hover_template(score, include_pred=True)
+
+        values = gnomad[score] if score in gnomad.columns else pd.Series(np.nan, index=gnomad.index)
+        has_score = values.notna().to_numpy()
+        if threshold_field is None:
+            # Points filled in by the browser, from the shared payload
+            panels.append((len(fig.data), values.to_numpy()))
+            x, y, customdata, color = [], [], [], None
+        else:
+            x, y = gnomad['aa_position'][has_score], values[has_score]
+            customdata = hover['gnomad'][has_score]
+            color = log_color[has_score] if log_color is not None else None
+        fig.add_trace(scatter_class(int(has_score.sum()), webgl_threshold)(
+            x=x, y=y, customdata=customdata, hovertemplate=template,
+            mode='markers', name=GNOMAD_TRACE_NAME, showlegend=False,
+            marker=dict(size=6, color=color, coloraxis='coloraxis', line=dict(width=1, color='LightGray')),
+        ), row=row, col=col)
+
+        for name, df, marker in [
+            ('clinvar', clinvar, dict(color='darkred', size=6, symbol='diamond', opacity=0.7)),
+            ('custom', custom, dict(color='gold', size=14, symbol='star', line=dict(width=1, color='white'))),
+        ]:
+            if df.empty or score not in df.columns:
+                continue
+            has_score = df[score].notna().to_numpy()
+            if not has_score.any():
+                continue
+            trace_class = go.Scatter if name == 'custom' else scatter_class(int(has_score.sum()), webgl_threshold)
+            fig.add_trace(trace_class(
+                x=df['aa_position'][has_score], y=df[score][has_score],
+                customdata=hover[name][has_score], hovertemplate=template,
+                mode='markers', name='ClinVar P/LP' if name == 'clinvar' else 'Custom Variant',
+                showlegend=False, marker=marker,
+            ), row=row, col=col)
+        fig.update_yaxes(title_text=SCORE_LABELS.get(score, score), row=row, col=col)
+
+    fig.update_xaxes(showgrid=True, gridcolor='lightgray', zeroline=False)
+    fig.update_xaxes(title_text="<b>Amino Acid Position</b>", row=n_rows)
+    fig.update_yaxes(showgrid=True, gridcolor='lightgray', zeroline=False)
+    fig.update_layout(
+        coloraxis=dict(colorscale='GnBu', colorbar=dict(
+            title=threshold_field or '', thickness=12,
+            tickvals=np.log10([1, 10, 100, 1000, 10000]), ticktext=['1', '10', '100', '1000', '10000'])),
+        hovermode='closest',
+        plot_bgcolor='white',
+        uirevision=f"{transcript}|panels",
+        height=PANEL_ROW_HEIGHT * n_rows,
+        showlegend=False,
+        font=dict(size=12),
+    )
+    if overlay is not None:
+        panels_on = range(1, len(scores) + 1)
+        fig.update_layout(shapes=panel_shapes(overlay, panels_on, labels_on=range(1, PANEL_COLUMNS + 1)))
+
+    # Info parts, the first one is the gnomAD part (as in build_figure_parts)
+    def scored(df):
+        columns = [s for s in scores if s in df.columns]
+        return int(df[columns].notna().any(axis=1).sum()) if columns else 0
+    if threshold_field is None:
+        info_parts = [f"{scored(gnomad)} gnomAD variants"]
+    else:
+        info_parts = [f"{scored(gnomad)} gnomAD variants (filtered: {threshold_field} > {threshold_val})"]
+    if scored(clinvar):
+        info_parts.append(f"{scored(clinvar)} ClinVar P/LP variants")
+    if scored(custom):
+        info_parts.append("1 custom variant")
+    info_parts.append(f"{len(scores)} scores")
+    if overlay is not None and track_info(overlay):
+        info_parts.append(track_info(overlay))
+
+    payload = None
+    if threshold_field is None and not gnomad.empty:
+        payload = client_payload(gnomad, hover['gnomad'], panels)
+    return fig, info_parts, payload
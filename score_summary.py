@@ -0,0 +1,188 @@
+"""
+Precomputed score distributions of a variant table, per transcript and score.
+
+For every transcript and score the summary holds the sorted score values (the
+percentile rank of a value is a binary search) and quantiles of the scores in
+sliding aa_position windows (window k covers aa WINDOW_STEP * k + 1 to
+WINDOW_STEP * k + WINDOW_SIZE). Compiled genes keep their summaries in the
+store (summary.npz next to the columns); other genes are summarized at load.
+"""
+import numpy as np
+
+from variants import SCORE_FIELDS
+
+SUMMARY_VERSION = 1
+WINDOW_SIZE = 30
+WINDOW_STEP = 10
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+def window_quantiles(positions, values, n_windows):
+    """
+    Row count and QUANTILES of the values in each of the n_windows sliding
+    windows (NaN where a window is empty). Every row is expanded once per
+    window covering it, then the (window, value) pairs are sorted together.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    first = np.maximum((positions - 1 - WINDOW_SIZE) // WINDOW_STEP + 1, 0)
+    last = np.minimum((positions - 1) // WINDOW_STEP, n_windows - 1)
+    reps = np.maximum(last - first + 1, 0)
+    total = int(reps.sum())
+    starts = np.cumsum(reps) - reps
+    windows = np.repeat(first, reps) + (np.arange(total) - np.repeat(starts, reps))
+    expanded = np.repeat(np.asarray(values, dtype=np.float64), reps)
+    expanded = expanded[np.lexsort((expanded, windows))]
+
+    counts = np.bincount(windows, minlength=n_windows)
+    offsets = np.cumsum(counts) - counts
+    quantiles = np.full((n_windows, len(QUANTILES)), np.nan)
+    filled = counts > 0
+    for j, q in enumerate(QUANTILES):
+        # Linear interpolation, as np.quantile
+        h = (counts[filled] - 1) * q
+        lo = np.floor(h).astype(np.int64)
+        hi = np.minimum(lo + 1, counts[filled] - 1)
+        v_lo = expanded[offsets[filled] + lo]
+        v_hi = expanded[offsets[filled] + hi]
+        quantiles[filled, j] = v_lo + (h - lo) * (v_hi - v_lo)
+    return counts.astype(np.int32), quantiles.astype(np.float32)
+
+def window_of(aa_position):
+    """Index of the window centered closest to an amino acid position."""
+    center = (WINDOW_SIZE + 1) / 2
+    return max(int(round((aa_position - center) / WINDOW_STEP)), 0)
+
+def percentile_rank(sorted_values, value):
+    """Percentage of the values below value (ties count half)."""
+    if len(sorted_values) == 0:
+        return None
+    below = np.searchsorted(sorted_values, value, side='left')
+    not_above = np.searchsorted(sorted_values, value, side='right')
+    return 100.0 * (below + not_above) / 2 / len(sorted_values)
+
+class ScoreSummary:
+    """Sorted scores and window quantiles of every (transcript, score) of one source."""
+
+    def __init__(self, keys, values, value_offsets, window_offsets, window_counts, window_quantiles):
+        self.keys = list(keys)
+        self.values = values
+        self.value_offsets = value_offsets
+        self.window_offsets = window_offsets
+        self.window_counts = window_counts
+        self.window_quantiles = window_quantiles
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+
+    @classmethod
+    def from_index(cls, index, scores=SCORE_FIELDS):
+        """Summarize a VariantIndex (rows sorted by transcript and aa_position)."""
+        keys, values, counts, quantiles = [], [], [], []
+        for transcript in index.transcripts:
+            for score in scores:
+                rows = index.rows(transcript, score)
+                if rows.empty:
+                    continue
+                positions = rows['aa_position'].to_numpy()
+                scored = rows[score].to_numpy(dtype=np.float64)
+                n_windows = max(int(positions.max()) - 1, 0) // WINDOW_STEP + 1
+                window_counts, window_q = window_quantiles(positions, scored, n_windows)
+                keys.append((transcript, score))
+                values.append(np.sort(scored))
+                counts.append(window_counts)
+                quantiles.append(window_q)
+        offsets = lambda arrays: np.concatenate([[0], np.cumsum([len(a) for a in arrays])]).astype(np.int64)
+        return cls(
+            keys,
+            np.concatenate(values) if values else np.zeros(0),
+            offsets(values),
+            offsets(counts),
+            np.concatenate(counts) if counts else np.zeros(0, dtype=np.int32),
+            np.concatenate(quantiles) if quantiles else np.zeros((0, len(QUANTILES)), dtype=np.float32),
+        )
+
+    def save(self, path):
+        """Write the summary as a .npz (with its format and window parameters)."""
+        np.savez(
+            path,
+            params=np.array([SUMMARY_VERSION, WINDOW_SIZE, WINDOW_STEP]),
+            quantile_levels=np.array(QUANTILES),
+            keys=np.array([f"{t}\t{s}" for t, s in self.keys], dtype=str),
+            values=self.values, value_offsets=self.value_offsets,
+            window_offsets=self.window_offsets, window_counts=self.window_counts,
+            window_quantiles=self.window_quantiles,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read a summary written by save(); None if it has another format or windows."""
+        with np.load(path) as data:
+            if (data['params'].tolist() != [SUMMARY_VERSION, WINDOW_SIZE, WINDOW_STEP]
+                    or data['quantile_levels'].tolist() != list(QUANTILES)):
+                return None
+            return cls(
+                [tuple(key.split('\t')) for key in data['keys'].tolist()],
+                data['values'], data['value_offsets'],
+                data['window_offsets'], data['window_counts'], data['window_quantiles'],
+            )
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.values, self.value_offsets, self.window_offsets,
+                                      self.window_counts, self.window_quantiles))
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def distribution(self, transcript, score):
+        """Sorted scores of a transcript (empty if it has none)."""
+        i = self._positions.get((transcript, score))
+        if i is None:
+            return self.values[0:0]
+        return self.values[self.value_offsets[i]:self.value_offsets[i + 1]]
+
+    def percentile(self, transcript, score, value):
+        """Percentile rank of a score among the transcript's variants, or None."""
+        return percentile_rank(self.distribution(transcript, score), value)
+
+    def window(self, transcript, score, aa_position):
+        """
+        The window centered on an amino acid position: dict with its aa range,
+        row count and quantiles (None when it holds no variant).
+        """
+        k = window_of(aa_position)
+        start = k * WINDOW_STEP + 1
+        result = {'start': start, 'end': start + WINDOW_SIZE - 1, 'count': 0, 'quantiles': None}
+        i = self._positions.get((transcript, score))
+        if i is None:
+            return result
+        lo, hi = self.window_offsets[i], self.window_offsets[i + 1]
+        if k < hi - lo and self.window_counts[lo + k] > 0:
+            result['count'] = int(self.window_counts[lo + k])
+            result['quantiles'] = dict(zip(QUANTILES, self.window_quantiles[lo + k].tolist()))
+        return result
+
+def describe_variant(gnomad, clinvar, transcript, score, value, aa_position):
+    """
+    Info text placing a variant score among the gnomAD and ClinVar P/LP scores
+    of the transcript: percentile ranks, and the ClinVar/gnomAD ratio in the
+    window around the variant relative to the whole transcript (enrichment).
+    gnomad and clinvar are ScoreSummary objects (or None).
+    """
+    parts = []
+    for name, summary in [('gnomAD', gnomad), ('ClinVar P/LP', clinvar)]:
+        rank = summary.percentile(transcript, score, value) if summary is not None else None
+        if rank is not None:
+            parts.append(f"percentile {rank:.0f} of {name}")
+    text = f"Custom {score} {value:.3f}: " + (", ".join(parts) if parts else "no score distribution")
+
+    if gnomad is not None and clinvar is not None:
+        g_total = len(gnomad.distribution(transcript, score))
+        c_total = len(clinvar.distribution(transcript, score))
+        g_window = gnomad.window(transcript, score, aa_position)
+        c_window = clinvar.window(transcript, score, aa_position)
+        text += (f"; aa {g_window['start']}-{g_window['end']}: "
+                 f"{c_window['count']} ClinVar P/LP vs {g_window['count']} gnomAD")
+        if g_total and c_total and g_window['count']:
+            enrichment = (c_window['count'] / c_total) / (g_window['count'] / g_total)
+            text += f" ({enrichment:.1f}x the transcript ratio)"
+        if g_window['quantiles'] is not None:
+            text += f", gnomAD median {g_window['quantiles'][0.5]:.3f}"
+    return text
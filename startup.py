@@ -0,0 +1,94 @@
+"""
+Startup tasks run in the background, with their progress.
+
+The app submits its loading steps (gene index, VEP, ClinVar header, default
+gene) here and starts serving right away; the readiness endpoint and the UI
+report the progress. In blocking mode (gunicorn --preload, see wsgi.py) the
+tasks run inline instead, before the workers are forked.
+"""
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Time the process imported this module, the reference of the cold-start timings
+PROCESS_START = time.time()
+
+class StartupTasks:
+    """Named tasks with dependencies, run in a thread pool (or inline)."""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.background = False
+        self.first_byte_at = None
+        self._executor = None
+        self._events = {}
+        self._status = {}
+        self._lock = threading.Lock()
+
+    def start(self, background=True):
+        """Run the tasks submitted from now on in a thread pool (background) or inline."""
+        self.background = background
+        if background and self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='startup')
+
+    def submit(self, name, func, after=()):
+        """Run func once the `after` tasks are finished (successfully or not)."""
+        with self._lock:
+            self._events[name] = threading.Event()
+            self._status[name] = {'name': name, 'status': 'pending', 'seconds': None, 'error': None}
+        if self._executor is not None:
+            self._executor.submit(self._run, name, func, after)
+        else:
+            self._run(name, func, after)
+
+    def _run(self, name, func, after):
+        for dependency in after:
+            self.wait(dependency)
+        status = self._status[name]
+        status['status'] = 'running'
+        t0 = time.time()
+        try:
+            func()
+            status['status'] = 'done'
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Startup task {name} failed: {e}")
+            status['status'] = 'failed'
+            status['error'] = str(e)
+        finally:
+            status['seconds'] = round(time.time() - t0, 3)
+            status['finished_after_s'] = round(time.time() - PROCESS_START, 3)
+            self._events[name].set()
+
+    def wait(self, name, timeout=None):
+        """Block until a task is finished. Unknown tasks count as finished."""
+        event = self._events.get(name)
+        return event.wait(timeout) if event is not None else True
+
+    def finished(self, names=None):
+        """True if all the tasks (or the given ones) are finished."""
+        names = self._events.keys() if names is None else names
+        return all(name in self._events and self._events[name].is_set() for name in names)
+
+    def succeeded(self, names):
+        """True if the given tasks all finished without error."""
+        return self.finished(names) and all(self._status[name]['status'] == 'done' for name in names)
+
+    def progress(self):
+        """Status, duration and error of every task, in submission order."""
+        with self._lock:
+            return [dict(status) for status in self._status.values()]
+
+    def record_first_byte(self):
+        """Remember (and report) when the first response was sent."""
+        if self.first_byte_at is None:
+            self.first_byte_at = time.time()
+            print(f"Cold start: first byte served {self.first_byte_at - PROCESS_START:.2f}s after start")
+
+    def timings(self):
+        """Cold-start timings in seconds since the process start."""
+        return {
+            'uptime_s': round(time.time() - PROCESS_START, 3),
+            'first_byte_after_s': round(self.first_byte_at - PROCESS_START, 3) if self.first_byte_at else None,
+        }
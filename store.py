@@ -0,0 +1,325 @@
+"""
+Columnar per-gene store compiled from the annotated gnomAD and ClinVar VCFs.
+
+Layout: <store_dir>/<GENE>/<source>/ holds one .npy file per column plus a
+meta.json with the row count and the category tables of the coded columns,
+and summary.npz with the score distributions (see score_summary.py).
+Loading a gene only reads (memory-maps) these files and never opens the VCFs.
+A source compiled for every gene (compile --all) is marked complete in
+<store_dir>/_metadata/<source>_complete.json: its genes without rows have no
+partition, and are loaded as empty without reading the VCF.
+
+Usage:
+    python store.py compile --gnomad gnomad.vcf.gz --clinvar clinvar.vcf.gz \
+        --gene-coord gene_coord.csv.gz --out store/ --genes SCN1A TTN
+    python store.py summarize --out store/
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from gene_index import VariantIndex
+from metadata import load_metadata
+from metrics import LATENCY
+from score_summary import ScoreSummary
+from variants import COMPACT_COLUMNS, load_gene_coord, parse_gene_variants_region
+
+# Version 2: columns in the compact schema (uint32 counts, float32 scores)
+STORE_VERSION = 2
+SOURCES = ('gnomad', 'clinvar')
+
+INT_COLUMNS = ['pos', 'aa_position']
+COUNT_COLUMNS = ['AC_joint', 'AC_genomes', 'nhomalt_joint', 'nhomalt_genomes']
+SCORE_COLUMNS = ['REVEL', 'am_pathogenicity', 'cadd_v1.7', 'MPC', 'MISTIC_score', 'popEVE']
+# Low-cardinality strings, stored as integer codes into a category table (the
+# smallest integer type pandas uses for the codes, so loading does not copy them)
+CATEGORY_COLUMNS = ['chrom', 'transcript', 'biotype', 'MISTIC_pred']
+# Free strings, stored as fixed-width unicode arrays
+STRING_COLUMNS = ['ref', 'alt', 'aa_change']
+
+def gene_dir(store_dir, gene_symbol, source):
+    """Directory holding the columns of one gene for one source."""
+    return os.path.join(store_dir, gene_symbol, source)
+
+def has_partition(store_dir, gene_symbol, source):
+    """True if the store holds the columns of the gene for this source."""
+    if not store_dir:
+        return False
+    return os.path.exists(os.path.join(gene_dir(store_dir, gene_symbol, source), 'meta.json'))
+
+def complete_path(store_dir, source):
+    """Marker of a source compiled for every gene of the gene coordinates."""
+    return os.path.join(store_dir, '_metadata', f"{source}_complete.json")
+
+def is_complete(store_dir, source):
+    """True if every gene has been compiled for this source (missing partitions have no rows)."""
+    return bool(store_dir) and os.path.exists(complete_path(store_dir, source))
+
+def mark_complete(store_dir, source, source_vcf=None, complete=True):
+    """Write (or remove, complete=False) the complete marker of a source."""
+    path = complete_path(store_dir, source)
+    if not complete:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump({'version': STORE_VERSION, 'source': source,
+                   'source_vcf': os.path.abspath(source_vcf) if source_vcf else None,
+                   'compiled_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+    os.replace(tmp, path)
+
+def has_gene(store_dir, gene_symbol, source):
+    """True if the gene has been compiled for this source (possibly without rows)."""
+    return has_partition(store_dir, gene_symbol, source) or is_complete(store_dir, source)
+
+def list_genes(store_dir):
+    """Sorted list of the genes with a partition in the store."""
+    if not store_dir or not os.path.isdir(store_dir):
+        return []
+    return sorted(
+        g for g in os.listdir(store_dir)
+        if any(has_partition(store_dir, g, source) for source in SOURCES)
+    )
+
+def frame_to_columns(df):
+    """
+    Convert a parsed variant DataFrame to typed numpy columns.
+    Returns (columns, categories) where categories maps each coded column
+    to its list of values.
+    """
+    n = len(df)
+    columns = {}
+    categories = {}
+    for col in INT_COLUMNS:
+        values = df[col] if col in df.columns else pd.Series(0, index=df.index)
+        columns[col] = pd.to_numeric(values, errors='coerce').fillna(0).to_numpy(dtype=np.int32)
+    for col in COUNT_COLUMNS:
+        values = df[col] if col in df.columns else pd.Series(0, index=df.index)
+        columns[col] = pd.to_numeric(values, errors='coerce').fillna(0).clip(lower=0).to_numpy(dtype=np.uint32)
+    for col in SCORE_COLUMNS:
+        values = df[col] if col in df.columns else pd.Series(np.nan, index=df.index)
+        columns[col] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float32)
+    for col in CATEGORY_COLUMNS:
+        values = df[col] if col in df.columns else pd.Series([None] * n, index=df.index)
+        cat = pd.Categorical(values.where(values.notna(), None))
+        columns[col] = np.asarray(cat.codes)
+        categories[col] = [str(c) for c in cat.categories]
+    for col in STRING_COLUMNS:
+        values = df[col].astype(str).tolist() if col in df.columns else []
+        columns[col] = np.array(values, dtype=str) if n else np.array([], dtype='<U1')
+    return columns, categories
+
+def columns_to_frame(columns, categories):
+    """Rebuild a variant DataFrame (compact schema, see variants.compact_variants) from stored columns."""
+    data = {}
+    for col in COMPACT_COLUMNS:
+        if col in CATEGORY_COLUMNS:
+            data[col] = pd.Categorical.from_codes(np.asarray(columns[col]), categories[col])
+        else:
+            data[col] = np.asarray(columns[col])
+    # copy=False keeps the numeric columns and the codes on the memory-mapped arrays
+    return pd.DataFrame(data, columns=COMPACT_COLUMNS, copy=False)
+
+def write_gene(store_dir, gene_symbol, source, df, source_vcf=None):
+    """
+    Write one gene/source partition. The partition is written to a temporary
+    directory and swapped in, so readers never see a half-written gene.
+    """
+    target = gene_dir(store_dir, gene_symbol, source)
+    tmp = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    # Rows are stored in VariantIndex order, so that loading does not re-sort
+    # (and copy) the memory-mapped columns
+    if not df.empty:
+        df = df.sort_values(['transcript', 'aa_position'], kind='stable')
+    columns, categories = frame_to_columns(df)
+    for col, values in columns.items():
+        np.save(os.path.join(tmp, f"{col}.npy"), values)
+    ScoreSummary.from_index(VariantIndex(df)).save(os.path.join(tmp, 'summary.npz'))
+
+    meta = {
+        'version': STORE_VERSION,
+        'gene': gene_symbol,
+        'source': source,
+        'n_rows': len(df),
+        'categories': categories,
+        'source_vcf': os.path.abspath(source_vcf) if source_vcf else None,
+        'source_mtime': os.path.getmtime(source_vcf) if source_vcf and os.path.exists(source_vcf) else None,
+        'compiled_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    old = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.rename(target, old)
+    os.rename(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+
+def read_meta(store_dir, gene_symbol, source):
+    """Read the meta.json of a gene/source partition."""
+    with open(os.path.join(gene_dir(store_dir, gene_symbol, source), 'meta.json')) as f:
+        return json.load(f)
+
+def data_stamp(store_dir, gene_symbol, source, vcf_file):
+    """
+    Identity of the data a gene is loaded from: its partition's meta.json
+    (rewritten at each compile) when compiled, else the complete marker of
+    the source, else the VCF. Path, size and mtime of that file, or None when
+    none exists.
+    """
+    if has_partition(store_dir, gene_symbol, source):
+        path = os.path.join(gene_dir(store_dir, gene_symbol, source), 'meta.json')
+    elif is_complete(store_dir, source):
+        path = complete_path(store_dir, source)
+    elif vcf_file and os.path.exists(vcf_file):
+        path = vcf_file
+    else:
+        return None
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+@LATENCY.timed('store_load')
+def load_gene(store_dir, gene_symbol, source, mmap_mode='r'):
+    """
+    Load a compiled gene as a DataFrame. Columns are memory-mapped,
+    so the cost is a file read of only this gene's arrays. A gene without a
+    partition in a complete source has no rows.
+    """
+    path = gene_dir(store_dir, gene_symbol, source)
+    if not has_partition(store_dir, gene_symbol, source) and is_complete(store_dir, source):
+        return columns_to_frame(*frame_to_columns(pd.DataFrame()))
+    meta = read_meta(store_dir, gene_symbol, source)
+    if meta.get('version') not in (1, STORE_VERSION):
+        raise ValueError(
+            f"Store for {gene_symbol}/{source} has version {meta.get('version')}, "
+            f"expected {STORE_VERSION}. Recompile with `python store.py compile`."
+        )
+    columns = {
+        col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode=mmap_mode)
+        for col in INT_COLUMNS + COUNT_COLUMNS + SCORE_COLUMNS + CATEGORY_COLUMNS + STRING_COLUMNS
+    }
+    if meta['version'] == 1:
+        # int32 counts and float64 scores, converted at indexing (so not memory-mapped)
+        print(f"{gene_symbol}/{source} was compiled with store version 1, recompile it to memory-map "
+              f"the compact columns")
+    return columns_to_frame(columns, meta['categories'])
+
+def load_summary(store_dir, gene_symbol, source):
+    """
+    Score distribution summary of a compiled gene, or None (not compiled,
+    compiled before summaries existed, or with other window parameters).
+    """
+    if not store_dir:
+        return None
+    path = os.path.join(gene_dir(store_dir, gene_symbol, source), 'summary.npz')
+    if not os.path.exists(path):
+        return None
+    return ScoreSummary.load(path)
+
+def summarize_store(store_dir):
+    """(Re)write the score summaries of every compiled gene, without the VCFs."""
+    t0 = time.time()
+    genes = list_genes(store_dir)
+    for i, gene_symbol in enumerate(genes, 1):
+        for source in SOURCES:
+            if not has_partition(store_dir, gene_symbol, source):
+                continue
+            summary = ScoreSummary.from_index(VariantIndex(load_gene(store_dir, gene_symbol, source)))
+            path = os.path.join(gene_dir(store_dir, gene_symbol, source), 'summary.npz')
+            tmp = f"{path}.tmp-{os.getpid()}.npz"
+            summary.save(tmp)
+            os.replace(tmp, path)
+            print(f"[{i}/{len(genes)}] {gene_symbol} {source}: {len(summary.keys)} transcript/score summaries")
+    print(f"Summarized {len(genes)} genes in {time.time() - t0:.1f}s")
+
+def load_or_parse(store_dir, gene_symbol, source, vcf_file, gene_coord):
+    """
+    Load a gene from the store if it has been compiled, otherwise parse the VCF region.
+    """
+    if has_gene(store_dir, gene_symbol, source):
+        print(f"Loading {gene_symbol} {source} variants from store {store_dir}...")
+        return load_gene(store_dir, gene_symbol, source)
+    return parse_gene_variants_region(vcf_file, gene_coord, gene_symbol)
+
+def compile_gene(store_dir, gene_symbol, source, vcf_file, gene_coord):
+    """Parse one gene region from a VCF and write it to the store."""
+    df = parse_gene_variants_region(vcf_file, gene_coord, gene_symbol)
+    write_gene(store_dir, gene_symbol, source, df, source_vcf=vcf_file)
+    return len(df)
+
+def compile_store(store_dir, gene_coord, genes, gnomad_vcf=None, clinvar_vcf=None):
+    """
+    Compile the given genes from the gnomAD and/or ClinVar VCFs into the store.
+    Genes that cannot be resolved or parsed are reported and skipped.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    vcfs = {'gnomad': gnomad_vcf, 'clinvar': clinvar_vcf}
+    # Header metadata (date, versions) cached next to the compiled genes
+    for source, vcf_file in vcfs.items():
+        if vcf_file:
+            load_metadata(vcf_file, source, store_dir)
+    failed = []
+    t0 = time.time()
+    for i, gene_symbol in enumerate(genes, 1):
+        for source, vcf_file in vcfs.items():
+            if not vcf_file:
+                continue
+            try:
+                n = compile_gene(store_dir, gene_symbol, source, vcf_file, gene_coord)
+                print(f"[{i}/{len(genes)}] {gene_symbol} {source}: {n} rows")
+            except Exception as e:
+                print(f"[{i}/{len(genes)}] {gene_symbol} {source}: FAILED ({e})")
+                failed.append((gene_symbol, source))
+    print(f"Compiled {len(genes)} genes into {store_dir} in {time.time() - t0:.1f}s "
+          f"({len(failed)} failures)")
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile annotated VCFs into a per-gene columnar store.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('compile', help="Compile genes from the gnomAD/ClinVar VCFs")
+    p.add_argument('--gnomad', help="gnomad_ms.fully_annotated.vcf.gz")
+    p.add_argument('--clinvar', help="clinvar_plp_ms.fully_annotated.vcf.gz")
+    p.add_argument('--gene-coord', required=True, help="gene_coord.csv.gz or its index (see gene_resolver.py)")
+    p.add_argument('--out', required=True, help="Store directory")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--genes', nargs='+', help="HGNC symbols to compile")
+    group.add_argument('--all', action='store_true',
+                       help="Compile every gene of gene_coord, sharded over the genome (see compile_genome.py)")
+    p.add_argument('-j', '--jobs', type=int, default=None, help="Worker processes for --all (default: all cores)")
+    p.add_argument('--restart', action='store_true',
+                   help="With --all, discard the checkpoint of an interrupted run instead of resuming it")
+
+    p = sub.add_parser('summarize', help="Rewrite the score summaries of the compiled genes")
+    p.add_argument('--out', required=True, help="Store directory")
+
+    args = parser.parse_args(argv)
+    if args.command == 'compile':
+        if not args.gnomad and not args.clinvar:
+            parser.error("at least one of --gnomad/--clinvar is required")
+        if args.all:
+            from compile_genome import compile_genome
+            failed = compile_genome(args.out, args.gene_coord, gnomad_vcf=args.gnomad,
+                                    clinvar_vcf=args.clinvar, jobs=args.jobs, restart=args.restart)
+            return 1 if failed else 0
+        gene_coord = load_gene_coord(args.gene_coord)
+        failed = compile_store(args.out, gene_coord, args.genes,
+                               gnomad_vcf=args.gnomad, clinvar_vcf=args.clinvar)
+        return 1 if failed else 0
+    if args.command == 'summarize':
+        summarize_store(args.out)
+        return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from cyvcf2 import VCF
+
+from gene_resolver import load_gene_resolver
+from metrics import LATENCY
+
+# Column order of the DataFrames built by parse_variant_record
+VARIANT_COLUMNS = [
+    'chrom', 'pos', 'ref', 'alt', 'gene', 'transcript', 'biotype',
+    'aa_position', 'aa_change', 'AC_joint', 'AC_genomes', 'nhomalt_joint',
+    'nhomalt_genomes', 'REVEL', 'am_pathogenicity', 'cadd_v1.7', 'MPC',
+    'MISTIC_score', 'MISTIC_pred', 'popEVE'
+]
+# INFO fields copied to every transcript row, with their default when absent
+COUNT_FIELDS = ['AC_joint', 'AC_genomes', 'nhomalt_joint', 'nhomalt_genomes']
+SCORE_FIELDS = ['REVEL', 'am_pathogenicity', 'cadd_v1.7', 'MPC', 'MISTIC_score', 'popEVE']
+# Compact in-memory schema of the loaded tables (compact_variants): one gene
+# per table, so no gene column; low-cardinality strings as categories
+COMPACT_COLUMNS = [col for col in VARIANT_COLUMNS if col != 'gene']
+CATEGORY_FIELDS = ['chrom', 'transcript', 'biotype', 'MISTIC_pred']
+POSITION_FIELDS = ['pos', 'aa_position']
+
+def load_gene_coord(gene_coord_file):
+    """
+    Load the gene coordinates (conventional chromosomes only) as a GeneResolver,
+    from gene_coord.csv.gz or its prebuilt index (see gene_resolver.py).
+    """
+    return load_gene_resolver(gene_coord_file)
+
+def get_gene_coordinates(gene_coord, gene_symbol):
+    """
+    Get chromosome and coordinates for a specific gene (its first locus)
+    """
+    return gene_coord.regions(gene_symbol)[0]
+
+def to_float(value):
+    """Safely convert a value to float, returning np.nan on failure."""
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+def parse_info_field(info_str):
+    """Parses a VCF INFO string into a dictionary."""
+    info_dict = {}
+    for item in info_str.split(';'):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            info_dict[key] = value
+        else:
+            info_dict[item] = True
+    return info_dict
+
+def parse_variant_record(variant, gene_symbol, source_type="vcf"):
+    """
+    Helper function to parse a single variant record (from cyvcf2 or a dictionary).
+    Returns a list of variant data dictionaries (one for each relevant transcript).
+    """
+    parsed_variants = []
+
+    if source_type == "vcf":  # From cyvcf2
+        info_dict = variant.INFO
+        chrom, pos, ref, alt = variant.CHROM, variant.POS, variant.REF, ','.join(variant.ALT)
+    else:  # From our custom row parser
+        info_dict = variant  # The dict itself is the info
+        chrom, pos, ref, alt = variant['chrom'], variant['pos'], variant['ref'], variant['alt']
+
+    bcsq_string = info_dict.get('BCSQ')
+    if bcsq_string is None:
+        return []
+
+    for entry in bcsq_string.split(','):
+        fields = entry.split('|')
+        if len(fields) < 6:
+            continue
+
+        consequence, entry_gene, entry_transcript, biotype, strand, aa_change = fields[0:6]
+
+        if consequence != 'missense' or entry_gene != gene_symbol or not aa_change:
+            continue
+
+        match = re.match(r'(\d+)', aa_change)
+        if not match:
+            continue
+
+        aa_position = int(match.group(1))
+
+        variant_data = {
+            'chrom': chrom, 'pos': pos, 'ref': ref, 'alt': alt,
+            'gene': entry_gene, 'transcript': entry_transcript, 'biotype': biotype,
+            'aa_position': aa_position, 'aa_change': aa_change,
+            'AC_joint': info_dict.get('AC_joint', 0),
+            'AC_genomes': info_dict.get('AC_genomes', 0),
+            'nhomalt_joint': info_dict.get('nhomalt_joint', 0),
+            'nhomalt_genomes': info_dict.get('nhomalt_genomes', 0),
+            'REVEL': info_dict.get('REVEL'),
+            'am_pathogenicity': info_dict.get('am_pathogenicity'),
+            'cadd_v1.7': info_dict.get('cadd_v1.7'),
+            'MPC': info_dict.get('MPC'),
+            # === NEW SCORES ADDED ===
+            'MISTIC_score': info_dict.get('MISTIC_score'),
+            'MISTIC_pred': info_dict.get('MISTIC_pred'),
+            'popEVE': info_dict.get('popEVE')
+        }
+        parsed_variants.append(variant_data)
+
+    return parsed_variants
+
+RECORD_FIELDS = ['BCSQ'] + COUNT_FIELDS + SCORE_FIELDS + ['MISTIC_pred']
+
+def compact_variants(df):
+    """
+    A variant table in the compact schema: categorical chrom, transcript,
+    biotype and MISTIC_pred, int32 positions, uint32 counts (missing as 0),
+    float32 scores, and no gene column. Columns already in their compact dtype
+    (e.g. memory-mapped from the store) are kept without a copy.
+    """
+    if df is None or len(df.columns) == 0:
+        return df
+    data = {}
+    for col in COMPACT_COLUMNS:
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if col in CATEGORY_FIELDS:
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype('category')
+        elif col in POSITION_FIELDS:
+            if values.dtype != np.int32:
+                values = pd.to_numeric(values, errors='coerce').fillna(0).astype(np.int32)
+        elif col in COUNT_FIELDS:
+            if values.dtype != np.uint32:
+                values = pd.to_numeric(values, errors='coerce').fillna(0).clip(lower=0).astype(np.uint32)
+        elif col in SCORE_FIELDS:
+            if values.dtype != np.float32:
+                values = pd.to_numeric(values, errors='coerce').astype(np.float32)
+        data[col] = values
+    return pd.DataFrame(data, columns=[col for col in COMPACT_COLUMNS if col in data], copy=False)
+
+def read_region_records(vcf_file, regions, gene_symbol):
+    """
+    Read the raw fields needed for parsing from every record of the regions.
+    Returns a dict of per-record lists. Records whose BCSQ has no missense
+    entry for the gene are skipped before any other INFO field is decoded.
+    """
+    vcf = VCF(vcf_file)
+    records = (variant for region in regions for variant in vcf(region))
+    return collect_records(records, f"missense|{gene_symbol}|")
+
+def collect_records(records, needle, stats=None):
+    """
+    Per-record lists of the fields of the records whose BCSQ contains needle
+    (e.g. "missense|SCN1A|"). stats, if given, gets the number of records read.
+    """
+    fields = RECORD_FIELDS
+    columns = {name: [] for name in ['chrom', 'pos', 'ref', 'alt'] + fields}
+    n_read = 0
+    for variant in records:
+        n_read += 1
+        info = variant.INFO
+        bcsq = info.get('BCSQ')
+        if bcsq is None or needle not in bcsq:
+            continue
+        columns['chrom'].append(variant.CHROM)
+        columns['pos'].append(variant.POS)
+        columns['ref'].append(variant.REF)
+        columns['alt'].append(','.join(variant.ALT))
+        columns['BCSQ'].append(bcsq)
+        for name in fields[1:]:
+            columns[name].append(info.get(name))
+    if stats is not None:
+        stats['records'] = stats.get('records', 0) + n_read
+    return columns
+
+def explode_bcsq(bcsq, gene_symbol):
+    """
+    Vectorized BCSQ parsing with Arrow compute kernels: split every record's BCSQ
+    into entries and keep the missense entries of the gene with a numeric
+    amino acid change (same rules as parse_variant_record).
+    Returns (record_index, transcript, biotype, aa_change, aa_position) arrays,
+    one element per kept entry.
+    """
+    record_index, _, transcript, biotype, aa_change, aa_position = \
+        explode_missense(bcsq, f"missense|{gene_symbol}|")
+    return record_index, transcript, biotype, aa_change, aa_position
+
+def explode_missense(bcsq, prefix="missense|"):
+    """
+    explode_bcsq for the entries starting with prefix, by default the missense
+    entries of every gene. Returns (record_index, gene, transcript, biotype,
+    aa_change, aa_position) arrays, one element per kept entry.
+    """
+    lists = pc.split_pattern(pa.array(bcsq, type=pa.string()), ',')
+    entries = pc.list_flatten(lists)
+    record_index = pc.list_parent_indices(lists)
+
+    # Cheap prefix test on the whole column before splitting the kept entries
+    keep = pc.starts_with(entries, prefix)
+    entries = pc.filter(entries, keep)
+    record_index = pc.filter(record_index, keep)
+
+    fields = pc.split_pattern(entries, '|')
+    keep = pc.greater_equal(pc.list_value_length(fields), 6)
+    fields = pc.filter(fields, keep)
+    record_index = pc.filter(record_index, keep)
+
+    aa_change = pc.list_element(fields, 5)
+    aa_digits = pc.struct_field(pc.extract_regex(aa_change, r'^(?P<pos>\d+)'), [0])
+    keep = pc.is_valid(aa_digits)
+    fields = pc.filter(fields, keep)
+
+    return (
+        pc.filter(record_index, keep).to_numpy(),
+        pc.list_element(fields, 1),
+        pc.list_element(fields, 2),
+        pc.list_element(fields, 3),
+        pc.filter(aa_change, keep),
+        pc.cast(pc.filter(aa_digits, keep), pa.int64()).to_numpy(),
+    )
+
+def _record_column(values, numeric=False, default=None):
+    """Per-record field values as a numpy array (float64 when numeric)."""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    if default is not None:
+        array[pd.isna(array)] = default
+    if numeric:
+        return pd.to_numeric(array, errors='coerce')
+    return array
+
+def variant_frame(records, idx, gene, transcript, biotype, aa_change, aa_position):
+    """
+    Variant DataFrame (VARIANT_COLUMNS) of exploded BCSQ entries: the record
+    fields (collect_records) are broadcast to the entries by record index.
+    """
+    data = {
+        'chrom': _record_column(records['chrom'])[idx],
+        'pos': np.asarray(records['pos'], dtype=np.int64)[idx],
+        'ref': _record_column(records['ref'])[idx],
+        'alt': _record_column(records['alt'])[idx],
+        'gene': gene,
+        'transcript': transcript.to_numpy(zero_copy_only=False),
+        'biotype': biotype.to_numpy(zero_copy_only=False),
+        'aa_position': aa_position,
+        'aa_change': aa_change.to_numpy(zero_copy_only=False),
+        'MISTIC_pred': _record_column(records['MISTIC_pred'])[idx],
+    }
+    for name in COUNT_FIELDS:
+        data[name] = _record_column(records[name], numeric=True, default=0)[idx]
+    for name in SCORE_FIELDS:
+        data[name] = _record_column(records[name], numeric=True).astype(np.float64)[idx]
+    return pd.DataFrame(data, columns=VARIANT_COLUMNS)
+
+def parse_gene_variants_region(vcf_file, gene_coord, gene_symbol):
+    """
+    Parse VCF file for a specific gene using coordinates (every locus of the
+    gene, from the GeneResolver gene_coord).
+    The INFO fields of the region are read into per-record arrays, the BCSQ
+    entries are exploded and filtered column-wise (explode_bcsq), and the
+    record fields are broadcast to the kept entries by index. The rows are the
+    same as running parse_variant_record on every record.
+    """
+    print(f"Looking up {gene_symbol} coordinates...")
+    regions = [f"{chrom}:{start}-{end}" for chrom, start, end in gene_coord.regions(gene_symbol)]
+    print(f"Found {gene_symbol} at {', '.join(regions)}")
+    print(f"Querying VCF region in {vcf_file}...")
+
+    with LATENCY.span('vcf_region_query'):
+        records = read_region_records(vcf_file, regions, gene_symbol)
+    with LATENCY.span('bcsq_parsing'):
+        idx, transcript, biotype, aa_change, aa_position = explode_bcsq(records['BCSQ'], gene_symbol)
+    with LATENCY.span('dataframe_construction'):
+        df = variant_frame(records, idx, np.full(len(idx), gene_symbol, dtype=object),
+                           transcript, biotype, aa_change, aa_position)
+
+    print(f"Found {len(df)} {gene_symbol} missense variants in {vcf_file}")
+    return df
+
+def parse_vcf_row(vcf_row_string, gene_symbol):
+    """
+    Parses a single tab-separated VCF row string.
+    """
+    try:
+        print("Parsing custom VCF row string...")
+        fields = vcf_row_string.strip().split('\t')
+        if len(fields) < 8:
+            print("Warning: Custom VCF row is malformed. Skipping.")
+            return pd.DataFrame()
+
+        chrom, pos, _, ref, alt, _, _, info_str = fields[0:8]
+        info_dict = parse_info_field(info_str)
+
+        # Add required fields for the parser
+        info_dict['chrom'] = chrom
+        info_dict['pos'] = int(pos)
+        info_dict['ref'] = ref
+        info_dict['alt'] = alt
+
+        parsed_variants = parse_variant_record(info_dict, gene_symbol, source_type="dict")
+        print(f"Found {len(parsed_variants)} missense variants in custom row.")
+        return pd.DataFrame(parsed_variants)
+    except Exception as e:
+        print(f"Error parsing custom VCF row: {e}")
+        return pd.DataFrame()
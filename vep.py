@@ -0,0 +1,325 @@
+"""
+Ensembl VEP client: batch HGVS annotation with a persistent response cache.
+
+Lookups go through the batch POST vep/human/hgvs endpoint (up to 200 HGVS
+per call) over a pooled session with retry/backoff and rate-limit handling.
+Every successful result is stored in a SQLite cache keyed by a hash of the
+HGVS notation and the query options, so a variant is only ever fetched once
+and cached lookups work offline.
+
+Usage:
+    python vep.py --cache vep_cache.sqlite "NM_001165963.4(SCN1A):c.1060G>C" ...
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ENSEMBL_SERVER = "https://rest.ensembl.org"
+VEP_BATCH_SIZE = 200  # maximum number of HGVS notations per POST accepted by Ensembl
+# Same options as the original single-variant GET query
+DEFAULT_OPTIONS = {
+    'mane': 1, 'canonical': 1, 'REVEL': 1, 'AlphaMissense': 1, 'CADD': 1,
+    'vcf_string': 1, 'fields': 'transcript_consequences'
+}
+
+def cache_key(hgvs, options):
+    """Content address of a query: sha256 of the HGVS notation and the sorted options."""
+    payload = json.dumps({'hgvs': hgvs, 'options': options}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class VepCache:
+    """Persistent SQLite store of VEP results, keyed by cache_key()."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vep_cache ("
+            " key TEXT PRIMARY KEY, hgvs TEXT, options TEXT, response TEXT, created REAL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """Return {key: result} for the keys present in the cache."""
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, response FROM vep_cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found.update((key, json.loads(response)) for key, response in rows)
+        return found
+
+    def put_many(self, entries):
+        """Store (key, hgvs, options, result) tuples."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vep_cache VALUES (?, ?, ?, ?, ?)",
+                [(key, hgvs, json.dumps(options, sort_keys=True), json.dumps(result), now)
+                 for key, hgvs, options, result in entries]
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vep_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class VepClient:
+    """
+    Batch VEP HGVS client. `server` can point to a local stub for testing,
+    `offline=True` answers from the cache only.
+    """
+
+    def __init__(self, server=ENSEMBL_SERVER, cache_path=None, options=None,
+                 batch_size=VEP_BATCH_SIZE, max_retries=5, backoff_factor=1.0,
+                 timeout=60, pool_size=4, max_requests_per_second=15, offline=False):
+        self.server = server.rstrip('/')
+        self.options = dict(DEFAULT_OPTIONS if options is None else options)
+        self.batch_size = min(batch_size, VEP_BATCH_SIZE)
+        self.timeout = timeout
+        self.offline = offline
+        self.cache = VepCache(cache_path) if cache_path else None
+        self.min_interval = 1.0 / max_requests_per_second if max_requests_per_second else 0
+        self._last_request = 0.0
+        self._throttle_lock = threading.Lock()
+
+        # Retries on connection errors, 5xx and 429 (honouring Retry-After)
+        retry = Retry(
+            total=max_retries, backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True, raise_on_status=False
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'Accept': 'application/json'})
+
+    def _throttle(self):
+        # Stay under the Ensembl per-second request limit
+        with self._throttle_lock:
+            wait = self._last_request + self.min_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request = time.time()
+
+    def _post_batch(self, hgvs_list):
+        """POST one batch to vep/human/hgvs and return the list of results."""
+        self._throttle()
+        body = dict(self.options, hgvs_notations=hgvs_list)
+        r = self.session.post(f"{self.server}/vep/human/hgvs", json=body, timeout=self.timeout)
+        # The hourly quota is reported in headers: wait for the reset when exhausted
+        if r.headers.get('X-RateLimit-Remaining') == '0':
+            reset = float(r.headers.get('X-RateLimit-Reset', 1))
+            print(f"VEP rate limit reached, sleeping {reset:.0f}s")
+            time.sleep(reset)
+        r.raise_for_status()
+        return r.json()
+
+    def annotate(self, hgvs_list):
+        """
+        Annotate HGVS notations. Returns {hgvs: result} where result is the VEP
+        record of that notation, or None if it could not be annotated.
+        """
+        hgvs_list = list(dict.fromkeys(hgvs_list))
+        keys = {hgvs: cache_key(hgvs, self.options) for hgvs in hgvs_list}
+        cached = self.cache.get_many(keys.values()) if self.cache is not None else {}
+        results = {hgvs: cached.get(keys[hgvs]) for hgvs in hgvs_list}
+        missing = [hgvs for hgvs in hgvs_list if results[hgvs] is None]
+        if cached:
+            print(f"VEP cache: {len(hgvs_list) - len(missing)}/{len(hgvs_list)} hits")
+        if self.offline:
+            if missing:
+                print(f"VEP offline mode: {len(missing)} notations not in cache")
+            return results
+
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            try:
+                records = self._post_batch(batch)
+            except requests.RequestException as e:
+                print(f"VEP request failed for {len(batch)} notations: {e}")
+                continue
+            # Results come back in any order, matched through their 'input' field
+            fetched = {rec.get('input'): rec for rec in records if rec.get('input') in keys}
+            results.update(fetched)
+            if self.cache is not None:
+                self.cache.put_many(
+                    (keys[hgvs], hgvs, self.options, rec) for hgvs, rec in fetched.items()
+                )
+        return results
+
+    def annotate_one(self, hgvs):
+        """Annotate a single HGVS notation, returning its VEP record or None."""
+        return self.annotate([hgvs]).get(hgvs)
+
+    def close(self):
+        """Close the HTTP session and the cache connection."""
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+def hgvs_gene(hgvs):
+    """Gene symbol of an HGVS notation like NM_001165963.4(SCN1A):c.1060G>C, or None."""
+    match = re.search(r'\(([^)]+)\)', hgvs)
+    return match.group(1) if match else None
+
+def get_best_score(transcript_consequences, score_key, target_gene):
+    """
+    Finds the best score from a list of transcript consequences.
+
+    Logic:
+    1. Collect all available scores for the given score_key.
+    2. If there's only one unique score value, return it.
+    3. If there are multiple, return the one associated with the target_gene.
+    4. If none are found, or none match the target gene in a conflict, return None.
+    """
+    scores_with_genes = []
+    for tc in transcript_consequences:
+        if score_key in tc:
+            scores_with_genes.append({
+                'gene': tc.get('gene_symbol'),
+                'score': tc[score_key]
+            })
+
+    if not scores_with_genes:
+        return None
+
+    # Use a string representation for uniqueness check, handles dicts like AlphaMissense
+    unique_scores_str = {json.dumps(s['score']) for s in scores_with_genes}
+
+    if len(unique_scores_str) == 1:
+        return scores_with_genes[0]['score']
+    else:
+        # Conflict: multiple different scores exist. Prioritize the target gene.
+        for item in scores_with_genes:
+            if item['gene'] == target_gene:
+                return item['score']
+
+    # Fallback if multiple scores exist but none match the target gene
+    return None
+
+def vep_to_vcf_row(data, target_gene):
+    """
+    Build a BCSQ-annotated VCF row (same layout as the annotated gnomAD/ClinVar
+    VCFs) from one VEP result. Returns (vcf_row, vcf_string) or (None, None)
+    when the result has no vcf_string.
+    """
+    # Get ID from colocated variants if available
+    rsid = data.get('colocated_variants', [{}])[0].get('id', '.')
+
+    if not data.get('vcf_string'):
+        print("Warning: 'vcf_string' not found in the API result. Unable to determine REF/ALT.")
+        return None, None
+    # Split the string by the hyphen and unpack the parts.
+    chrom, pos, ref, alt = data['vcf_string'].split('-')
+
+    qual = '.'
+    filter_col = '.'
+
+    # --- Construct INFO Field ---
+    info_parts = []
+
+    # a) Build BCSQ tag
+    bcsq_entries = []
+    genomic_change = f"{pos}{ref}>{alt}"
+
+    for tc in data.get('transcript_consequences', []):
+        gene = tc.get('gene_symbol', '.')
+        transcript_id = tc.get('transcript_id', '.')
+        biotype = tc.get('biotype', '.')
+
+        is_protein_altering = 'amino_acids' in tc
+
+        for term in tc.get('consequence_terms', []):
+            base_entry = f"{term}|{gene}|{transcript_id}|{biotype}"
+            if term == "missense_variant":
+                base_entry = f"missense|{gene}|{transcript_id}|{biotype}"
+
+            if is_protein_altering:
+                strand = '+' if tc.get('strand') == 1 else '-'
+                aa_pos = tc.get('protein_start')
+                ref_aa, alt_aa = tc.get('amino_acids', '/').split('/')
+                protein_change = f"{aa_pos}{ref_aa}>{aa_pos}{alt_aa}"
+                full_entry = f"{base_entry}|{strand}|{protein_change}|{genomic_change}"
+                bcsq_entries.append(full_entry)
+            else:
+                bcsq_entries.append(base_entry)
+
+    if bcsq_entries:
+        info_parts.append("BCSQ=" + ",".join(bcsq_entries))
+
+    # b) Add other scores using smarter logic
+    all_tcs = data.get('transcript_consequences', [])
+
+    cadd_score = get_best_score(all_tcs, 'cadd_phred', target_gene)
+    if cadd_score is not None:
+        info_parts.append(f"cadd_v1.7={cadd_score}")
+
+    revel_score = get_best_score(all_tcs, 'revel', target_gene)
+    if revel_score is not None:
+        info_parts.append(f"REVEL={revel_score}")
+
+    am_score = get_best_score(all_tcs, 'alphamissense', target_gene)
+    if am_score is not None:
+        info_parts.append(f"am_pathogenicity={am_score.get('am_pathogenicity', '.')}")
+        info_parts.append(f"am_class={am_score.get('am_class', '.')}")
+
+    info_string = ";".join(info_parts)
+
+    # --- Assemble Final VCF Row ---
+    vcf_row = "\t".join(map(str, [chrom, pos, rsid, ref, alt, qual, filter_col, info_string]))
+    return vcf_row, data['vcf_string']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Annotate HGVS notations with Ensembl VEP (cached).")
+    parser.add_argument('hgvs', nargs='*', help="HGVS notations")
+    parser.add_argument('--file', help="File with one HGVS notation per line")
+    parser.add_argument('--cache', default=os.environ.get('VEP_CACHE', 'vep_cache.sqlite'),
+                        help="SQLite cache file (default: $VEP_CACHE or vep_cache.sqlite)")
+    parser.add_argument('--server', default=os.environ.get('VEP_SERVER', ENSEMBL_SERVER),
+                        help="VEP REST server, e.g. a local stub (default: $VEP_SERVER or Ensembl)")
+    parser.add_argument('--offline', action='store_true', help="Only answer from the cache")
+    args = parser.parse_args(argv)
+
+    hgvs_list = list(args.hgvs)
+    if args.file:
+        with open(args.file) as f:
+            hgvs_list += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not hgvs_list:
+        parser.error("no HGVS notation given")
+
+    client = VepClient(server=args.server, cache_path=args.cache, offline=args.offline)
+    results = client.annotate(hgvs_list)
+    n_failed = 0
+    for hgvs in hgvs_list:
+        result = results.get(hgvs)
+        vcf_row = vep_to_vcf_row(result, hgvs_gene(hgvs))[0] if result else None
+        if vcf_row is None:
+            n_failed += 1
+            print(f"{hgvs}\tNOT ANNOTATED")
+        else:
+            print(f"{hgvs}\t{vcf_row}")
+    return 1 if n_failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
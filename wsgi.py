@@ -0,0 +1,15 @@
+"""
+Production entry point for a WSGI server, e.g. with the settings of gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+The data is loaded by create_app() when this module is imported. With
+gunicorn's preload_app this happens once in the master process, and the
+workers share the loaded arrays copy-on-write instead of each reparsing the
+VCFs. The Dash debug mode and reloader are never enabled here.
+"""
+from app import create_app
+
+# Loaded in the foreground: gunicorn preloads this module in the master process
+app = create_app(background=False)
+server = app.server